@@ -0,0 +1,30 @@
+import os
+import zipfile
+from datetime import datetime, timezone
+from kyc_common.archive import ArchiveRejectedError
+from kyc_common.bulk import split_bulk_archive
+from kyc_common.idempotency import StageInProgressError, run_stage, upload_id
+
+env_table = os.environ["TABLE"]
+# order of the paid checks for every applicant of the batch
+check_mode = os.environ.get("CHECK_MODE", "parallel")
+
+def lambda_handler(event, context):
+    # records every applicant of a bulk archive and writes the items file the ProcessApplicants map reads
+    try:
+        print(event)
+
+        bucket = event['detail']['bucket']['name']
+        key = event['detail']['object']['key']
+        submitted_at = event.get("time", datetime.now(timezone.utc).isoformat())
+
+        # a re-delivered event gets the recorded batch instead of uploading and recording the applicants again
+        return run_stage("split", key, upload_id(event),
+                         lambda: split_bulk_archive(bucket, key, env_table, submitted_at, check_mode))
+
+    except StageInProgressError:
+        raise
+    except (ArchiveRejectedError, zipfile.BadZipFile) as e:
+        # fail the task so the state machine can route the rejected archive
+        print(f"Archive rejected: {str(e)}")
+        raise ArchiveRejectedError(str(e)) from e
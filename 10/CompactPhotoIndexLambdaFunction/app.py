@@ -0,0 +1,14 @@
+import os
+from kyc_common.phash import compact_segments
+
+env_bucket = os.environ["BUCKET"]
+
+def lambda_handler(event, context):
+    # merges the photo hashes CompareFaces wrote since the last run into one snapshot, which warm containers load whole
+    try:
+
+        return compact_segments(env_bucket)
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        raise
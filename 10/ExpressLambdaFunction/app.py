@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from kyc_common import clients
+from kyc_common.archive import ArchiveRejectedError, extract_application, unzipped_dir, unzipped_s3_prefix
+from kyc_common.checks import check_faces, details_cache, extract_details, faces_cache
+from kyc_common.details import parse_details
+from kyc_common.idempotency import StageInProgressError, run_stage, upload_id
+from kyc_common.images import normalize_application
+from kyc_common.metrics import emit_metrics
+from kyc_common.results import record_details_rejected, write_results_ddb
+
+env_table = os.environ["TABLE"]
+env_queue_url = os.environ.get("QUEUE_URL")
+unzip_mode = os.environ.get("UNZIP_MODE", "stream")
+
+# the two paid checks of an application run at the same time, on threads kept by warm containers
+check_executor = ThreadPoolExecutor(max_workers=2)
+
+def unzip_application(bucket, key, app_uuid):
+    # the same extraction and validation as the Unzip stage, the result is recorded like its output
+    file_digests, details_bytes = extract_application(bucket, key, app_uuid, unzip_mode)
+    digests = {
+        "selfie": file_digests.get(f'{app_uuid}_selfie.png'),
+        "license": file_digests.get(f'{app_uuid}_license.png'),
+    }
+
+    # invalid details stop the application before any paid check, like the DetailsInvalid state
+    try:
+        if details_bytes is None:
+            raise ValueError(f"Archive {key} has no {app_uuid}_details.csv")
+        return {"digests": digests, "details_valid": True, "details": parse_details(details_bytes)}
+    except ValueError as e:
+        print(f"Details rejected: {str(e)}")
+        return {"digests": digests, "details_valid": False, "details_error": str(e)}
+
+def run_checks(app_uuid, upload, bucket, details_dict, digests, images):
+    # Rekognition and Textract are called concurrently, so the slower call sets the latency
+    selfie_key = f'{unzipped_s3_prefix}{app_uuid}_selfie.png'
+    license_key = f'{unzipped_s3_prefix}{app_uuid}_license.png'
+    faces = check_executor.submit(run_stage, "faces", app_uuid, upload,
+                                  lambda: check_faces(app_uuid, bucket, license_key, selfie_key, digests, images))
+    details = check_executor.submit(run_stage, "details", app_uuid, upload,
+                                    lambda: extract_details(app_uuid, bucket, license_key, details_dict, digests, images))
+    return {**faces.result(), "LICENSE_DETAILS_MATCH": details.result()}
+
+def send_notification(notification):
+    clients.client("sqs").send_message(QueueUrl=env_queue_url, MessageBody=json.dumps(notification))
+
+def lambda_handler(event, context):
+    # runs the whole DocumentStateMachine for one application in a single invocation
+    try:
+        print(event)
+
+        bucket = event['detail']['bucket']['name']
+        key = event['detail']['object']['key']
+        app_uuid = os.path.basename(key).replace(".zip", "")
+        submitted_at = event.get("time", datetime.now(timezone.utc).isoformat())
+
+        # every stage is recorded in the stage table, so a retried or duplicated event skips the stages that finished
+        upload = upload_id(event)
+        application = run_stage("unzip", app_uuid, upload, lambda: unzip_application(bucket, key, app_uuid))
+        if not application["details_valid"]:
+            # the rejection is recorded and the customer notified, like the RecordDetailsInvalid state
+            reason = application.get("details_error", "details file failed validation")
+            run_stage("write", app_uuid, upload,
+                      lambda: record_details_rejected(env_table, app_uuid, reason, submitted_at))
+            return {"app_uuid": app_uuid, "details_valid": False}
+        details_dict = application["details"]
+
+        # the same NormalizeImages stage as the state machine, so the checks send the smaller images
+        images = run_stage("normalize", app_uuid, upload, lambda: normalize_application(bucket, app_uuid))
+
+        misses_before = faces_cache.stats["misses"] + details_cache.stats["misses"]
+        check_results = run_checks(app_uuid, upload, bucket, details_dict, application["digests"], images)
+        api_calls = faces_cache.stats["misses"] + details_cache.stats["misses"] - misses_before
+
+        # the same single write and license validation message as WriteToDynamo
+        run_stage("write", app_uuid, upload,
+                  lambda: write_results_ddb(env_table, app_uuid, details_dict, check_results, submitted_at))
+        notification = {"driver_license_id": details_dict["DOCUMENT_NUMBER"], "validation_override": True, "app_uuid": app_uuid}
+        if env_queue_url:
+            run_stage("send", app_uuid, upload, lambda: send_notification(notification))
+
+        emit_metrics({"CheckMode": "express"}, {"ChecksRun": sum(name.startswith("LICENSE_") for name in check_results), "ApiCalls": api_calls})
+        # measured from the upload, like the ApplicationLatency WriteToDynamo reports for the other modes
+        elapsed = datetime.now(timezone.utc) - datetime.fromisoformat(submitted_at)
+        emit_metrics({"CheckMode": "express"}, {"ApplicationLatency": elapsed.total_seconds() * 1000}, unit="Milliseconds")
+        return {**notification, "details_valid": True, **check_results}
+
+    except StageInProgressError:
+        # fail the invocation, so Lambda retries the event once the other invocation has recorded the stage
+        raise
+    except (ArchiveRejectedError, zipfile.BadZipFile) as e:
+        # retrying a rejected archive cannot succeed, so the invocation ends here
+        print(f"Archive rejected: {str(e)}")
+        return {"archive_rejected": True, "error": str(e)}
+    except Exception as e:
+        print(f"Error: {str(e)}")
+    finally:
+        faces_cache.emit_metrics()
+        details_cache.emit_metrics()
+        # clean up /tmp/unzipped
+        if os.path.exists(unzipped_dir):
+            shutil.rmtree(unzipped_dir)
@@ -0,0 +1 @@
+"Code shared by the KYC Lambda functions, deployed as the KycCommonLayer layer"
@@ -0,0 +1,322 @@
+"Extracts applicant archives from S3 into the unzip prefix, enforcing size limits and hashing every member"
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from kyc_common import clients
+
+unzipped_dir = "/tmp/unzipped/"
+unzipped_s3_prefix = "unzipped/"
+
+# archives bigger than this are spooled to /tmp instead of being held in memory
+spool_max_size = int(os.environ.get("SPOOL_MAX_SIZE", 32 * 1024 * 1024))
+# size of each range GET issued while reading the archive in "ranged" mode
+range_read_size = int(os.environ.get("RANGE_READ_SIZE", 1024 * 1024))
+# end of central directory record plus the longest comment zipfile searches for it
+range_tail_size = 22 + 65535
+# limits enforced before and while extracting, so one hostile upload cannot stall the container
+max_archive_size = int(os.environ.get("MAX_ARCHIVE_SIZE", 50 * 1024 * 1024))
+max_members = int(os.environ.get("MAX_MEMBERS", 10))
+max_member_size = int(os.environ.get("MAX_MEMBER_SIZE", 25 * 1024 * 1024))
+max_total_size = int(os.environ.get("MAX_TOTAL_SIZE", 60 * 1024 * 1024))
+max_compression_ratio = int(os.environ.get("MAX_COMPRESSION_RATIO", 100))
+# number of archive members uploaded at the same time
+upload_concurrency = int(os.environ.get("UPLOAD_CONCURRENCY", 4))
+
+_transfer_config = None
+
+
+def transfer_config():
+    # boto3.s3.transfer pulls in s3transfer, so it is only imported once a member is uploaded
+    global _transfer_config
+    if _transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+
+        _transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=2,
+        )
+    return _transfer_config
+
+
+class ArchiveRejectedError(Exception):
+    "Raised for archives that break the limits, the state machine catches it by name"
+
+
+def safe_member_name(name):
+    # zip names use "/" but archives written on windows may use "\\" or a drive letter too
+    if name.startswith(("/", "\\")) or (len(name) > 1 and name[1] == ":"):
+        return False
+    return ".." not in name.replace("\\", "/").split("/")
+
+
+def check_archive(zip_ref, key, member_limit=max_members, size_limit=max_total_size):
+    # validate the central directory before any member is decompressed
+    members = [member for member in zip_ref.infolist() if not member.is_dir()]
+    if len(members) > member_limit:
+        raise ArchiveRejectedError(f"Archive {key} has {len(members)} members, limit is {member_limit}")
+
+    total_size = 0
+    for member in members:
+        # members are uploaded under the unzip prefix by name, so a name must not leave it
+        if not safe_member_name(member.filename):
+            raise ArchiveRejectedError(f"Member {member.filename} has an absolute or parent directory path")
+        if member.file_size > max_member_size:
+            raise ArchiveRejectedError(f"Member {member.filename} is {member.file_size} bytes, limit is {max_member_size}")
+        if member.file_size > max(member.compress_size, 1) * max_compression_ratio:
+            raise ArchiveRejectedError(f"Member {member.filename} exceeds compression ratio {max_compression_ratio}")
+        total_size += member.file_size
+    if total_size > size_limit:
+        raise ArchiveRejectedError(f"Archive {key} expands to {total_size} bytes, limit is {size_limit}")
+
+    return members
+
+
+class ExtractionBudget:
+    # total decompressed bytes shared by every member of one archive
+
+    def __init__(self, size_limit=max_total_size):
+        self.size_limit = size_limit
+        self.remaining = size_limit
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+        with self.lock:
+            self.remaining -= size
+            if self.remaining < 0:
+                raise ArchiveRejectedError(f"Archive expanded past {self.size_limit} bytes")
+
+
+class GuardedReader:
+    # counts the bytes actually decompressed so the limits hold even if the headers lie,
+    # and hashes them so later stages can cache results by content
+
+    def __init__(self, stream, member, budget):
+        self.stream = stream
+        self.member = member
+        self.budget = budget
+        self.bytes_read = 0
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > min(self.member.file_size, max_member_size):
+            raise ArchiveRejectedError(f"Member {self.member.filename} decompressed past its declared size")
+        self.budget.consume(len(data))
+        self.digest.update(data)
+        return data
+
+
+def unzip_object(bucket, key):
+    # get the zip file name and set the local path
+    zip_name = os.path.basename(key)
+    zip_fullpath = f'/tmp/{zip_name}'
+
+    # download the zip file from S3
+    clients.s3().download_file(bucket, key, zip_fullpath)
+    try:
+        with zipfile.ZipFile(zip_fullpath, 'r') as zip_ref:
+            budget = ExtractionBudget()
+            for member in check_archive(zip_ref, key):
+                extract_member(zip_ref, member, budget)
+    finally:
+        os.remove(zip_fullpath)
+
+    # list all the files in the unzip prefix/folder
+    zipped_files = os.listdir(unzipped_dir)
+    return zipped_files
+
+
+def extract_member(zip_ref, member, budget):
+    # written through the same guard as the streamed members, so a header that lies cannot fill /tmp
+    file_path = os.path.join(unzipped_dir, member.filename)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with zip_ref.open(member) as member_stream, open(file_path, 'wb') as extracted_file:
+        shutil.copyfileobj(GuardedReader(member_stream, member, budget), extracted_file)
+
+
+def upload_member(file_name, upload):
+    # upload a single file and report how long it took
+    start = time.perf_counter()
+    file_digest = upload()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"uploaded {file_name} in {elapsed_ms:.1f} ms")
+    return file_digest
+
+
+def upload_members(uploads, concurrency=None):
+    # run the uploads concurrently, raising the first error once they have all finished
+    with ThreadPoolExecutor(max_workers=concurrency or upload_concurrency) as executor:
+        futures = {file_name: executor.submit(upload_member, file_name, upload) for file_name, upload in uploads}
+    # map every uploaded file to the sha256 of its content
+    return {file_name: future.result() for file_name, future in futures.items()}
+
+
+def upload_extracted_file(bucket, file):
+    # upload a file from the unzip folder and return the sha256 of its content
+    clients.s3().upload_file(unzipped_dir + file, bucket, unzipped_s3_prefix + file, Config=transfer_config())
+    with open(unzipped_dir + file, 'rb') as extracted_file:
+        return hashlib.file_digest(extracted_file, "sha256").hexdigest()
+
+
+def stream_unzip_object(bucket, key, captured):
+    # read the zip body into a bounded buffer that only spills to /tmp past the threshold
+    response = clients.s3().get_object(Bucket=bucket, Key=key)
+    if response["ContentLength"] > max_archive_size:
+        raise ArchiveRejectedError(f"Archive {key} is {response['ContentLength']} bytes, limit is {max_archive_size}")
+
+    with tempfile.SpooledTemporaryFile(max_size=spool_max_size, dir="/tmp") as zip_buffer:
+        shutil.copyfileobj(response["Body"], zip_buffer)
+        zip_buffer.seek(0)
+
+        # pipe every member directly from the archive to the unzip prefix in s3
+        with zipfile.ZipFile(zip_buffer, 'r') as zip_ref:
+            budget = ExtractionBudget()
+            uploads = [
+                (member.filename, lambda member=member: stream_member(zip_ref, member, bucket, budget, captured))
+                for member in check_archive(zip_ref, key)
+            ]
+            uploaded_files = upload_members(uploads)
+
+    return uploaded_files
+
+
+class S3RangeReader(io.RawIOBase):
+    # seekable read-only view of an S3 object where every read is a range GET, except in the
+    # tail holding the central directory, which is fetched once and then served from memory
+
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+        self.size = clients.s3().head_object(Bucket=bucket, Key=key)["ContentLength"]
+        if self.size > max_archive_size:
+            raise ArchiveRejectedError(f"Archive {key} is {self.size} bytes, limit is {max_archive_size}")
+        self.position = 0
+        self.bytes_fetched = 0
+        self.requests = 0
+        # zipfile reads the end of central directory, its comment and the central directory from here,
+        # and the buffered reads of the last member run into it, so none of it is fetched twice
+        self.tail_start = max(self.size - range_tail_size, 0)
+        self.tail = self.fetch(self.tail_start, self.size - 1) if self.size else b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def fetch(self, start, end):
+        response = clients.s3().get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}")
+        data = response["Body"].read()
+        self.bytes_fetched += len(data)
+        self.requests += 1
+        return data
+
+    def readinto(self, buffer):
+        if self.position >= self.size or len(buffer) == 0:
+            return 0
+        if self.position >= self.tail_start:
+            data = self.tail[self.position - self.tail_start:self.position - self.tail_start + len(buffer)]
+        else:
+            # a range GET stops where the tail starts
+            data = self.fetch(self.position, min(self.position + len(buffer), self.tail_start) - 1)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def ranged_unzip_object(bucket, key, app_uuid, captured):
+    # only these members are needed by the later stages
+    expected_files = {
+        f"{app_uuid}_selfie.png",
+        f"{app_uuid}_license.png",
+        f"{app_uuid}_details.csv",
+    }
+
+    raw_reader = S3RangeReader(bucket, key)
+    with io.BufferedReader(raw_reader, buffer_size=range_read_size) as zip_reader:
+        # opening the archive only reads the end of central directory and the central directory
+        with zipfile.ZipFile(zip_reader, 'r') as zip_ref:
+            members = check_archive(zip_ref, key)
+            member_names = {member.filename for member in members}
+
+            # reject the archive before any member data is downloaded
+            missing_files = expected_files - member_names
+            unexpected_files = member_names - expected_files
+            if missing_files:
+                raise ArchiveRejectedError(f"Archive {key} is missing {sorted(missing_files)}")
+            if unexpected_files:
+                raise ArchiveRejectedError(f"Archive {key} has unexpected members {sorted(unexpected_files)}")
+
+            budget = ExtractionBudget()
+            # every member is read through the one buffered reader, so they are read one at a time in
+            # archive order: a read from another thread would seek away and discard what was buffered
+            uploads = [
+                (member.filename, lambda member=member: stream_member(zip_ref, member, bucket, budget, captured))
+                for member in sorted(members, key=lambda member: member.header_offset)
+            ]
+            uploaded_files = upload_members(uploads, concurrency=1)
+
+    print(f"fetched {raw_reader.bytes_fetched} of {raw_reader.size} bytes in {raw_reader.requests} range requests")
+    return uploaded_files
+
+
+def stream_member(zip_ref, member, bucket, budget, captured):
+    # zipfile serialises reads of the shared archive, so members can be opened from several threads
+    with zip_ref.open(member) as member_stream:
+        guarded_reader = GuardedReader(member_stream, member, budget)
+        upload_stream = guarded_reader
+        if member.filename in captured:
+            # keep small members such as the details file in memory so they are only read once
+            captured[member.filename] = guarded_reader.read()
+            upload_stream = io.BytesIO(captured[member.filename])
+        clients.s3().upload_fileobj(upload_stream, bucket, unzipped_s3_prefix + member.filename, Config=transfer_config())
+
+    return guarded_reader.digest.hexdigest()
+
+
+def extract_application(bucket, key, app_uuid, unzip_mode="stream"):
+    "Extracts one applicant archive to the unzip prefix, returning the member digests and the details file content"
+    details_name = f'{app_uuid}_details.csv'
+    captured = {details_name: None}
+
+    if unzip_mode == "disk":
+        # unzip the object from the bucket using the key to get all the files
+        files_list = unzip_object(bucket, key)
+
+        # upload the unzipped files to the unzip prefix in s3
+        file_digests = upload_members([
+            (file, lambda file=file: upload_extracted_file(bucket, file))
+            for file in files_list
+        ])
+        if os.path.exists(unzipped_dir + details_name):
+            with open(unzipped_dir + details_name, 'rb') as file:
+                captured[details_name] = file.read()
+    elif unzip_mode == "ranged":
+        # download and upload only the selfie, license and details members
+        file_digests = ranged_unzip_object(bucket, key, app_uuid, captured)
+    else:
+        # extract and upload the files without staging them on /tmp
+        file_digests = stream_unzip_object(bucket, key, captured)
+
+    return file_digests, captured[details_name]
@@ -0,0 +1,127 @@
+"Splits bulk onboarding archives, a manifest.csv with one row per applicant plus their images, into single applications"
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from kyc_common import clients
+from kyc_common.archive import ArchiveRejectedError, ExtractionBudget, check_archive, spool_max_size, stream_member, upload_members
+from kyc_common.details import validate_details
+
+manifest_name = "manifest.csv"
+bulk_items_prefix = "bulk/items/"
+
+# a bulk archive holds the manifest and two images per applicant
+bulk_max_applicants = int(os.environ.get("BULK_MAX_APPLICANTS", 10000))
+bulk_max_archive_size = int(os.environ.get("BULK_MAX_ARCHIVE_SIZE", 8 * 1024 * 1024 * 1024))
+bulk_max_total_size = int(os.environ.get("BULK_MAX_TOTAL_SIZE", 9 * 1024 * 1024 * 1024))
+# conditional puts in flight while the manifest is read
+bulk_write_concurrency = int(os.environ.get("BULK_WRITE_CONCURRENCY", 16))
+# rejected rows listed in the state output, the rest are only counted so the output stays under 256 KB
+max_listed_rejections = 20
+
+
+def iter_manifest(manifest_stream):
+    "Yields (app_uuid, details, error) for every manifest row, decoding the CSV as it is read"
+    reader = csv.DictReader(io.TextIOWrapper(manifest_stream, encoding="utf-8", newline=""))
+    for line_number, row in enumerate(reader, start=2):
+        app_uuid = (row.pop("APP_UUID", None) or "").strip()
+        try:
+            if not app_uuid:
+                raise ValueError("Row has no APP_UUID")
+            yield app_uuid, validate_details(row), None
+        except ValueError as e:
+            yield app_uuid, None, f"line {line_number}: {str(e)}"
+
+
+def record_applicant(ddb_table, item):
+    "Writes the applicant unless the APP_UUID is already recorded, returns whether it was written"
+    # a re-sent batch must not replace the check results and stage history of an application already processed
+    try:
+        ddb_table.put_item(Item=item, ConditionExpression="attribute_not_exists(APP_UUID)")
+        return True
+    except ddb_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+def write_applicants(rows, digests, table_name, batch_id, submitted_at, check_mode):
+    "Records every valid row that is not recorded yet and returns the Map items, the rejected rows and the skipped count"
+    ddb_table = clients.table(table_name)
+    applications = []
+    rejected = []
+    seen = set()
+    # each put is conditional, which BatchWriteItem does not support, so the puts run concurrently instead
+    with ThreadPoolExecutor(max_workers=bulk_write_concurrency) as executor:
+        for app_uuid, details_dict, error in rows:
+            image_digests = {
+                "selfie": digests.get(f"{app_uuid}_selfie.png"),
+                "license": digests.get(f"{app_uuid}_license.png"),
+            }
+            if error is None and app_uuid in seen:
+                error = f"{app_uuid} appears more than once in the manifest"
+            if error is None and None in image_digests.values():
+                error = f"{app_uuid} has no selfie or license image"
+            if error is not None:
+                rejected.append({"app_uuid": app_uuid, "error": error})
+                continue
+
+            seen.add(app_uuid)
+            item = {"APP_UUID": app_uuid, **details_dict, "BATCH_ID": batch_id, "SUBMITTED_AT": submitted_at}
+            # the same application the Unzip stage returns, so the checks run unchanged
+            application = {
+                "app_uuid": app_uuid,
+                "digests": image_digests,
+                "check_mode": check_mode,
+                "details_valid": True,
+                "details": details_dict,
+            }
+            applications.append((executor.submit(record_applicant, ddb_table, item), application))
+
+    # applicants recorded before are left out of the Map, so they are not checked and paid for again
+    items = [application for written, application in applications if written.result()]
+    return items, rejected, len(applications) - len(items)
+
+
+def split_bulk_archive(bucket, key, table_name, submitted_at, check_mode="parallel"):
+    "Uploads the images of a bulk archive, records its applicants and writes the items file for the Map state"
+    batch_id = os.path.basename(key).replace(".zip", "")
+    response = clients.s3().get_object(Bucket=bucket, Key=key)
+    if response["ContentLength"] > bulk_max_archive_size:
+        raise ArchiveRejectedError(f"Archive {key} is {response['ContentLength']} bytes, limit is {bulk_max_archive_size}")
+
+    with tempfile.SpooledTemporaryFile(max_size=spool_max_size, dir="/tmp") as zip_buffer:
+        shutil.copyfileobj(response["Body"], zip_buffer)
+        zip_buffer.seek(0)
+
+        with zipfile.ZipFile(zip_buffer, 'r') as zip_ref:
+            members = check_archive(zip_ref, key, member_limit=bulk_max_applicants * 2 + 1, size_limit=bulk_max_total_size)
+            if manifest_name not in {member.filename for member in members}:
+                raise ArchiveRejectedError(f"Archive {key} has no {manifest_name}")
+
+            # the images go first, so every recorded applicant points at images that are already uploaded
+            budget = ExtractionBudget(bulk_max_total_size)
+            digests = upload_members([
+                (member.filename, lambda member=member: stream_member(zip_ref, member, bucket, budget, {}))
+                for member in members if member.filename != manifest_name
+            ])
+            with zip_ref.open(manifest_name) as manifest_stream:
+                items, rejected, skipped = write_applicants(iter_manifest(manifest_stream), digests, table_name,
+                                                            batch_id, submitted_at, check_mode)
+
+    # the Map state reads its items from S3, so the batch size is not bound by the state payload limit
+    items_key = f"{bulk_items_prefix}{batch_id}.json"
+    clients.s3().put_object(Bucket=bucket, Key=items_key, Body=json.dumps(items).encode("utf-8"))
+    print(f"batch {batch_id}: {len(items)} applicants recorded, {skipped} already recorded, {len(rejected)} rows rejected")
+    return {
+        "batch_id": batch_id,
+        "items_bucket": bucket,
+        "items_key": items_key,
+        "applicants": len(items),
+        "already_recorded": skipped,
+        "rejected": len(rejected),
+        "rejections": rejected[:max_listed_rejections],
+    }
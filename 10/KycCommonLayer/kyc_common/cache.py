@@ -0,0 +1,70 @@
+"Content-addressed result cache with a warm-container LRU in front of a DynamoDB table with TTL"
+import json
+import os
+import time
+from collections import OrderedDict
+
+from kyc_common import clients
+from kyc_common.metrics import emit_metrics
+
+cache_table_name = os.environ.get("CACHE_TABLE")
+cache_ttl_seconds = int(os.environ.get("CACHE_TTL_SECONDS", 30 * 24 * 3600))
+cache_max_entries = int(os.environ.get("CACHE_MAX_ENTRIES", 256))
+
+
+class ResultCache:
+    "Caches JSON-serialisable results in the container first and then in the cache table"
+
+    def __init__(self, name, table_name=cache_table_name, ttl_seconds=cache_ttl_seconds, max_entries=cache_max_entries):
+        self.name = name
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # results kept in the warm container, most recently used last
+        self.local_cache = OrderedDict()
+        self.stats = {"hits": 0, "local_hits": 0, "misses": 0}
+
+    def get(self, cache_key):
+        # looks the result up in the container first and then in the dynamodb cache table
+        if cache_key in self.local_cache:
+            self.local_cache.move_to_end(cache_key)
+            self.stats["hits"] += 1
+            self.stats["local_hits"] += 1
+            return self.local_cache[cache_key]
+
+        if self.table_name:
+            item = clients.table(self.table_name).get_item(Key={"CACHE_KEY": cache_key}).get("Item")
+            # expired items can linger until dynamodb's TTL sweep removes them
+            if item and int(item["EXPIRES_AT"]) > time.time():
+                result = json.loads(item["RESULT"])
+                self.remember(cache_key, result)
+                self.stats["hits"] += 1
+                return result
+
+        self.stats["misses"] += 1
+        return None
+
+    def remember(self, cache_key, result):
+        self.local_cache[cache_key] = result
+        self.local_cache.move_to_end(cache_key)
+        while len(self.local_cache) > self.max_entries:
+            self.local_cache.popitem(last=False)
+
+    def put(self, cache_key, result):
+        self.remember(cache_key, result)
+        if self.table_name:
+            clients.table(self.table_name).put_item(Item={
+                "CACHE_KEY": cache_key,
+                "RESULT": json.dumps(result),
+                "EXPIRES_AT": int(time.time()) + self.ttl_seconds,
+            })
+
+    def emit_metrics(self):
+        emit_metrics({"Cache": self.name}, self.stats)
+
+
+def image_digest(bucket, key, digests, name):
+    "Returns the content hash from the Unzip stage, falling back to the S3 ETag for older events"
+    if digests and digests.get(name):
+        return digests[name]
+    return clients.s3().head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
@@ -0,0 +1,169 @@
+"The paid identity checks, each cached by image content and paced to the account quota"
+import hashlib
+import os
+import time
+
+from kyc_common import clients
+from kyc_common.cache import ResultCache, image_digest
+from kyc_common.details import details_fields
+from kyc_common.images import image_profile, service_image
+from kyc_common.metrics import emit_metrics
+from kyc_common.phash import SharedHashIndex
+from kyc_common.rate_limit import SharedTokenBucket
+
+similarity_threshold = 80
+
+faces_cache = ResultCache("CompareFaces")
+details_cache = ResultCache("CompareDetails")
+faces_limiter = SharedTokenBucket("rekognition_compare_faces")
+details_limiter = SharedTokenBucket("textract_analyze_id")
+photo_index = SharedHashIndex()
+
+
+class CheckFailedError(Exception):
+    "Raised in parallel_fail_fast mode so Step Functions stops waiting on the other PerformChecks branch"
+
+
+def notify(message):
+    # the customer is notified through this SNS topic whenever a check fails
+    clients.sns().publish(
+        TopicArn=os.environ["TOPIC"],
+        Message=message,
+        Subject=message,
+    )
+
+
+def cache_suffix(images, names):
+    # keys of results on the uploaded images stay as they were, so existing cache entries keep matching
+    profiles = [image_profile(images, name) for name in names]
+    return "" if set(profiles) == {"original"} else "|" + "|".join(profiles)
+
+
+def report_api_latency(check, source, start):
+    # shows what reading the normalized copies instead of the uploads does to the latency of the call
+    emit_metrics({"Check": check, "ImageSource": source}, {"ApiLatency": (time.perf_counter() - start) * 1000}, unit="Milliseconds")
+
+
+def find_reused_photos(bucket, app_uuid, images):
+    "Returns the APP_UUIDs of other applications whose selfie near-duplicates this one's, then records this one's"
+    # only a normalized selfie carries a dHash, an upload the NormalizeImages stage could not decode is not indexed
+    selfie = (images or {}).get("selfie") or {}
+    if "dhash" not in selfie:
+        return []
+    hashes = {"selfie": int(selfie["dhash"], 16)}
+    try:
+        start = time.perf_counter()
+        reused = photo_index.find_reused(bucket, app_uuid, hashes)
+        emit_metrics({"Check": "CompareFaces"}, {"PhotoLookupLatency": (time.perf_counter() - start) * 1000}, unit="Milliseconds")
+        photo_index.record(bucket, app_uuid, hashes)
+    except Exception as e:
+        # the index only flags applications for review, so the check goes on to Rekognition without it
+        print(f"Photo index unavailable: {str(e)}")
+        return []
+    emit_metrics({"Check": "CompareFaces"}, {"ReusedPhotos": len(reused)})
+    return sorted({owner for matches in reused.values() for _, owner, _ in matches})
+
+
+def check_faces(app_uuid, bucket, license_key, selfie_key, digests=None, images=None):
+    "Compares the selfie with the license photo, unless the selfie was sent before and the application goes to review"
+    # the index is looked up before Rekognition, so a reused selfie costs no paid call
+    reused_from = find_reused_photos(bucket, app_uuid, images)
+    if reused_from:
+        # a near-duplicate selfie may be a resubmission as well as fraud, so a person decides instead of the check
+        print(f"selfie reused from other applications: {reused_from}")
+        notify('Selfie matches another application, flagged for review')
+        return {"LICENSE_SELFIE_MATCH": None, "SELFIE_REUSED_FROM": reused_from}
+    return {"LICENSE_SELFIE_MATCH": compare_faces(app_uuid, bucket, license_key, selfie_key, digests, images)}
+
+
+def compare_faces(app_uuid, bucket, license_key, selfie_key, digests=None, images=None):
+    "Compares the selfie with the license photo and returns whether they match"
+    print("started comparing faces")
+
+    # the same pair of images compared with the same threshold always gives the same answer
+    license_digest = image_digest(bucket, license_key, digests, "license")
+    selfie_digest = image_digest(bucket, selfie_key, digests, "selfie")
+    cache_key = hashlib.sha256(
+        f"compare_faces|{license_digest}|{selfie_digest}|{similarity_threshold}{cache_suffix(images, ['license', 'selfie'])}".encode()
+    ).hexdigest()
+
+    response = faces_cache.get(cache_key)
+    if response is None:
+        # wait for our share of the account's CompareFaces quota instead of getting throttled
+        faces_limiter.acquire()
+        # uses rekognition to compare selfie and license photo, normalized by the NormalizeImages stage when it ran
+        source_image = service_image(bucket, license_key, (images or {}).get("license"))
+        target_image = service_image(bucket, selfie_key, (images or {}).get("selfie"))
+        start = time.perf_counter()
+        rekognition_response = clients.rekognition().compare_faces(
+            SourceImage=source_image,
+            TargetImage=target_image,
+            SimilarityThreshold=similarity_threshold
+        )
+        report_api_latency("CompareFaces", image_profile(images, "selfie"), start)
+        # only the similarities are needed to decide the match
+        response = {"FaceMatches": [{"Similarity": match["Similarity"]} for match in rekognition_response["FaceMatches"]]}
+        faces_cache.put(cache_key, response)
+    else:
+        print("reusing cached face comparison")
+
+    # checks if the photo comparison is valid
+    valid_photo = bool(response["FaceMatches"]) and response["FaceMatches"][0]["Similarity"] >= similarity_threshold
+
+    if not valid_photo:
+        notify('License photo validation FAILED')
+
+    print("finished compare faces")
+    return valid_photo
+
+
+def analyze_license(bucket, license_key, digests, images=None):
+    "Returns the fields Textract extracts from the license, cached by the hash of the image"
+    license_digest = image_digest(bucket, license_key, digests, "license")
+    cache_key = hashlib.sha256(f"analyze_id|{license_digest}{cache_suffix(images, ['license'])}".encode()).hexdigest()
+
+    document_fields = details_cache.get(cache_key)
+    if document_fields is not None:
+        print("reusing cached ID extraction")
+        return document_fields
+
+    # wait for our share of the account's AnalyzeID quota instead of getting throttled
+    details_limiter.acquire()
+    # uses Textract to analyze the ID
+    document = service_image(bucket, license_key, (images or {}).get("license"))
+    start = time.perf_counter()
+    response = clients.textract().analyze_id(
+        DocumentPages=[document]
+    )
+    report_api_latency("CompareDetails", image_profile(images, "license"), start)
+
+    # extracts the details after analysis
+    id_document = response["IdentityDocuments"][0]
+    document_fields = {
+        data_field["Type"]["Text"]: data_field["ValueDetection"]["Text"]
+        for data_field in id_document["IdentityDocumentFields"]
+    }
+    details_cache.put(cache_key, document_fields)
+    return document_fields
+
+
+def extract_details(app_uuid, bucket, license_key, parsed_details_dict, digests=None, images=None):
+    "Compares the details read from the license with the ones the customer entered"
+    print("Starting to extract details from ID...")
+    document_fields = analyze_license(bucket, license_key, digests, images)
+    id_fields = {field: value for field, value in document_fields.items() if field in details_fields}
+
+    # strict comparison
+    valid_comparison = parsed_details_dict == id_fields
+
+    # flexible comparison
+    # valid_comparison = all(
+    #     parsed_details_dict.get(k, '').strip().lower() == id_fields.get(k, '').strip().lower()
+    #     for k in details_fields
+    # )
+
+    if not valid_comparison:
+        notify('Data validation between the license and the .csv file FAILED')
+
+    print("finished extracting and comparing details from ID and input data")
+    return valid_comparison
@@ -0,0 +1,76 @@
+"AWS clients created on first use with a tuned botocore config, so functions only pay for the clients they call"
+import os
+import threading
+
+# botocore and boto3 are imported on first use, keeping them out of INIT for functions that never call AWS
+max_pool_connections = int(os.environ.get("KYC_MAX_POOL_CONNECTIONS", 10))
+max_attempts = int(os.environ.get("KYC_MAX_ATTEMPTS", 5))
+
+_clients = {}
+_tables = {}
+_session = None
+_lock = threading.Lock()
+
+
+def tuned_config():
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=max_pool_connections,
+        tcp_keepalive=True,
+        retries={"mode": "adaptive", "max_attempts": max_attempts},
+    )
+
+
+def _get_session():
+    # one boto3 session per container, the default session is not safe to create from several threads
+    global _session
+    if _session is None:
+        import boto3
+
+        _session = boto3.session.Session()
+    return _session
+
+
+def client(service_name):
+    "Returns the shared client for service_name, creating it on first use"
+    if service_name not in _clients:
+        with _lock:
+            if service_name not in _clients:
+                _clients[service_name] = _get_session().client(service_name, config=tuned_config())
+    return _clients[service_name]
+
+
+def table(table_name):
+    "Returns the shared DynamoDB Table resource for table_name, creating it on first use"
+    if table_name not in _tables:
+        with _lock:
+            if table_name not in _tables:
+                dynamodb = _get_session().resource("dynamodb", config=tuned_config())
+                _tables[table_name] = dynamodb.Table(table_name)
+    return _tables[table_name]
+
+
+def override(service_name=None, stand_in=None, table_name=None):
+    "Replaces a client or table with a stand-in, for running the functions locally"
+    with _lock:
+        if table_name is not None:
+            _tables[table_name] = stand_in
+        else:
+            _clients[service_name] = stand_in
+
+
+def s3():
+    return client("s3")
+
+
+def sns():
+    return client("sns")
+
+
+def rekognition():
+    return client("rekognition")
+
+
+def textract():
+    return client("textract")
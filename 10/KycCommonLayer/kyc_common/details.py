@@ -0,0 +1,51 @@
+"Parses the customer details file submitted with every application"
+import csv
+import io
+import os
+
+from kyc_common import clients
+
+unzipped_s3_prefix = "unzipped/"
+max_field_length = int(os.environ.get("MAX_FIELD_LENGTH", 256))
+details_fields = ['DOCUMENT_NUMBER','FIRST_NAME','LAST_NAME','DATE_OF_BIRTH', 'ADDRESS','STATE_IN_ADDRESS','CITY_IN_ADDRESS','ZIP_CODE_IN_ADDRESS']
+
+
+def parse_details(details_bytes):
+    "Parses the customer details once and checks them against the expected schema, raising ValueError"
+    reader = csv.DictReader(io.StringIO(details_bytes.decode("utf-8")))
+    details_dict = next(reader, None)
+    if details_dict is None:
+        raise ValueError("Details file has no rows")
+    return validate_details(details_dict)
+
+
+def validate_details(details_dict):
+    "Checks one row of details against the expected schema, raising ValueError"
+    if set(details_dict) != set(details_fields):
+        raise ValueError(f"Details file columns {sorted(map(str, details_dict))} do not match {sorted(details_fields)}")
+    for field, value in details_dict.items():
+        if not value or len(value) > max_field_length:
+            raise ValueError(f"Details field {field} is empty or longer than {max_field_length} characters")
+
+    return details_dict
+
+
+def parse_csv_ddb(app_uuid, details_file):
+    "Opens the customer details file and returns its first row"
+    with open(details_file, 'r', encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        details_dict = next(reader)
+
+    return details_dict
+
+
+def load_details(bucket, application):
+    "Returns the details parsed by the Unzip stage, downloading them when they were too large to pass inline"
+    if "details" in application:
+        return application["details"]
+
+    app_uuid = application["app_uuid"]
+    details_key = application.get("details_key", f"{unzipped_s3_prefix}{app_uuid}_details.csv")
+    details_file = f'/tmp/{app_uuid}_details.csv'
+    clients.s3().download_file(bucket, details_key, details_file)
+    return parse_csv_ddb(app_uuid, details_file)
@@ -0,0 +1,96 @@
+"Runs each pipeline stage once per upload, recording its result on a small marker item of its own in the stage table"
+import json
+import os
+import time
+
+from kyc_common import clients
+
+# markers live in their own on-demand table, so claims and results never cost the provisioned writes of the APP_UUID item
+stage_table_name = os.environ.get("STAGE_TABLE", "StageMarkerTable")
+# a claimed stage that has not finished after this long is assumed to have died with its invocation
+stage_claim_seconds = int(os.environ.get("STAGE_CLAIM_SECONDS", 900))
+# markers outlast every redelivery and retry of their upload, then dynamodb's TTL sweep removes them
+stage_marker_ttl_seconds = int(os.environ.get("STAGE_MARKER_TTL_SECONDS", 7 * 24 * 3600))
+
+claim_condition = (
+    "attribute_not_exists(#upload_id) OR #upload_id <> :upload_id"
+    " OR (#status = :in_progress AND #claimed_until < :now)"
+)
+marker_names = {"#upload_id": "UPLOAD_ID", "#status": "STATUS", "#claimed_until": "CLAIMED_UNTIL", "#expires_at": "EXPIRES_AT"}
+
+
+class StageInProgressError(Exception):
+    "Raised while another invocation runs the same stage for the same upload, the state machine retries it by name"
+
+
+def upload_id(event):
+    "Names one upload by bucket, key, ETag and sequencer: a re-delivered event repeats all four, a new upload of the key does not"
+    detail = event["detail"]
+    s3_object = detail["object"]
+    return "/".join([detail["bucket"]["name"], s3_object["key"], s3_object.get("etag", ""), s3_object.get("sequencer", "")])
+
+
+def marker_key(app_uuid, stage):
+    return f"{app_uuid}#{stage.upper()}"
+
+
+def recorded_marker(item):
+    # the old item of a failed condition is in the typed wire form, the Table resource only deserializes successful calls
+    from boto3.dynamodb.types import TypeDeserializer
+
+    deserializer = TypeDeserializer()
+    return {name: deserializer.deserialize(value) for name, value in item.items()}
+
+
+def run_stage(stage, app_uuid, upload, run):
+    "Returns the recorded result if the stage already finished for this upload, otherwise runs it and records the result"
+    ddb_table = clients.table(stage_table_name)
+    key = {"STAGE_KEY": marker_key(app_uuid, stage)}
+    now = int(time.time())
+
+    try:
+        # claim the stage, so a duplicate running at the same time waits instead of paying for the same calls
+        ddb_table.update_item(
+            Key=key,
+            UpdateExpression="SET #upload_id = :upload_id, #status = :in_progress, #claimed_until = :claimed_until, #expires_at = :expires_at",
+            ConditionExpression=claim_condition,
+            ExpressionAttributeNames=marker_names,
+            ExpressionAttributeValues={
+                ":upload_id": upload,
+                ":in_progress": "IN_PROGRESS",
+                ":claimed_until": now + stage_claim_seconds,
+                ":expires_at": now + stage_marker_ttl_seconds,
+                ":now": now,
+            },
+            ReturnValuesOnConditionCheckFailure="ALL_OLD",
+        )
+    except ddb_table.meta.client.exceptions.ConditionalCheckFailedException as e:
+        marker = recorded_marker(e.response.get("Item", {}))
+        if marker.get("STATUS") == "COMPLETED":
+            print(f"{stage} already finished for {upload}, returning the recorded result")
+            return json.loads(marker["RESULT"])
+        raise StageInProgressError(f"{stage} of {app_uuid} is already running for {upload}") from e
+
+    try:
+        result = run()
+    except BaseException:
+        # expire the claim so the retry of this invocation can run the stage again
+        ddb_table.update_item(
+            Key=key,
+            UpdateExpression="SET #claimed_until = :released",
+            ConditionExpression="#upload_id = :upload_id",
+            ExpressionAttributeNames={"#claimed_until": "CLAIMED_UNTIL", "#upload_id": "UPLOAD_ID"},
+            ExpressionAttributeValues={":released": 0, ":upload_id": upload},
+        )
+        raise
+
+    # the completed marker replaces the claim in one put, and the result is stored as JSON so floats and nested lists
+    # come back exactly as the stage returned them
+    ddb_table.put_item(Item={
+        **key,
+        "UPLOAD_ID": upload,
+        "STATUS": "COMPLETED",
+        "RESULT": json.dumps(result),
+        "EXPIRES_AT": now + stage_marker_ttl_seconds,
+    })
+    return result
@@ -0,0 +1,92 @@
+"Decodes, orients, downscales and recompresses the uploaded images to the resolution each paid check needs"
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kyc_common import clients
+from kyc_common.metrics import emit_metrics
+from kyc_common.phash import dhash
+
+normalized_s3_prefix = "normalized/"
+# Rekognition finds faces well below this size, Textract needs more pixels to read the printed fields
+faces_max_side = int(os.environ.get("FACES_MAX_SIDE", 1024))
+license_max_side = int(os.environ.get("LICENSE_MAX_SIDE", 2000))
+jpeg_quality = int(os.environ.get("JPEG_QUALITY", 85))
+# decoding stops before a hostile upload can exhaust the memory of the function
+max_image_pixels = int(os.environ.get("MAX_IMAGE_PIXELS", 50 * 1000 * 1000))
+
+max_sides = {"selfie": faces_max_side, "license": license_max_side}
+
+
+def normalize_bytes(data, max_side, quality=jpeg_quality):
+    "Returns the image as an upright RGB JPEG no larger than max_side, or None when it cannot be decoded"
+    # Pillow is only imported by the stage that resizes images, the other functions never load it
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    Image.MAX_IMAGE_PIXELS = max_image_pixels
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding, far cheaper than resizing afterwards
+            image.draft("RGB", (max_side, max_side))
+            # phones store the rotation in EXIF, the services expect the pixels upright
+            upright = ImageOps.exif_transpose(image).convert("RGB")
+        upright.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        upright.save(output, format="JPEG", quality=quality, optimize=True)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        print(f"Image not normalized: {str(e)}")
+        return None
+    return output.getvalue()
+
+
+def normalize_image(bucket, key, name):
+    "Normalizes one uploaded image and returns where the checks read it from, with the bytes before and after"
+    original = clients.s3().get_object(Bucket=bucket, Key=key)["Body"].read()
+    start = time.perf_counter()
+    normalized = normalize_bytes(original, max_sides[name])
+    print(f"normalized {key} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # an image Pillow cannot decode, or one that re-encodes larger, is checked as uploaded
+    if normalized is None or len(normalized) >= len(original):
+        return {"key": key, "original_bytes": len(original), "normalized_bytes": len(original)}
+
+    image = {
+        "profile": f"{name}-{max_sides[name]}-q{jpeg_quality}",
+        "original_bytes": len(original),
+        "normalized_bytes": len(normalized),
+    }
+    # CompareFaces looks the selfie up among those of earlier applications, licenses of one state
+    # share a template and hash too close together to tell a reused one apart
+    image_hash = dhash(normalized) if name == "selfie" else None
+    if image_hash is not None:
+        image["dhash"] = f"{image_hash:016x}"
+    # only the key is returned, the result is recorded on the application item and every byte there costs write capacity
+    image["key"] = normalized_s3_prefix + os.path.splitext(os.path.basename(key))[0] + ".jpg"
+    clients.s3().put_object(Bucket=bucket, Key=image["key"], Body=normalized, ContentType="image/jpeg")
+    return image
+
+
+def normalize_application(bucket, app_uuid, unzipped_s3_prefix="unzipped/"):
+    "Normalizes the selfie and the license of an application, reporting the bytes the checks no longer send"
+    # Pillow releases the GIL while decoding and encoding, so both images are processed at once
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {
+            name: executor.submit(normalize_image, bucket, f"{unzipped_s3_prefix}{app_uuid}_{name}.png", name)
+            for name in ("selfie", "license")
+        }
+    images = {name: future.result() for name, future in futures.items()}
+
+    bytes_saved = sum(image["original_bytes"] - image["normalized_bytes"] for image in images.values())
+    emit_metrics({"Stage": "NormalizeImages"}, {"BytesSaved": bytes_saved}, unit="Bytes")
+    return images
+
+
+def service_image(bucket, key, image=None):
+    "The Image or Document argument of a Rekognition or Textract call: the normalized copy or the upload"
+    return {"S3Object": {"Bucket": bucket, "Name": (image or {}).get("key", key)}}
+
+
+def image_profile(images, name):
+    # results computed on a normalized image are cached apart from results on the upload
+    return (images or {}).get(name, {}).get("profile", "original")
@@ -0,0 +1,322 @@
+"Perceptual hashes of the selfie photos in a multi-index hash table, persisted to S3 as segments"
+import io
+import os
+import struct
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate, combinations
+
+from kyc_common import clients
+
+hash_index_prefix = os.environ.get("HASH_INDEX_PREFIX", "phash/")
+# dHashes of the same photo resized or recompressed differ by a few bits, unrelated photos by about 32
+duplicate_max_distance = int(os.environ.get("DUPLICATE_MAX_DISTANCE", 5))
+# warm containers list new segments at most this often, their own additions are visible at once
+hash_index_refresh_seconds = float(os.environ.get("HASH_INDEX_REFRESH_SECONDS", 10))
+# segments named up to this long before the newest one loaded may still be landing, so they are listed again
+hash_index_settle_seconds = int(os.environ.get("HASH_INDEX_SETTLE_SECONDS", 60))
+segment_fetch_concurrency = int(os.environ.get("HASH_INDEX_FETCH_CONCURRENCY", 8))
+
+kinds = ("selfie", "license")
+# one entry of a segment: the hash, whether it is a selfie or a license and the length of the APP_UUID that follows
+entry_format = struct.Struct("<QBH")
+# APP_UUIDs are free-form keys, so they are stored as they are instead of assuming 16 bytes of hex
+max_owner_length = 0xFFFF
+snapshot_header = struct.Struct("<4sII")
+snapshot_magic = b"DHX2"
+
+
+def owner_bytes(app_uuid):
+    owner = app_uuid.encode("utf-8")
+    if not owner or len(owner) > max_owner_length:
+        raise ValueError(f"APP_UUID of {len(owner)} bytes cannot be indexed")
+    return owner
+
+
+def dhash(data, size=8):
+    "Returns the 64 bit difference hash of an image, or None when it cannot be decoded"
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # the hash only needs a 9x8 thumbnail, so the JPEG decoder can skip most of the pixels
+            image.draft("L", (size * 8, size * 8))
+            pixels = list(image.convert("L").resize((size + 1, size), Image.Resampling.BOX).getdata())
+    except (UnidentifiedImageError, OSError) as e:
+        print(f"Image not hashed: {str(e)}")
+        return None
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            offset = row * (size + 1) + column
+            value = (value << 1) | (pixels[offset] < pixels[offset + 1])
+    return value
+
+
+class HashIndex:
+    "Finds the 64 bit hashes within a Hamming distance of a query by splitting them into bands"
+
+    def __init__(self, bands=4, max_distance=duplicate_max_distance):
+        self.bands = bands
+        self.band_bits = 64 // bands
+        self.band_mask = (1 << self.band_bits) - 1
+        # two hashes within max_distance agree on some band to within max_distance // bands bits,
+        # so a query only probes the buckets of its bands and their neighbours at that distance
+        self.probe_masks = [
+            sum(1 << bit for bit in flipped)
+            for distance in range(max_distance // bands + 1)
+            for flipped in combinations(range(self.band_bits), distance)
+        ]
+        self.max_distance = max_distance
+        self.hashes = array("Q")
+        # the APP_UUID of entry i is owners[owner_offsets[i]:owner_offsets[i + 1]], and its kind one byte,
+        # a list of str would be twice as large and could not be loaded from a snapshot as it is
+        self.owners = bytearray()
+        self.owner_offsets = array("I", [0])
+        self.kinds = bytearray()
+        # entries of the loaded snapshot grouped by band value, the ones with value k of a band
+        # are positions[offsets[k]:offsets[k + 1]], so a snapshot loads without rebuilding anything
+        self.offsets = [array("I") for _ in range(bands)]
+        self.positions = [array("I") for _ in range(bands)]
+        # the hashes in the same order, a query reads them in sequence instead of all over self.hashes
+        self.values = [array("Q") for _ in range(bands)]
+        # entries added since the snapshot, by band value
+        self.recent = [{} for _ in range(bands)]
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def band_keys(self, value):
+        return [(value >> (band * self.band_bits)) & self.band_mask for band in range(self.bands)]
+
+    def owner(self, position):
+        return bytes(self.owners[self.owner_offsets[position]:self.owner_offsets[position + 1]])
+
+    def add(self, value, app_uuid, kind):
+        owner = owner_bytes(app_uuid)
+        with self.lock:
+            position = len(self.hashes)
+            self.hashes.append(value)
+            self.owners += owner
+            self.owner_offsets.append(len(self.owners))
+            self.kinds.append(kinds.index(kind))
+            for table, key in zip(self.recent, self.band_keys(value)):
+                bucket = table.get(key)
+                if bucket is None:
+                    table[key] = array("I", [position])
+                else:
+                    bucket.append(position)
+
+    def lookup(self, value, max_distance=None, exclude=None):
+        "Returns (distance, app_uuid, kind) of every stored hash within max_distance, nearest first"
+        max_distance = self.max_distance if max_distance is None else max_distance
+        hashes = self.hashes
+        found = set()
+        for band, key in enumerate(self.band_keys(value)):
+            offsets, positions, values, recent = self.offsets[band], self.positions[band], self.values[band], self.recent[band]
+            for mask in self.probe_masks:
+                probe = key ^ mask
+                if offsets and offsets[probe] != offsets[probe + 1]:
+                    start = offsets[probe]
+                    near = [i for i, other in enumerate(values[start:offsets[probe + 1]], start) if (other ^ value).bit_count() <= max_distance]
+                    found.update(positions[i] for i in near)
+                if probe in recent:
+                    found.update([p for p in recent[probe] if (hashes[p] ^ value).bit_count() <= max_distance])
+
+        exclude_bytes = exclude.encode("utf-8") if exclude else None
+        matches = []
+        for position in found:
+            owner = self.owner(position)
+            if owner != exclude_bytes:
+                matches.append(((hashes[position] ^ value).bit_count(), owner.decode("utf-8"), kinds[self.kinds[position]]))
+        return sorted(matches)
+
+    def load(self, data):
+        "Adds every entry of a segment"
+        offset = 0
+        while offset < len(data):
+            value, kind, length = entry_format.unpack_from(data, offset)
+            offset += entry_format.size
+            self.add(value, data[offset:offset + length].decode("utf-8"), kinds[kind])
+            offset += length
+
+    def load_snapshot(self, data):
+        "Replaces the index with a snapshot written by dump_snapshot"
+        magic, bands, count = snapshot_header.unpack_from(data)
+        if magic != snapshot_magic or bands != self.bands:
+            raise ValueError(f"Snapshot is not a {self.bands} band hash index")
+        offset = snapshot_header.size
+        arrays = [("Q", count)] + [("I", (1 << self.band_bits) + 1), ("I", count), ("Q", count)] * bands + [("I", count + 1)]
+        loaded = []
+        for typecode, length in arrays:
+            values = array(typecode)
+            values.frombytes(data[offset:offset + length * values.itemsize])
+            offset += length * values.itemsize
+            loaded.append(values)
+        with self.lock:
+            self.hashes = loaded[0]
+            self.offsets = loaded[1:-1:3]
+            self.positions = loaded[2:-1:3]
+            self.values = loaded[3:-1:3]
+            self.owner_offsets = loaded[-1]
+            owners_size = self.owner_offsets[-1]
+            self.owners = bytearray(data[offset:offset + owners_size])
+            self.kinds = bytearray(data[offset + owners_size:offset + owners_size + count])
+            self.recent = [{} for _ in range(self.bands)]
+
+    def dump_snapshot(self):
+        "Returns every entry grouped by band value, the layout load_snapshot reads back as it is"
+        with self.lock:
+            count = len(self.hashes)
+            parts = [snapshot_header.pack(snapshot_magic, self.bands, count), self.hashes.tobytes()]
+            for band in range(self.bands):
+                shift = band * self.band_bits
+                keys = [(value >> shift) & self.band_mask for value in self.hashes]
+                counts = [0] * ((1 << self.band_bits) + 1)
+                for key in keys:
+                    counts[key + 1] += 1
+                positions = array("I", sorted(range(count), key=keys.__getitem__))
+                parts.append(array("I", accumulate(counts)).tobytes())
+                parts.append(positions.tobytes())
+                parts.append(array("Q", map(self.hashes.__getitem__, positions)).tobytes())
+            parts.extend([self.owner_offsets.tobytes(), bytes(self.owners), bytes(self.kinds)])
+        return b"".join(parts)
+
+
+def dump_entries(app_uuid, hashes):
+    owner = owner_bytes(app_uuid)
+    return b"".join(entry_format.pack(value, kinds.index(kind), len(owner)) + owner for kind, value in hashes.items())
+
+
+def list_keys(bucket, prefix, start_after=""):
+    "Returns the keys under prefix in name order, after start_after"
+    keys = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix, "StartAfter": start_after}
+    while True:
+        response = clients.s3().list_objects_v2(**kwargs)
+        keys.extend(item["Key"] for item in response.get("Contents", []))
+        if not response.get("IsTruncated"):
+            return keys
+        kwargs = {"Bucket": bucket, "Prefix": prefix, "ContinuationToken": response["NextContinuationToken"]}
+
+
+def segment_name(key):
+    # segments are named by the millisecond they were written, so name order is time order
+    return key.rsplit("/", 1)[-1].removesuffix(".bin")
+
+
+def settled_before(name):
+    # the names of segments written a settle period before the named one sort before this
+    if not name:
+        return ""
+    millis = int(name.split("-", 1)[0]) - hash_index_settle_seconds * 1000
+    return f"{max(millis, 0):013d}"
+
+
+def after(name):
+    # StartAfter for the object of a segment or snapshot name, so listing skips it
+    return f"{name}.bin" if name else ""
+
+
+class SharedHashIndex:
+    "A HashIndex of every application checked so far, kept in the warm container and refreshed from S3"
+
+    def __init__(self, prefix=hash_index_prefix, refresh_seconds=hash_index_refresh_seconds):
+        self.prefix = prefix
+        self.refresh_seconds = refresh_seconds
+        self.index = HashIndex()
+        # the snapshot the index was built from and the segments added on top of it
+        self.snapshot = ""
+        self.loaded_segments = set()
+        self.newest_segment = ""
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+        self.stats = {"segments_loaded": 0, "snapshots_loaded": 0, "refreshes": 0}
+
+    def refresh(self, bucket, force=False):
+        "Loads the segments written since the last refresh, or the newer snapshot if one covers segments not loaded"
+        with self.lock:
+            if not force and self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.refresh_seconds:
+                return
+            self.refreshed_at = time.monotonic()
+            self.stats["refreshes"] += 1
+
+            snapshots = list_keys(bucket, f"{self.prefix}snapshots/", f"{self.prefix}snapshots/{after(self.snapshot)}")
+            if snapshots:
+                snapshot = segment_name(snapshots[-1])
+                # a snapshot covering only segments already loaded changes nothing but where listing starts
+                if not self.newest_segment or snapshot > settled_before(self.newest_segment):
+                    index = HashIndex(self.index.bands, self.index.max_distance)
+                    index.load_snapshot(clients.s3().get_object(Bucket=bucket, Key=snapshots[-1])["Body"].read())
+                    self.index = index
+                    self.loaded_segments = set()
+                    self.newest_segment = snapshot
+                    self.stats["snapshots_loaded"] += 1
+                self.snapshot = snapshot
+
+            start_after = max(after(self.snapshot), settled_before(self.newest_segment))
+            keys = [
+                key for key in list_keys(bucket, f"{self.prefix}segments/", f"{self.prefix}segments/{start_after}")
+                if segment_name(key) not in self.loaded_segments
+            ]
+            # segments hold one application each, so they are fetched concurrently like the unzipped members are uploaded
+            with ThreadPoolExecutor(max_workers=segment_fetch_concurrency) as executor:
+                bodies = executor.map(lambda key: clients.s3().get_object(Bucket=bucket, Key=key)["Body"].read(), keys)
+                for key, body in zip(keys, bodies):
+                    self.index.load(body)
+                    self.loaded_segments.add(segment_name(key))
+                    self.newest_segment = max(self.newest_segment, segment_name(key))
+                    self.stats["segments_loaded"] += 1
+            # names that settled before the listing start are never listed again
+            self.loaded_segments = {name for name in self.loaded_segments if name > settled_before(self.newest_segment)}
+
+    def find_reused(self, bucket, app_uuid, hashes):
+        "Returns the photos of other applicants within the duplicate distance of this application's photos"
+        self.refresh(bucket)
+        matches = {kind: self.index.lookup(value, exclude=app_uuid) for kind, value in hashes.items()}
+        return {kind: found for kind, found in matches.items() if found}
+
+    def record(self, bucket, app_uuid, hashes):
+        "Adds the photos of an application to this container's index and writes them as a segment for the others"
+        name = f"{int(time.time() * 1000):013d}-{app_uuid}"
+        clients.s3().put_object(Bucket=bucket, Key=f"{self.prefix}segments/{name}.bin", Body=dump_entries(app_uuid, hashes))
+        with self.lock:
+            for kind, value in hashes.items():
+                self.index.add(value, app_uuid, kind)
+            self.loaded_segments.add(name)
+            self.newest_segment = max(self.newest_segment, name)
+
+
+def compact_segments(bucket, prefix=hash_index_prefix):
+    "Merges the newest snapshot and the settled segments after it into a new snapshot, named after its last segment"
+    snapshots = list_keys(bucket, f"{prefix}snapshots/")
+    snapshot = segment_name(snapshots[-1]) if snapshots else ""
+    # segments older than twice the settle period were listed by every warm container already,
+    # so a container finding this snapshot only moves its listing start instead of reloading
+    settled = settled_before(settled_before(f"{int(time.time() * 1000):013d}"))
+    segments = [
+        key for key in list_keys(bucket, f"{prefix}segments/", f"{prefix}segments/{after(snapshot)}")
+        if segment_name(key) < settled
+    ]
+    if not segments:
+        return {"snapshot": snapshot, "segments": 0}
+
+    index = HashIndex()
+    if snapshots:
+        index.load_snapshot(clients.s3().get_object(Bucket=bucket, Key=snapshots[-1])["Body"].read())
+    for key in segments:
+        index.load(clients.s3().get_object(Bucket=bucket, Key=key)["Body"].read())
+    name = segment_name(segments[-1])
+    clients.s3().put_object(Bucket=bucket, Key=f"{prefix}snapshots/{name}.bin", Body=index.dump_snapshot())
+
+    # containers refresh far more often than this runs, so none still reads what the previous snapshot covers
+    expired = snapshots[:-1]
+    if snapshot:
+        expired += [key for key in list_keys(bucket, f"{prefix}segments/") if segment_name(key) <= snapshot]
+    for start in range(0, len(expired), 1000):
+        clients.s3().delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": key} for key in expired[start:start + 1000]]})
+    print(f"compacted {len(segments)} segments into {name}, {len(index)} hashes, deleted {len(expired)} objects")
+    return {"snapshot": name, "segments": len(segments), "hashes": len(index), "deleted": len(expired)}
@@ -0,0 +1,97 @@
+"Token bucket shared by every container through DynamoDB conditional writes, with a per-container fallback"
+import os
+import random
+import threading
+import time
+from decimal import Decimal
+
+from kyc_common import clients
+from kyc_common.metrics import emit_metrics
+
+rate_limit_table_name = os.environ.get("RATE_LIMIT_TABLE")
+# calls per second allowed by the account quota
+rate_limit_per_second = float(os.environ.get("RATE_LIMIT_PER_SECOND", 5))
+rate_limit_max_wait = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 10))
+
+
+class SharedTokenBucket:
+    "Paces calls to one service across every container, waiting for a token instead of getting throttled"
+
+    def __init__(self, name, rate=rate_limit_per_second, max_wait=rate_limit_max_wait, table_name=rate_limit_table_name):
+        self.name = name
+        self.rate = rate
+        self.max_wait = max_wait
+        self.table_name = table_name
+        # used when there is no shared rate limit table or it cannot be reached
+        self.local_tokens = rate
+        self.local_updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        "Waits for a token and returns the seconds spent waiting"
+        from botocore.exceptions import ClientError
+
+        start = time.monotonic()
+        while True:
+            try:
+                delay = self.try_acquire_shared() if self.table_name else self.try_acquire_local()
+            except ClientError as e:
+                # fall back to pacing this container alone if the shared bucket is unavailable
+                print(f"Shared rate limiter unavailable, using the local one: {str(e)}")
+                delay = self.try_acquire_local()
+
+            waited = time.monotonic() - start
+            if delay == 0:
+                break
+            if waited + delay > self.max_wait:
+                print(f"Waited {waited:.2f} s for a {self.name} token, calling anyway")
+                break
+            time.sleep(delay)
+
+        emit_metrics({"RateLimiter": self.name}, {"RateLimitWait": round(waited * 1000, 3)}, unit="Milliseconds")
+        return waited
+
+    def try_acquire_shared(self):
+        # refills the bucket from the elapsed time and takes a token, returning how long to wait if it is empty
+        rate_limit_table = clients.table(self.table_name)
+        now = time.time()
+        item = rate_limit_table.get_item(Key={"BUCKET": self.name}, ConsistentRead=True).get("Item")
+        if item is None:
+            tokens = self.rate
+        else:
+            elapsed = now - float(item["UPDATED_AT"])
+            tokens = min(self.rate, float(item["TOKENS"]) + elapsed * self.rate)
+        if tokens < 1:
+            return (1 - tokens) / self.rate
+
+        # the write only succeeds if no other container took a token since the read
+        if item is None:
+            condition = {"ConditionExpression": "attribute_not_exists(BUCKET)"}
+        else:
+            condition = {
+                "ConditionExpression": "UPDATED_AT = :updated_at",
+                "ExpressionAttributeValues": {":updated_at": item["UPDATED_AT"]},
+            }
+        try:
+            rate_limit_table.put_item(
+                Item={
+                    "BUCKET": self.name,
+                    "TOKENS": Decimal(str(round(tokens - 1, 6))),
+                    "UPDATED_AT": Decimal(str(round(now, 6))),
+                },
+                **condition,
+            )
+        except rate_limit_table.meta.client.exceptions.ConditionalCheckFailedException:
+            # lost the race for this token, try again shortly
+            return random.uniform(0.005, 0.02)
+        return 0
+
+    def try_acquire_local(self):
+        with self.lock:
+            now = time.monotonic()
+            self.local_tokens = min(self.rate, self.local_tokens + (now - self.local_updated_at) * self.rate)
+            self.local_updated_at = now
+            if self.local_tokens < 1:
+                return (1 - self.local_tokens) / self.rate
+            self.local_tokens -= 1
+            return 0
@@ -0,0 +1,39 @@
+"Records the outcome of an application in the customer metadata table"
+import os
+
+from kyc_common import clients
+
+
+def write_results_ddb(table_name, app_uuid, details_dict, check_results, submitted_at):
+    "Puts the details and every check result in the table with a single write, keeping newer submissions"
+    ddb_table = clients.table(table_name)
+    item = {**details_dict, **check_results, "SUBMITTED_AT": submitted_at}
+    attribute_names = {f"#a{i}": name for i, name in enumerate(item)}
+    attribute_values = {f":v{i}": value for i, value in enumerate(item.values())}
+    update_expression = "SET " + ", ".join(f"#a{i} = :v{i}" for i in range(len(item)))
+
+    try:
+        # only overwrite results from an older submission of the same application
+        response = ddb_table.update_item(
+            Key={
+                "APP_UUID": app_uuid
+            },
+            UpdateExpression=update_expression,
+            ConditionExpression="attribute_not_exists(SUBMITTED_AT) OR SUBMITTED_AT <= :submitted_at",
+            ExpressionAttributeNames=attribute_names,
+            ExpressionAttributeValues={**attribute_values, ":submitted_at": submitted_at},
+            ReturnConsumedCapacity="TOTAL",
+        )
+        print(f"consumed write capacity for {app_uuid}: {response['ConsumedCapacity']['CapacityUnits']}")
+    except ddb_table.meta.client.exceptions.ConditionalCheckFailedException:
+        print(f"a newer submission of {app_uuid} is already recorded, skipping the write")
+
+
+def record_details_rejected(table_name, app_uuid, reason, submitted_at):
+    "Records an application whose details file failed validation and notifies the customer, no paid check was run"
+    write_results_ddb(table_name, app_uuid, {}, {"DETAILS_VALID": False, "DETAILS_ERROR": reason}, submitted_at)
+    clients.sns().publish(
+        TopicArn=os.environ["TOPIC"],
+        Message=f"Details validation FAILED: {reason}",
+        Subject="Details validation FAILED",
+    )
@@ -0,0 +1,19 @@
+from kyc_common.idempotency import StageInProgressError, run_stage, upload_id
+from kyc_common.images import normalize_application
+
+
+def lambda_handler(event, context):
+    # shrinks the selfie and the license to what Rekognition and Textract need before any paid check
+    try:
+
+        bucket = event["detail"]["bucket"]["name"]
+        app_uuid = event["application"]["app_uuid"]
+
+        # a duplicated event or a retried execution reuses the images recorded by the first run
+        return run_stage("normalize", app_uuid, upload_id(event), lambda: normalize_application(bucket, app_uuid))
+
+    except StageInProgressError:
+        raise
+    except Exception as e:
+        # the checks fall back to the uploaded images when the stage returns nothing
+        print(f"Error: {str(e)}")
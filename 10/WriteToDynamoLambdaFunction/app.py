@@ -1,31 +1,91 @@
-import boto3
-import csv
+import json
 import os
 import shutil
-from aws_lambda_powertools import Tracer
+from datetime import datetime, timezone
+from aws_lambda_powertools import Metrics, Tracer
+from aws_lambda_powertools.metrics import MetricUnit
+from kyc_common import clients
+from kyc_common.details import load_details
+from kyc_common.idempotency import StageInProgressError, run_stage, upload_id
+from kyc_common.results import record_details_rejected, write_results_ddb
 
 env_table = os.environ["TABLE"]
+env_queue_url = os.environ.get("QUEUE_URL")
 
 unzipped_dir = "/tmp/unzipped/"
 unzipped_s3_prefix = "unzipped/"
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-ddb_table = dynamodb.Table(env_table)
-
 tracer = Tracer()
+metrics = Metrics(namespace="KycApp")
 
-def parse_csv_ddb(app_uuid, details_file):
-    # opens the customer details file and extracts the information row by row
-    with open(details_file, 'r', encoding="utf-8") as file:
-        reader = csv.DictReader(file)
-        details_dict = next(reader)
-    
-    # puts the extracted details in the dynamodb table
-    ddb_table.put_item(Item={**details_dict, "APP_UUID": app_uuid})
+# estimated price of the paid call behind each check, used for the per-mode cost report
+check_api_costs = {
+    "LICENSE_SELFIE_MATCH": float(os.environ.get("FACES_CHECK_COST", 0.001)),
+    "LICENSE_DETAILS_MATCH": float(os.environ.get("DETAILS_CHECK_COST", 0.025)),
+}
+
+def collect_check_results(event):
+    # gathers the results of the checks that ran, skipping checks that were not run or did not finish
+    results = [result for result in (event.get("checks") or {}).values() if result]
+
+    # in parallel_fail_fast mode the failed check reports its result through the caught error
+    if "checks_error" in event:
+        cause = json.loads(event["checks_error"]["Cause"])
+        results.append(json.loads(cause["errorMessage"]))
+
+    return results
+
+def merge_check_results(results):
+    # keeps only the check attributes that belong in the table
+    check_results = {}
+    for result in results:
+        check_results.update({name: value for name, value in result.items() if name != "api_called"})
+    return check_results
+
+def report_check_cost(application, results, submitted_at):
+    # records how many paid calls each check mode made and how long the application took end to end
+    metrics.add_dimension(name="CheckMode", value=application.get("check_mode", "parallel"))
+    api_cost = sum(
+        check_api_costs.get(name, 0)
+        for result in results if result.get("api_called")
+        for name in result
+    )
+    metrics.add_metric(name="ChecksRun", unit=MetricUnit.Count, value=len(results))
+    metrics.add_metric(name="ApiCalls", unit=MetricUnit.Count, value=sum(1 for result in results if result.get("api_called")))
+    metrics.add_metric(name="EstimatedApiCost", unit=MetricUnit.NoUnit, value=api_cost)
+
+    elapsed = datetime.now(timezone.utc) - datetime.fromisoformat(submitted_at)
+    metrics.add_metric(name="ApplicationLatency", unit=MetricUnit.Milliseconds, value=elapsed.total_seconds() * 1000)
+
+def record_application(bucket, event):
+    # writes the details with the check results once per upload and returns the license validation message
+    application = event["application"]
+    app_uuid = application["app_uuid"]
+    submitted_at = event.get("time", datetime.now(timezone.utc).isoformat())
+
+    # details that failed validation are recorded with the reason, there is no license to validate
+    if not application.get("details_valid", True):
+        record_details_rejected(env_table, app_uuid, application.get("details_error", "details file failed validation"), submitted_at)
+        return None
 
-    return details_dict
+    # the Unzip stage already parsed and validated the details, unless they were too large to pass inline
+    parsed_details_dict = load_details(bucket, application)
 
+    # write the details together with the results of the checks
+    results = collect_check_results(event)
+    write_results_ddb(env_table, app_uuid, parsed_details_dict, merge_check_results(results), submitted_at)
+    report_check_cost(application, results, submitted_at)
+
+    return {
+        "driver_license_id": parsed_details_dict["DOCUMENT_NUMBER"],
+        "validation_override": True,
+        "app_uuid": app_uuid
+    }
+
+def send_notification(notification):
+    clients.client("sqs").send_message(QueueUrl=env_queue_url, MessageBody=json.dumps(notification))
+
+@metrics.log_metrics    # flushing the check cost metrics at the end of every invocation
 @tracer.capture_lambda_handler    # tracing the lambda handler using X-Ray
 def lambda_handler(event, context):
     
@@ -34,22 +94,18 @@ def lambda_handler(event, context):
         # get the bucket and app uuid
         bucket = event["detail"]["bucket"]["name"]
         app_uuid = event["application"]["app_uuid"]
+
+        # a duplicated event or a retried execution gets the message recorded by the first run, without a second write
+        upload = upload_id(event)
+        notification = run_stage("write", app_uuid, upload, lambda: record_application(bucket, event))
+
+        # the license validation message is a stage too, so a duplicate never sends it twice
+        if notification and env_queue_url:
+            run_stage("send", app_uuid, upload, lambda: send_notification(notification))
+        return notification
         
-        # form the directory of details file
-        details_key = f"{unzipped_s3_prefix}{app_uuid}_details.csv"
-        details_file = f'/tmp/{app_uuid}_details.csv'
-        
-        # download the file using the directory and extract details from that file
-        s3.download_file(bucket, details_key, details_file)
-        parsed_details_dict = parse_csv_ddb(app_uuid, details_file)
-        
-        
-        return {
-            "driver_license_id": parsed_details_dict["DOCUMENT_NUMBER"],
-            "validation_override": True,
-            "app_uuid": app_uuid
-        }
-        
+    except StageInProgressError:
+        raise
     except Exception as e:
         print(f"Error: {str(e)}")
     finally:
@@ -6,12 +6,15 @@ import zipfile
 import boto3
 import shutil
 import csv
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # Environment variables:
 # TABLE = CustomerMetaDataTable
 
-unzipped_dir = "/tmp/unzipped/"
 unzipped_s3_prefix = "unzipped/"
+# number of records of one event processed at the same time, each in its own scratch directory
+record_concurrency = int(os.environ.get("RECORD_CONCURRENCY", 4))
 env_table = os.environ["TABLE"]
 env_topic = os.environ['TOPIC']
 
@@ -22,10 +25,11 @@ rekognition = boto3.client('rekognition')
 sns = boto3.client('sns')
 
 
-def unzip_object(bucket, key):
-    # get the zip file name and set the local path
+def unzip_object(bucket, key, scratch_dir):
+    # get the zip file name and set the local paths inside the scratch directory of the record
     zip_name = os.path.basename(key)
-    zip_fullpath = f'/tmp/{zip_name}'
+    zip_fullpath = os.path.join(scratch_dir, zip_name)
+    unzipped_dir = os.path.join(scratch_dir, "unzipped/")
 
     # download the zip file from S3
     s3.download_file(bucket, key, zip_fullpath)
@@ -98,16 +102,35 @@ def compare_faces(app_uuid, bucket, license_key, selfie_key):
     return valid_photo
     
 
-def lambda_handler(event, context):
+def s3_records(event):
+    # S3 notifications arrive directly, or wrapped in the body of an SQS message, each kept with its messageId
+    records = []
+    for record in event.get('Records', []):
+        if 'body' not in record:
+            records.append((None, record))
+            continue
+        try:
+            body = json.loads(record['body'])
+        except ValueError:
+            # an unreadable message fails as a record of its own, without failing the rest of the batch
+            records.append((record['messageId'], {}))
+            continue
+        records.extend((record['messageId'], s3_record) for s3_record in body.get('Records', []))
+    return records
+
+
+def process_record(record):
+    # every record gets its own scratch directory, so concurrent records never share extracted files
+    scratch_dir = tempfile.mkdtemp(prefix="record-", dir="/tmp")
+    outcome = {"status": "succeeded"}
     try:
-        print(event)
-
-        record = event['Records'][0]
         bucket = record['s3']['bucket']['name']
         key = record['s3']['object']['key']
+        outcome.update(bucket=bucket, key=key, app_uuid=os.path.basename(key).replace(".zip", ""))
 
         # unzip the object from the bucket using the key to get all the files
-        files_list = unzip_object(bucket, key)
+        unzipped_dir = os.path.join(scratch_dir, "unzipped/")
+        files_list = unzip_object(bucket, key, scratch_dir)
 
         # upload the unzipped files to the unzip prefix in s3
         for file in files_list:
@@ -136,11 +159,34 @@ def lambda_handler(event, context):
         rekognition_response = compare_faces(app_uuid, bucket, license_key, selfie_key)
         if not rekognition_response:
             raise ValueError('Photo rekognition match FAILED. Program will stop')
-    
+
     except Exception as e:
         print(f"Error: {str(e)}")
+        outcome.update(status="failed", error=str(e))
     finally:
-        # clean up /tmp/unzipped
-        if os.path.exists(unzipped_dir):
-            shutil.rmtree(unzipped_dir)
+        # clean up the scratch directory of the record
+        shutil.rmtree(scratch_dir, ignore_errors=True)
 
+    return outcome
+
+
+def lambda_handler(event, context):
+    print(event)
+
+    # process every record of the event, not only the first one
+    records = s3_records(event)
+    with ThreadPoolExecutor(max_workers=max(1, min(record_concurrency, len(records)))) as executor:
+        outcomes = list(executor.map(process_record, [record for _, record in records]))
+
+    # only the SQS messages with a failed record go back to the queue, the rest of the batch is deleted
+    failed_message_ids = []
+    for (message_id, _), outcome in zip(records, outcomes):
+        if outcome["status"] == "failed" and message_id is not None and message_id not in failed_message_ids:
+            failed_message_ids.append(message_id)
+
+    failed = sum(1 for outcome in outcomes if outcome["status"] == "failed")
+    print(f"processed {len(outcomes)} records, {failed} failed")
+    return {
+        "records": outcomes,
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed_message_ids],
+    }
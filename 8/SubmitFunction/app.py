@@ -1,37 +1,85 @@
 import os
 import json
-import requests
+import time
 import boto3
+from concurrent.futures import ThreadPoolExecutor
+from validation_client import CircuitBreaker, ValidationClient
 
 url = os.environ['INVOKE_URL']
 env_table = os.environ['TABLE']
 env_topic = os.environ['TOPIC']
 env_queue_url = os.environ['QUEUE_URL']
 
+# number of requests to the validation API in flight at the same time
+max_workers = int(os.environ.get('MAX_WORKERS', 4))
+# licenses sent in one request to the batch contract of the validation API, 1 uses the single-record contract
+validation_batch_size = int(os.environ.get('VALIDATION_BATCH_SIZE', 25))
+# time kept back from the function timeout to record the results and return the batch item failures
+deadline_margin = float(os.environ.get('DEADLINE_MARGIN_MS', 2000)) / 1000
+
 dynamodb = boto3.resource('dynamodb')
 ddb_table = dynamodb.Table(env_table)
 sns = boto3.client('sns')
 sqs = boto3.client('sqs')
 
-def lambda_handler(event, context):
+# one client per container keeps the connections alive and the breaker state across invocations
+breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5)),
+    reset_timeout=float(os.environ.get('BREAKER_RESET_TIMEOUT', 30)),
+)
+validation_client = ValidationClient(
+    url,
+    timeout=float(os.environ.get('VALIDATION_TIMEOUT', 5)),
+    max_retries=int(os.environ.get('VALIDATION_MAX_RETRIES', 3)),
+    hedge_after=float(os.environ.get('HEDGE_AFTER_MS', 0)) / 1000,
+    pool_size=max_workers,
+    breaker=breaker,
+)
 
-    print("Submitting license data to external validation API...")
-    
-    message_body = json.loads(event["Records"][0]["body"])
-    app_uuid = message_body.pop('uuid')
+def parse_message(record):
+    message_body = json.loads(record["body"])
+    # the state machine sends app_uuid, older messages used uuid
+    app_uuid = message_body.pop('app_uuid') if 'app_uuid' in message_body else message_body.pop('uuid')
     print(message_body)
-    
-    # send data to the external validation API
-    try:
-        req = requests.post(url, json=message_body, timeout=5)
-        req.raise_for_status()
-    except requests.RequestException as e:
-        print(f"HTTP error: {e}")
-        raise
-    
-    response_json = req.json()
-    validation_result = response_json.get("result", False)  # fallback to False if key missing
+    return app_uuid, message_body
+
+def invocation_deadline(context):
+    # the time.monotonic() value by which every request to the validation API has to be finished
+    if context is None:
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - deadline_margin
+
+def validate_licenses(message_bodies, deadline):
+    # send data to the external validation API, coalescing the licenses into one batch request
+    if validation_batch_size == 1:
+        payload = message_bodies[0]
+    else:
+        payload = {"records": message_bodies}
+
+    response_json = validation_client.post(payload, deadline)
+    if validation_batch_size == 1:
+        return [response_json.get("result", False)]  # fallback to False if key missing
+
+    # the batch contract returns one result per record, in the order they were sent
+    results = response_json["results"]
+    if len(results) != len(message_bodies):
+        raise ValueError(f"Validation API returned {len(results)} results for {len(message_bodies)} licenses")
+    return [result.get("result", False) for result in results]
+
+def submit_licenses(messages, deadline):
+    # messages is a list of (message_id, app_uuid, message_body) validated with a single request
+    validation_results = validate_licenses([message_body for _, _, message_body in messages], deadline)
+
+    failed_message_ids = []
+    for (message_id, app_uuid, _), validation_result in zip(messages, validation_results):
+        try:
+            record_validation(app_uuid, validation_result)
+        except Exception as e:
+            print(f"Error recording message {message_id}: {str(e)}")
+            failed_message_ids.append(message_id)
+    return failed_message_ids
 
+def record_validation(app_uuid, validation_result):
     # updates dynamodb table with the validation result
     ddb_table.update_item(
         Key={
@@ -42,7 +90,7 @@ def lambda_handler(event, context):
             ':v_match': validation_result
             }
     )
-    
+
     # publish a notification to SNS if validation fails
     if not validation_result:
         sns.publish(
@@ -50,11 +98,40 @@ def lambda_handler(event, context):
             Message= 'License validation by third party FAILED',
             Subject='License validation by third party FAILED',
         )
-    
-    print("License validation completed...")
 
-    
-    
-    
-    
+    return validation_result
+
+def lambda_handler(event, context):
+
+    print("Submitting license data to external validation API...")
+    deadline = invocation_deadline(context)
+
+    records = event["Records"]
+    failed_message_ids = []
+    messages = []
+    for record in records:
+        try:
+            messages.append((record["messageId"], *parse_message(record)))
+        except Exception as e:
+            print(f"Error parsing message {record['messageId']}: {str(e)}")
+            failed_message_ids.append(record["messageId"])
+
+    # coalesce the messages into batch requests and send a bounded number of them at a time
+    chunks = [messages[i:i + validation_batch_size] for i in range(0, len(messages), validation_batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(chunk, executor.submit(submit_licenses, chunk, deadline)) for chunk in chunks]
+
+    for chunk, future in futures:
+        try:
+            failed_message_ids.extend(future.result())
+        except Exception as e:
+            # the whole request failed or was not sent before the deadline, so every message in it is redelivered
+            print(f"Error submitting {len(chunk)} messages: {str(e)}")
+            failed_message_ids.extend(message_id for message_id, _, _ in chunk)
+
+    # only the failed messages go back to the queue to be redelivered
+    batch_item_failures = [{"itemIdentifier": message_id} for message_id in failed_message_ids]
 
+    print(f"License validation completed for {len(records) - len(batch_item_failures)} of {len(records)} messages...")
+    print(f"Validation API circuit: {breaker.snapshot()}")
+    return {"batchItemFailures": batch_item_failures}
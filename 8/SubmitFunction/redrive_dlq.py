@@ -0,0 +1,138 @@
+"Drains LicenseDeadLetterQueue and replays the messages through the SubmitFunction handler logic"
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket:
+    "Paces message replays to the vendor quota, allowing bursts of up to one second's worth"
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.refilled_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count=1):
+        # waits until count tokens are available, a rate of 0 disables pacing
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(max(self.rate, count), self.tokens + (now - self.refilled_at) * self.rate)
+                self.refilled_at = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return waited
+                delay = (count - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def to_lambda_record(message):
+    # the handler expects the shape of an SQS event record
+    return {
+        "messageId": message["MessageId"],
+        "receiptHandle": message["ReceiptHandle"],
+        "body": message["Body"],
+    }
+
+
+def replay_batch(sqs, queue_url, handler, bucket, messages, summary, lock):
+    waited = bucket.acquire(len(messages))
+    records = [to_lambda_record(message) for message in messages]
+    try:
+        response = handler({"Records": records}, None)
+        failed_ids = {failure["itemIdentifier"] for failure in response["batchItemFailures"]}
+    except Exception as e:
+        print(f"Error replaying {len(records)} messages: {str(e)}")
+        failed_ids = {record["messageId"] for record in records}
+
+    # replayed messages leave the DLQ, failed ones become visible again once their visibility timeout ends
+    replayed = [record for record in records if record["messageId"] not in failed_ids]
+    for i in range(0, len(replayed), 10):
+        sqs.delete_message_batch(QueueUrl=queue_url, Entries=[
+            {"Id": str(j), "ReceiptHandle": record["receiptHandle"]}
+            for j, record in enumerate(replayed[i:i + 10])
+        ])
+
+    with lock:
+        summary["replayed"] += len(replayed)
+        summary["failed"] += len(failed_ids)
+        summary["rate_limit_wait_seconds"] += waited
+
+
+def redrive(sqs, queue_url, handler, workers=4, rate=10.0, batch_size=100, max_messages=0,
+            visibility_timeout=300, progress_every=500):
+    "Replays the queue through handler and returns a summary, stopping once the queue is empty or max_messages is reached"
+    bucket = TokenBucket(rate)
+    summary = {"received": 0, "replayed": 0, "failed": 0, "rate_limit_wait_seconds": 0.0}
+    lock = threading.Lock()
+    # bounds the messages received but not yet replayed, so none outlive their visibility timeout
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    start = time.perf_counter()
+    next_progress = progress_every
+
+    def run(batch):
+        try:
+            replay_batch(sqs, queue_url, handler, bucket, batch, summary, lock)
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while not max_messages or summary["received"] < max_messages:
+            # SQS returns at most 10 messages per receive, so batches are built from several receives
+            batch = []
+            while len(batch) < batch_size:
+                response = sqs.receive_message(
+                    QueueUrl=queue_url,
+                    MaxNumberOfMessages=min(10, batch_size - len(batch)),
+                    VisibilityTimeout=visibility_timeout,
+                    WaitTimeSeconds=1,
+                )
+                messages = response.get("Messages", [])
+                if not messages:
+                    break
+                batch.extend(messages)
+            if not batch:
+                break
+
+            summary["received"] += len(batch)
+            in_flight.acquire()
+            executor.submit(run, batch)
+
+            if summary["received"] >= next_progress:
+                elapsed = time.perf_counter() - start
+                print(f"received {summary['received']} messages, replayed {summary['replayed']}, "
+                      f"failed {summary['failed']}, {summary['replayed'] / elapsed:.1f} msg/s")
+                next_progress += progress_every
+
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    summary["rate_limit_wait_seconds"] = round(summary["rate_limit_wait_seconds"], 2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--queue-url", default=os.environ.get("DLQ_URL"), required="DLQ_URL" not in os.environ)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=10.0, help="messages per second allowed by the vendor quota, 0 for no limit")
+    parser.add_argument("--batch-size", type=int, default=100, help="messages handed to the handler at once")
+    parser.add_argument("--max-messages", type=int, default=0, help="stop after this many messages, 0 drains the queue")
+    args = parser.parse_args()
+
+    # the handler module needs the same environment as the deployed SubmitFunction
+    import boto3
+    import app
+
+    summary = redrive(boto3.client("sqs"), args.queue_url, app.lambda_handler, args.workers, args.rate,
+                      args.batch_size, args.max_messages)
+    print(f"Redrive summary: {summary}")
+
+
+if __name__ == "__main__":
+    main()
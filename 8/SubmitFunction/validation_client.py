@@ -0,0 +1,171 @@
+"Outbound client for the external license validation API with retries, a circuit breaker and hedged requests"
+import json
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# responses worth retrying, everything else in the 4xx range is the caller's fault
+retryable_status_codes = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    "Raised without calling the API while the vendor is considered down"
+
+
+class DeadlineExceededError(Exception):
+    "Raised instead of starting an attempt or a backoff that would outlast the invocation"
+
+
+class CircuitBreaker:
+    "Opens after consecutive failures, then lets a single probe through once the reset timeout has passed"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError("Validation API circuit is open, failing fast")
+                self.transition("half_open")
+            if self.state == "half_open":
+                if self.probe_in_flight:
+                    raise CircuitOpenError("Validation API circuit is half open and a probe is in flight")
+                self.probe_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+            if self.state != "closed":
+                self.transition("closed")
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != "open":
+                    self.transition("open")
+
+    def transition(self, state):
+        # every state change is logged as an embedded metric so the breaker can be graphed and alarmed on
+        self.state = state
+        print(json.dumps({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": "KycApp",
+                    "Dimensions": [["CircuitState"]],
+                    "Metrics": [{"Name": "CircuitTransitions", "Unit": "Count"}],
+                }],
+            },
+            "CircuitState": state,
+            "CircuitTransitions": 1,
+            "ConsecutiveFailures": self.consecutive_failures,
+        }))
+
+    def snapshot(self):
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive_failures}
+
+
+class ValidationClient:
+    "Keeps connections alive, retries with exponential backoff and full jitter, and optionally hedges slow requests"
+
+    def __init__(self, url, timeout=5, max_retries=3, backoff_base=0.2, backoff_max=2.0,
+                 hedge_after=0.0, pool_size=4, breaker=None, min_attempt_time=0.5):
+        self.url = url
+        self.timeout = timeout
+        # an attempt is not started with less time than this left before the deadline
+        self.min_attempt_time = min_attempt_time
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker(failure_threshold=5, reset_timeout=30)
+
+        # hedged requests need a second connection per worker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size * 2)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.hedge_executor = ThreadPoolExecutor(max_workers=pool_size * 2)
+
+    def post(self, payload, deadline=None):
+        "Posts the payload and returns the decoded JSON response, retrying transient failures until the time.monotonic() deadline"
+        for attempt in range(self.max_retries + 1):
+            timeout = self.attempt_timeout(deadline)
+            self.breaker.before_call()
+            try:
+                response = self.post_hedged(payload, timeout)
+            except requests.RequestException as e:
+                if not self.is_retryable(e):
+                    # the vendor answered, the request itself was rejected
+                    self.breaker.record_success()
+                    print(f"HTTP error: {e}")
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    print(f"HTTP error: {e}")
+                    raise
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if deadline is not None and time.monotonic() + delay + self.min_attempt_time > deadline:
+                    print(f"HTTP error: {e}, no time left to retry")
+                    raise DeadlineExceededError(f"Validation API failed and the invocation has no time left to retry: {e}") from e
+                print(f"HTTP error: {e}, retrying in {delay:.2f} s")
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return response.json()
+
+    def attempt_timeout(self, deadline):
+        # every attempt has to finish before the deadline, so the last one gets whatever time is left
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.monotonic()
+        if remaining < self.min_attempt_time:
+            raise DeadlineExceededError(f"Only {max(remaining, 0):.2f} s left before the deadline, not calling the validation API")
+        return min(self.timeout, remaining)
+
+    def is_retryable(self, error):
+        if isinstance(error, requests.HTTPError):
+            return error.response is not None and error.response.status_code in retryable_status_codes
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+    def post_once(self, payload, timeout):
+        response = self.session.post(self.url, json=payload, timeout=timeout)
+        response.raise_for_status()
+        return response
+
+    def post_hedged(self, payload, timeout):
+        # sends a second identical request if the first is slower than hedge_after, and keeps whichever succeeds first
+        if self.hedge_after <= 0 or self.hedge_after >= timeout:
+            return self.post_once(payload, timeout)
+
+        pending = {self.hedge_executor.submit(self.post_once, payload, timeout)}
+        done, pending = wait(pending, timeout=self.hedge_after)
+        if not done:
+            pending.add(self.hedge_executor.submit(self.post_once, payload, timeout - self.hedge_after))
+
+        error = None
+        while done or pending:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        raise error
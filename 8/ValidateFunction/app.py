@@ -1,14 +1,22 @@
 "Fake driver license API responds with the validation_override"
 import json
 
+def validate_license(body_json):
+    "Validates one license record by echoing its validation_override"
+    license_id = body_json['driver_license_id']
+    override_parameter = body_json['validation_override']
+    return {'driver_license_id': license_id, 'result': override_parameter}
+
 def lambda_handler(event, context):
-    "Takes API gateway event and responds with the validation_override"
+    "Takes API gateway event and responds with the validation_override of one record or a batch of records"
     body = event['body']
     body_json = json.loads(body)
-    license_id = body_json['driver_license_id']
-    override_parameter = body_json['validation_override']
 
     response = {}
     response['statusCode'] = 200
-    response['body'] = override_parameter
-    return response
\ No newline at end of file
+    if 'records' in body_json:
+        # batch contract: many license records in, one result per record out in the same order
+        response['body'] = json.dumps({'results': [validate_license(record) for record in body_json['records']]})
+    else:
+        response['body'] = json.dumps(validate_license(body_json))
+    return response
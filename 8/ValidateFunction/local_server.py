@@ -0,0 +1,151 @@
+"Local HTTP stand-in for the license validation API with configurable latency, errors, throttling and slow bodies"
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app import lambda_handler
+
+
+class ServerConfig:
+    "Fault and latency settings, shared by every request the server handles"
+
+    def __init__(self, latency="fixed:0", error_rate=0.0, throttle_rate=0.0, rate_limit=0.0,
+                 slow_body_rate=0.0, slow_body_delay=0.05, seed=None):
+        # latency is "fixed:<ms>", "uniform:<min ms>:<max ms>" or "lognormal:<median ms>:<sigma>"
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        # requests per second accepted before answering 429, 0 disables the limit
+        self.rate_limit = rate_limit
+        self.slow_body_rate = slow_body_rate
+        # pause between each byte of a slow body
+        self.slow_body_delay = slow_body_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = rate_limit
+        self.refilled_at = time.monotonic()
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "throttled": 0, "slow_bodies": 0}
+
+    def sample_latency(self):
+        kind, *params = self.latency.split(":")
+        params = [float(param) for param in params]
+        with self.lock:
+            if kind == "uniform":
+                return self.random.uniform(params[0], params[1]) / 1000
+            if kind == "lognormal":
+                return self.random.lognormvariate(0, params[1]) * params[0] / 1000
+            return params[0] / 1000
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def take_token(self):
+        # token bucket refilled at rate_limit per second, with one second of burst
+        if self.rate_limit <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.refilled_at) * self.rate_limit)
+            self.refilled_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def count(self, outcome):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats[outcome] += 1
+
+
+class ValidationRequestHandler(BaseHTTPRequestHandler):
+    "Answers every POST through the ValidateFunction handler after applying the configured faults"
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        config = self.server.config
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if not config.take_token() or config.roll(config.throttle_rate):
+            config.count("throttled")
+            return self.respond(429, json.dumps({"message": "Too Many Requests"}), {"Retry-After": "1"})
+
+        time.sleep(config.sample_latency())
+
+        if config.roll(config.error_rate):
+            config.count("errors")
+            return self.respond(500, json.dumps({"message": "Internal Server Error"}))
+
+        response = lambda_handler({"body": body.decode("utf-8")}, None)
+        if config.roll(config.slow_body_rate):
+            config.count("slow_bodies")
+            return self.respond(response["statusCode"], response["body"], slow=True)
+
+        config.count("ok")
+        self.respond(response["statusCode"], response["body"])
+
+    def respond(self, status, body, headers=None, slow=False):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        if not slow:
+            self.wfile.write(data)
+            return
+        # trickle the body out one byte at a time to exercise client read timeouts
+        for i in range(len(data)):
+            self.wfile.write(data[i:i + 1])
+            self.wfile.flush()
+            time.sleep(self.server.config.slow_body_delay)
+
+    def log_message(self, format, *args):
+        # keep benchmark output readable, the stats carry the outcome of every request
+        pass
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    "Starts the server on a background thread and returns it with its /license URL, call shutdown() to stop it"
+    server = ThreadingHTTPServer((host, port), ValidationRequestHandler)
+    server.daemon_threads = True
+    server.config = config or ServerConfig()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/license"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", default="fixed:0", help="fixed:<ms>, uniform:<min>:<max> or lognormal:<median>:<sigma>")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before answering 429")
+    parser.add_argument("--slow-body-rate", type=float, default=0.0)
+    parser.add_argument("--slow-body-delay", type=float, default=0.05)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = ServerConfig(args.latency, args.error_rate, args.throttle_rate, args.rate_limit,
+                          args.slow_body_rate, args.slow_body_delay, args.seed)
+    server, url = start_server(config, args.host, args.port)
+    print(f"Validation API stand-in listening on {url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(config.stats))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,62 @@
-import boto3
+import json
 import os
-import zipfile
 import shutil
+import zipfile
+from kyc_common.archive import ArchiveRejectedError, extract_application, unzipped_dir, unzipped_s3_prefix
+from kyc_common.details import parse_details
+from kyc_common.idempotency import StageInProgressError, run_stage, upload_id
+
+
+# "stream" pipes each zip member straight to S3, "ranged" fetches only the expected members
+# with range GETs, "disk" keeps the old /tmp staging path
+unzip_mode = os.environ.get("UNZIP_MODE", "stream")
+# order of the paid checks, chosen per deployment: parallel, parallel_fail_fast, faces_first or details_first
+check_mode = os.environ.get("CHECK_MODE", "parallel")
+# details payloads larger than this are passed to the next states as an S3 pointer instead
+details_inline_max_bytes = int(os.environ.get("DETAILS_INLINE_MAX_BYTES", 8192))
+
+def unzip_application(bucket, key, app_uuid):
+    # extract the archive and validate the details, the result is passed to the next states
+    details_name = f'{app_uuid}_details.csv'
+
+    # extract the members to the unzip prefix, keeping the details file in memory
+    file_digests, details_bytes = extract_application(bucket, key, app_uuid, unzip_mode)
+
+    # extract the selfie_key
+    selfie_key = f'{unzipped_s3_prefix}{app_uuid}_selfie.png'
+
+    # extract the license_key
+    license_key = f'{unzipped_s3_prefix}{app_uuid}_license.png'
 
-unzipped_dir = "/tmp/unzipped/"
-unzipped_s3_prefix = "unzipped/"
+    # extract the details_file
+    details_file = f'{unzipped_dir}{app_uuid}_details.csv'
 
-s3 = boto3.client('s3')
+    # print(f"app_uuid = {app_uuid}")
+    # print(f"selfie_key = {selfie_key}")
+    # print(f"license_key = {license_key}")
+    # print(f"details_file = {details_file}")
 
-def unzip_object(bucket, key):
-    # get the zip file name and set the local path
-    zip_name = os.path.basename(key)
-    zip_fullpath = f'/tmp/{zip_name}'
+    # content hashes of the images let the checks reuse results for identical resubmissions
+    digests = {
+        "selfie": file_digests.get(f'{app_uuid}_selfie.png'),
+        "license": file_digests.get(f'{app_uuid}_license.png'),
+    }
+    application = { "app_uuid": app_uuid, "digests": digests, "check_mode": check_mode}
 
-    # download the zip file from S3
-    s3.download_file(bucket, key, zip_fullpath)
-    with zipfile.ZipFile(zip_fullpath, 'r') as zip_ref:
-        zip_ref.extractall(unzipped_dir)
-    os.remove(zip_fullpath)
+    # validating the details locally is cheap, so it runs before any paid check
+    try:
+        if details_bytes is None:
+            raise ValueError(f"Archive {key} has no {details_name}")
+        details_dict = parse_details(details_bytes)
+    except ValueError as e:
+        print(f"Details rejected: {str(e)}")
+        return { **application, "details_valid": False, "details_error": str(e)}
+
+    # pass the parsed details along in the state, or a pointer to them if they are too large
+    if len(json.dumps(details_dict)) > details_inline_max_bytes:
+        return { **application, "details_valid": True, "details_key": unzipped_s3_prefix + details_name}
 
-    # list all the files in the unzip prefix/folder
-    zipped_files = os.listdir(unzipped_dir)
-    return zipped_files
+    return { **application, "details_valid": True, "details": details_dict}
 
 def lambda_handler(event, context):
     try:
@@ -30,37 +65,21 @@ def lambda_handler(event, context):
         bucket = event['detail']['bucket']['name']
         key = event['detail']['object']['key']
 
-        # unzip the object from the bucket using the key to get all the files
-        files_list = unzip_object(bucket, key)
-
-        # upload the unzipped files to the unzip prefix in s3
-        for file in files_list:
-            s3.upload_file(unzipped_dir + file, bucket, unzipped_s3_prefix + file)
-
         # extract the app_uuid
         app_uuid = os.path.basename(key).replace(".zip", "")
 
-        # extract the selfie_key
-        selfie_key = f'{unzipped_s3_prefix}{app_uuid}_selfie.png'
-
-        # extract the license_key
-        license_key = f'{unzipped_s3_prefix}{app_uuid}_license.png'
-
-        # extract the details_file
-        details_file = f'{unzipped_dir}{app_uuid}_details.csv'
-
-        # print(f"app_uuid = {app_uuid}")
-        # print(f"selfie_key = {selfie_key}")
-        # print(f"license_key = {license_key}")
-        # print(f"details_file = {details_file}")
-        
-        return { "app_uuid": app_uuid}
-    
+        # a duplicated event or a retried execution gets the application recorded by the first run
+        return run_stage("unzip", app_uuid, upload_id(event), lambda: unzip_application(bucket, key, app_uuid))
 
+    except StageInProgressError:
+        raise
+    except (ArchiveRejectedError, zipfile.BadZipFile) as e:
+        # fail the task so the state machine can route the rejected archive
+        print(f"Archive rejected: {str(e)}")
+        raise ArchiveRejectedError(str(e)) from e
     except Exception as e:
         print(f"Error: {str(e)}")
     finally:
         # clean up /tmp/unzipped
         if os.path.exists(unzipped_dir):
             shutil.rmtree(unzipped_dir)
-
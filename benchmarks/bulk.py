@@ -0,0 +1,108 @@
+"Throughput of BulkOnboardingStateMachine on bulk archives of synthetic applicants, run in-process against the local stand-ins"
+import argparse
+import contextlib
+import os
+import time
+
+from pipeline import (Pipeline, bucket, configure_environment, load_handler, percentile, register_license, repo_root,
+                      stage_names)
+from local.applicants import make_applicants, make_bulk_archive
+from local.state_machine import StateMachine, lambda_resource, load_definition, s3_item_reader, s3_result_writer
+
+
+def run_batch(args, size, seed):
+    pipeline = Pipeline(args.api_latency_ms / 1000, args.s3_latency_ms / 1000, args.max_concurrency,
+                        args.task_overhead_ms / 1000)
+    split, _ = load_handler("bulk_split", "10/BulkSplitLambdaFunction")
+    definition = load_definition(repo_root / "10" / "template.yaml", "BulkOnboardingStateMachine")
+    definition["States"]["ProcessApplicants"]["MaxConcurrency"] = args.max_concurrency
+    state_machine = StateMachine(
+        definition,
+        {
+            **pipeline.resources,
+            "BulkSplitLambdaFunction": lambda_resource(split),
+            "arn:aws:states:::s3:getObject": s3_item_reader(pipeline.s3),
+            "arn:aws:states:::s3:putObject": s3_result_writer(pipeline.s3),
+        },
+        references={"DocumentBucket": bucket},
+        # every child execution runs both checks at once on the shared Parallel executor
+        max_workers=args.max_concurrency * 2,
+    )
+
+    applicants = make_applicants(size, [args.image_kb * 1024], args.mismatch_rate, args.invalid_rate, seed)
+    for applicant in applicants:
+        register_license(pipeline.textract, applicant)
+    key = f"bulk/incoming/batch-{size}.zip"
+    pipeline.s3.put_object(Bucket=bucket, Key=key, Body=make_bulk_archive(applicants))
+
+    start = time.perf_counter()
+    # the handlers log every event and result, which would drown the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        execution = state_machine.execute({
+            "time": "2026-01-01T00:00:00+00:00",
+            "detail": {"bucket": {"name": bucket}, "object": {"key": key}},
+        })
+    elapsed = time.perf_counter() - start
+    state_machine.executor.shutdown()
+    pipeline.state_machine.executor.shutdown()
+    return execution, elapsed, applicants, pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1000, 10000], help="applicants per bulk archive")
+    parser.add_argument("--max-concurrency", type=int, default=40, help="MaxConcurrency of the ProcessApplicants map")
+    parser.add_argument("--image-kb", type=int, default=2, help="size of every selfie and license image")
+    parser.add_argument("--mismatch-rate", type=float, default=0.1, help="share of licenses that disagree with the form")
+    parser.add_argument("--invalid-rate", type=float, default=0.02, help="share of manifest rows that break the details schema")
+    parser.add_argument("--api-latency-ms", type=float, default=100, help="latency of each Rekognition and Textract call")
+    parser.add_argument("--api-rate", type=float, help="Rekognition and Textract calls per second allowed by the rate limiter")
+    parser.add_argument("--s3-latency-ms", type=float, default=5, help="latency of each S3 request")
+    parser.add_argument("--task-overhead-ms", type=float, default=20,
+                        help="state transition and Lambda invoke added to every Task of the child executions")
+    parser.add_argument("--check-mode", default="parallel",
+                        choices=["parallel", "parallel_fail_fast", "faces_first", "details_first"],
+                        help="CheckMode the batch is split with, the order of the paid checks of every applicant")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # BulkSplitLambdaFunction is deployed with more upload threads than the single archive functions
+    os.environ.setdefault("UPLOAD_CONCURRENCY", "32")
+    os.environ["CHECK_MODE"] = args.check_mode
+    if args.api_rate:
+        # the limiter reads its settings at import, and a saturated quota makes every call wait its turn
+        os.environ["RATE_LIMIT_PER_SECOND"] = str(args.api_rate)
+        os.environ["RATE_LIMIT_MAX_WAIT"] = "3600"
+    configure_environment()
+
+    for level, size in enumerate(args.batch_sizes):
+        execution, elapsed, applicants, pipeline = run_batch(args, size, args.seed + level)
+        if execution["status"] == "FAILED":
+            print(f"\n{size} applicants: {execution['error']} {execution['cause'][:200]}")
+            continue
+
+        batch = execution["output"]["batch"]
+        durations = {}
+        for entry in execution["history"]:
+            durations.setdefault(stage_names.get(entry["state"], entry["state"]), []).append(entry["duration_ms"])
+        split_s = durations["SplitBulkArchive"][0] / 1000
+        fan_out_s = durations["ProcessApplicants"][0] / 1000
+        passed = sum(
+            1 for applicant in applicants
+            if all(pipeline.table.items.get(applicant.app_uuid, {}).get(name) is True
+                   for name in ("LICENSE_SELFIE_MATCH", "LICENSE_DETAILS_MATCH"))
+        )
+        print(f"\n{size} applicants, {args.check_mode}, map concurrency {args.max_concurrency}: {size / elapsed:.1f} applicants/s overall, "
+              f"split {split_s:.1f} s ({size / split_s:.0f} applicants/s), fan-out {fan_out_s:.1f} s "
+              f"({batch['applicants'] / fan_out_s:.1f} applicants/s)")
+        print(f"recorded {batch['applicants']}, already recorded {batch['already_recorded']}, rejected rows {batch['rejected']}, "
+              f"passed {passed}, PutItem {pipeline.table.calls['put_item']}, S3 {pipeline.s3.calls}, "
+              f"Rekognition {pipeline.rekognition.calls}, Textract {pipeline.textract.calls}")
+        print(f"{'state':>20} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, values in durations.items():
+            print(f"{name:>20} {len(values):>6} {percentile(values, 0.5):>8.1f} {percentile(values, 0.95):>8.1f} "
+                  f"{percentile(values, 0.99):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
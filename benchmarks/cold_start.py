@@ -0,0 +1,163 @@
+"Cold start profile of every Lambda handler: import breakdown, first-invoke latency and peak RSS in fresh interpreters"
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root / "8" / "ValidateFunction"))
+layer_dir = repo_root / "10" / "KycCommonLayer"
+probe_path = Path(__file__).resolve().parent / "cold_start_probe.py"
+
+from local_server import start_server
+
+# handler directory and the environment each function is deployed with
+functions = {
+    "Unzip": (repo_root / "9" / "UnzipLambdaFunction", {}),
+    "NormalizeImages": (repo_root / "10" / "NormalizeImagesLambdaFunction", {}),
+    "CompareFaces": (repo_root / "9" / "CompareFacesLambdaFunction", {"TABLE": "CustomerMetadataTable"}),
+    "CompareDetails": (repo_root / "9" / "CompareDetailsLambdaFunction", {"TABLE": "CustomerMetadataTable"}),
+    "WriteToDynamo": (repo_root / "10" / "WriteToDynamoLambdaFunction", {"TABLE": "CustomerMetadataTable", "QUEUE_URL": "LicenseQueue"}),
+    "Express": (repo_root / "10" / "ExpressLambdaFunction", {"TABLE": "CustomerMetadataTable", "QUEUE_URL": "LicenseQueue"}),
+    "Submit": (repo_root / "8" / "SubmitFunction", {
+        "TABLE": "CustomerMetadataTable",
+        "QUEUE_URL": "LicenseQueue",
+        "VALIDATION_BATCH_SIZE": "1",
+    }),
+    "Validate": (repo_root / "8" / "ValidateFunction", {}),
+}
+
+common_env = {
+    "TOPIC": "arn:aws:sns:us-east-1:000000000000:ApplicationNotifications",
+    "STAGE_TABLE": "StageMarkerTable",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "local",
+    "AWS_SECRET_ACCESS_KEY": "local",
+    # the X-Ray daemon is not running locally
+    "POWERTOOLS_TRACE_DISABLED": "true",
+}
+
+# summarised across runs, and compared against the baseline report
+measured = ["import_ms", "first_invoke_ms", "peak_rss_mb"]
+
+
+def run_probe(name, invoke_url, importtime=False):
+    function_dir, env = functions[name]
+    process_env = {
+        **os.environ,
+        **common_env,
+        **env,
+        "INVOKE_URL": invoke_url,
+        "PYTHONPATH": os.pathsep.join([str(function_dir), str(layer_dir), str(repo_root)]),
+    }
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []), str(probe_path), name]
+    completed = subprocess.run(command, cwd=function_dir, env=process_env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{name} probe failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+
+def import_breakdown(stderr, top):
+    # sums the self time of every module imported by the handler, grouped by top-level package
+    packages = {}
+    inside = False
+    for line in stderr.splitlines():
+        if line.startswith("cold_start_probe: import"):
+            inside = line.endswith("start")
+            continue
+        if not inside or not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _, module = line.removeprefix("import time:").split("|")
+        package = module.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return [[package, round(us / 1000, 1)] for package, us in ranked[:top]]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def profile(name, runs, top, invoke_url):
+    samples = [run_probe(name, invoke_url)[0] for _ in range(runs)]
+    # -X importtime slows the import down, so the breakdown comes from one extra run that is not timed
+    _, stderr = run_probe(name, invoke_url, importtime=True)
+    result = {
+        metric: {
+            "median": round(statistics.median(sample[metric] for sample in samples), 1),
+            "p90": round(percentile([sample[metric] for sample in samples], 0.9), 1),
+        }
+        for metric in measured
+    }
+    result["boto3_at_init"] = samples[0]["boto3_at_init"]
+    result["succeeded"] = all(sample["succeeded"] for sample in samples)
+    result["top_imports_ms"] = import_breakdown(stderr, top)
+    return result
+
+
+def compare(report, baseline, threshold, min_delta):
+    "Returns a line for every median that grew by more than threshold and min_delta since the baseline"
+    regressions = []
+    for name, result in report["functions"].items():
+        previous = baseline["functions"].get(name)
+        if previous is None:
+            continue
+        for metric in measured:
+            before, after = previous[metric]["median"], result[metric]["median"]
+            if after - before > min_delta and after > before * (1 + threshold):
+                regressions.append(f"{name} {metric}: {before} -> {after}")
+    return regressions
+
+
+def print_report(report):
+    print(f"{'function':>15} {'import ms':>16} {'first invoke ms':>16} {'peak RSS MB':>12} {'boto3 at init':>14}  top imports (ms)")
+    for name, result in report["functions"].items():
+        import_ms, invoke_ms = result["import_ms"], result["first_invoke_ms"]
+        top_imports = ", ".join(f"{package} {ms}" for package, ms in result["top_imports_ms"])
+        print(f"{name:>15} {import_ms['median']:>7} p90 {import_ms['p90']:>4} {invoke_ms['median']:>7} p90 {invoke_ms['p90']:>4} "
+              f"{result['peak_rss_mb']['median']:>12} {str(result['boto3_at_init']):>14}  {top_imports}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters started per function")
+    parser.add_argument("--functions", nargs="+", default=list(functions), choices=list(functions))
+    parser.add_argument("--top", type=int, default=5, help="packages listed in the import breakdown")
+    parser.add_argument("--output", help="write the report as JSON, to commit as the next baseline")
+    parser.add_argument("--compare", help="baseline report to check for regressions, exits 1 if any are found")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative growth of a median reported as a regression")
+    parser.add_argument("--min-delta", type=float, default=5.0, help="absolute growth below which differences are noise")
+    args = parser.parse_args()
+
+    # SubmitFunction validates its first license against the local stand-in of the validation API
+    server, invoke_url = start_server()
+    try:
+        report = {
+            "python": platform.python_version(),
+            "runs": args.runs,
+            "functions": {name: profile(name, args.runs, args.top, invoke_url) for name in args.functions},
+        }
+    finally:
+        server.shutdown()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold, args.min_delta)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"Runs inside a fresh interpreter for cold_start.py: imports one handler, invokes it once and prints the timings"
+import sys
+import time
+
+# everything the probe needs besides the handler is imported after the handler, so it stays out of the INIT numbers
+function_name = sys.argv[1]
+print("cold_start_probe: import start", file=sys.stderr, flush=True)
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+print("cold_start_probe: import end", file=sys.stderr, flush=True)
+
+import contextlib
+import io
+import json
+import os
+import resource
+import zipfile
+
+from local import stand_ins
+
+boto3_at_init = "boto3" in sys.modules
+bucket = "kyc-applications"
+app_uuid = "00000000-0000-4000-8000-000000000000"
+details = {
+    "DOCUMENT_NUMBER": "D12345678",
+    "FIRST_NAME": "JANE",
+    "LAST_NAME": "DOE",
+    "DATE_OF_BIRTH": "1990-01-01",
+    "ADDRESS": "1 MAIN ST",
+    "STATE_IN_ADDRESS": "NY",
+    "CITY_IN_ADDRESS": "NEW YORK",
+    "ZIP_CODE_IN_ADDRESS": "10001",
+}
+s3 = stand_ins.S3()
+s3.put_object(Bucket=bucket, Key=f"unzipped/{app_uuid}_selfie.png", Body=b"selfie" * 1024)
+s3.put_object(Bucket=bucket, Key=f"unzipped/{app_uuid}_license.png", Body=b"license" * 1024)
+textract = stand_ins.Textract(s3)
+textract.documents[(bucket, f"unzipped/{app_uuid}_license.png")] = details
+application = {"app_uuid": app_uuid, "digests": {"selfie": "selfie", "license": "license"}, "details_valid": True, "details": details}
+s3_event = {"detail": {"bucket": {"name": bucket}, "object": {"key": f"{app_uuid}.zip"}}, "time": "2026-01-01T00:00:00+00:00"}
+
+
+def use_kyc_common(client_names):
+    # creating the real clients is part of a cold invocation, so it is timed before the stand-ins replace them
+    from kyc_common import clients
+
+    clients_start = time.perf_counter()
+    table_names = {"table": "TABLE", "stage_table": "STAGE_TABLE"}
+    for name in client_names:
+        clients.table(os.environ[table_names[name]]) if name in table_names else clients.client(name)
+    clients_ms = (time.perf_counter() - clients_start) * 1000
+
+    clients.override("s3", s3)
+    clients.override("sns", stand_ins.SNS())
+    clients.override("rekognition", stand_ins.Rekognition(s3))
+    clients.override("textract", textract)
+    clients.override("sqs", stand_ins.SQS())
+    if "table" in client_names:
+        clients.override(table_name=os.environ["TABLE"], stand_in=stand_ins.Table())
+    if "stage_table" in client_names:
+        clients.override(table_name=os.environ["STAGE_TABLE"], stand_in=stand_ins.Table(key_name="STAGE_KEY"))
+    return clients_ms
+
+
+def prepare():
+    # returns the time spent creating clients outside the handler and the event of the first invocation
+    if function_name in ("Unzip", "Express"):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            for name in ("selfie", "license"):
+                zip_file.writestr(f"{app_uuid}_{name}.png", s3.body(bucket, f"unzipped/{app_uuid}_{name}.png"))
+            zip_file.writestr(f"{app_uuid}_details.csv", ",".join(details) + "\n" + ",".join(details.values()) + "\n")
+        s3.put_object(Bucket=bucket, Key=f"{app_uuid}.zip", Body=archive.getvalue())
+        if function_name == "Express":
+            return use_kyc_common(["s3", "rekognition", "textract", "sns", "sqs", "table", "stage_table"]), s3_event
+        return use_kyc_common(["s3", "stage_table"]), s3_event
+    if function_name == "NormalizeImages":
+        return use_kyc_common(["s3", "stage_table"]), {**s3_event, "application": application}
+    if function_name == "CompareFaces":
+        return use_kyc_common(["rekognition", "sns", "stage_table"]), {**s3_event, "application": application}
+    if function_name == "CompareDetails":
+        return use_kyc_common(["textract", "sns", "stage_table"]), {**s3_event, "application": application}
+    if function_name == "WriteToDynamo":
+        checks = {"faces": {"LICENSE_SELFIE_MATCH": True, "api_called": True}, "details": {"LICENSE_DETAILS_MATCH": True, "api_called": True}}
+        return use_kyc_common(["sqs", "table", "stage_table"]), {**s3_event, "application": application, "checks": checks}
+    if function_name == "Submit":
+        # SubmitFunction creates its clients at import
+        app.ddb_table = stand_ins.Table()
+        app.sns = stand_ins.SNS()
+        body = {"driver_license_id": details["DOCUMENT_NUMBER"], "validation_override": True, "app_uuid": app_uuid}
+        return 0.0, {"Records": [{"messageId": "message-1", "body": json.dumps(body)}]}
+    if function_name == "Validate":
+        return 0.0, {"body": json.dumps({"driver_license_id": details["DOCUMENT_NUMBER"], "validation_override": True})}
+    raise ValueError(f"Unknown function {function_name}")
+
+
+clients_ms, event = prepare()
+# the handlers log their events and results, which would corrupt the JSON line this probe prints
+with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+    invoke_start = time.perf_counter()
+    response = app.lambda_handler(event, None)
+    handler_ms = (time.perf_counter() - invoke_start) * 1000
+
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "clients_ms": clients_ms,
+    "handler_ms": handler_ms,
+    "first_invoke_ms": clients_ms + handler_ms,
+    # ru_maxrss is in kilobytes on Linux
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "boto3_at_init": boto3_at_init,
+    "succeeded": response is not None,
+}))
@@ -0,0 +1,71 @@
+"End-to-end latency of ExpressLambdaFunction against the DocumentStateMachine path on the same applicants"
+import argparse
+import contextlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import Pipeline, configure_environment, load_handler, percentile
+from local.applicants import make_applicants
+
+
+def run_express(express, applicant):
+    start = time.perf_counter()
+    result = express({
+        "time": "2026-01-01T00:00:00+00:00",
+        "detail": {"bucket": {"name": "kyc-applications"}, "object": {"key": f"express/{applicant.app_uuid}.zip"}},
+    }, None)
+    return (time.perf_counter() - start) * 1000, result is not None
+
+
+def run_state_machine(pipeline, applicant):
+    history, outcome = pipeline.run(applicant)
+    return history[-1]["duration_ms"], outcome != "error"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--applicants", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--image-kb", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--api-latency-ms", type=float, default=300, help="latency of each Rekognition and Textract call")
+    parser.add_argument("--s3-latency-ms", type=float, default=10, help="latency of each S3 request")
+    parser.add_argument("--task-overhead-ms", type=float, default=40,
+                        help="state transition and Lambda invoke added to every Task of the Step Functions path")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    configure_environment()
+
+    print(f"{'path':>14} {'concurrency':>12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'apps/s':>8} {'errors':>7}")
+    for level, concurrency in enumerate(args.concurrency):
+        for path in ("state_machine", "express"):
+            pipeline = Pipeline(args.api_latency_ms / 1000, args.s3_latency_ms / 1000, concurrency,
+                                args.task_overhead_ms / 1000)
+            applicants = make_applicants(args.applicants, [kb * 1024 for kb in args.image_kb], seed=args.seed + level)
+            pipeline.upload(applicants)
+            if path == "express":
+                express, express_module = load_handler("express", "10/ExpressLambdaFunction")
+                # every container runs one invocation at a time, so each in-process invocation gets its own two check threads
+                express_module.check_executor = ThreadPoolExecutor(max_workers=2 * concurrency)
+                # the express channel uploads under its own prefix
+                for applicant in applicants:
+                    pipeline.s3.put_object(Bucket="kyc-applications", Key=f"express/{applicant.app_uuid}.zip", Body=applicant.archive)
+                run = lambda applicant: run_express(express, applicant)
+            else:
+                run = lambda applicant: run_state_machine(pipeline, applicant)
+
+            start = time.perf_counter()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    results = list(executor.map(run, applicants))
+            elapsed = time.perf_counter() - start
+            pipeline.state_machine.executor.shutdown()
+
+            latencies = [latency for latency, _ in results]
+            errors = sum(1 for _, succeeded in results if not succeeded)
+            print(f"{path:>14} {concurrency:>12} {percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.95):>8.1f} "
+                  f"{percentile(latencies, 0.99):>8.1f} {len(applicants) / elapsed:>8.1f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
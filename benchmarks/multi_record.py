@@ -0,0 +1,103 @@
+"Throughput of the monolithic handlers in 3/ to 6/ on S3 events carrying many records, against the local stand-ins"
+import argparse
+import contextlib
+import glob
+import importlib.util
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+
+from local import stand_ins
+from local.applicants import make_applicants
+
+bucket = "kyc-applications"
+# each step of the tutorial keeps its handler in a different file
+handlers = {
+    "3": "3/lambda_function.py",
+    "4": "4/app.py",
+    "5": "5/app.py",
+    "6": "6/app.py",
+}
+
+
+def load_monolith(step, record_concurrency, api_latency, s3_latency):
+    # the handlers read their settings and create their clients at import, so the stand-ins replace them afterwards
+    os.environ["RECORD_CONCURRENCY"] = str(record_concurrency)
+    spec = importlib.util.spec_from_file_location(f"monolith_{step}", repo_root / handlers[step])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    s3 = stand_ins.S3(latency=s3_latency)
+    textract = stand_ins.Textract(s3, latency=api_latency)
+    module.s3 = s3
+    module.ddb_table = stand_ins.Table()
+    module.sns = stand_ins.SNS()
+    module.rekognition = stand_ins.Rekognition(s3, latency=api_latency)
+    module.textract = textract
+    return module, s3, textract
+
+
+def s3_event(keys):
+    return {"Records": [
+        {"eventSource": "aws:s3", "s3": {"bucket": {"name": bucket}, "object": {"key": key}}}
+        for key in keys
+    ]}
+
+
+def sqs_event(event):
+    # the same records re-sent through a queue, one S3 notification per message
+    return {"Records": [
+        {"messageId": f"message-{number}", "eventSource": "aws:sqs", "body": json.dumps({"Records": [record]})}
+        for number, record in enumerate(event["Records"])
+    ]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", nargs="+", default=list(handlers), choices=list(handlers))
+    parser.add_argument("--records", type=int, default=100, help="records carried by the event")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="RECORD_CONCURRENCY levels")
+    parser.add_argument("--image-kb", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--api-latency-ms", type=float, default=300, help="latency of each Rekognition and Textract call")
+    parser.add_argument("--s3-latency-ms", type=float, default=10, help="latency of each S3 request")
+    parser.add_argument("--sqs", action="store_true", help="deliver the records as the messages of an SQS batch")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TABLE", "CustomerMetadataTable")
+    os.environ.setdefault("TOPIC", "arn:aws:sns:us-east-1:000000000000:ApplicationNotifications")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    applicants = make_applicants(args.records, [kb * 1024 for kb in args.image_kb], seed=args.seed)
+
+    print(f"{'step':>5} {'concurrency':>12} {'records':>8} {'succeeded':>10} {'failed':>7} {'records/s':>10} {'scratch left':>13} {'redelivered':>12}")
+    for step in args.steps:
+        for concurrency in args.concurrency:
+            module, s3, textract = load_monolith(step, concurrency, args.api_latency_ms / 1000, args.s3_latency_ms / 1000)
+            for applicant in applicants:
+                s3.put_object(Bucket=bucket, Key=f"zipped/{applicant.app_uuid}.zip", Body=applicant.archive)
+                textract.documents[(bucket, f"unzipped/{applicant.app_uuid}_license.png")] = applicant.license_fields
+            event = s3_event(f"zipped/{applicant.app_uuid}.zip" for applicant in applicants)
+            if args.sqs:
+                event = sqs_event(event)
+
+            scratch_before = set(glob.glob("/tmp/record-*"))
+            start = time.perf_counter()
+            # the handlers log every event and result, which would drown the report
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                response = module.lambda_handler(event, None)
+            elapsed = time.perf_counter() - start
+            scratch_left = len(set(glob.glob("/tmp/record-*")) - scratch_before)
+
+            outcomes = response["records"]
+            succeeded = sum(1 for outcome in outcomes if outcome["status"] == "succeeded")
+            print(f"{step:>5} {concurrency:>12} {len(outcomes):>8} {succeeded:>10} {len(outcomes) - succeeded:>7} "
+                  f"{len(outcomes) / elapsed:>10.1f} {scratch_left:>13} {len(response['batchItemFailures']):>12}")
+
+
+if __name__ == "__main__":
+    main()
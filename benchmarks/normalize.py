@@ -0,0 +1,83 @@
+"Bytes the NormalizeImages stage saves and its effect on CompareFaces and CompareDetails latency, on phone-sized photos"
+import argparse
+import contextlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import Pipeline, configure_environment, percentile, stage_names
+from local.applicants import make_applicants
+
+
+def run_mode(args, applicants, normalize):
+    pipeline = Pipeline(args.api_latency_ms / 1000, args.s3_latency_ms / 1000, args.concurrency,
+                        api_latency_per_mb=args.api_latency_per_mb_ms / 1000)
+    resources = pipeline.state_machine.resources
+    normalize_images = resources["NormalizeImagesLambdaFunction"]
+    stage_outputs = []
+
+    def recorded_normalize_images(payload):
+        images = normalize_images(payload)
+        stage_outputs.append(images)
+        return images
+
+    # the stage returning nothing is how a failed normalization reaches the checks, which then use the uploads
+    resources["NormalizeImagesLambdaFunction"] = recorded_normalize_images if normalize else lambda payload: None
+    pipeline.upload(applicants)
+
+    start = time.perf_counter()
+    # the handlers log every event and result, which would drown the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(pipeline.run, applicants))
+    elapsed = time.perf_counter() - start
+    pipeline.state_machine.executor.shutdown()
+
+    outcomes = {}
+    latencies = {}
+    for history, outcome in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        for entry in history:
+            latencies.setdefault(stage_names.get(entry["state"], entry["state"]), []).append(entry["duration_ms"])
+
+    images = [image for output in stage_outputs if output for image in output.values()]
+    return elapsed, outcomes, latencies, images, pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--applicants", type=int, default=12)
+    parser.add_argument("--photo-sides", type=int, nargs="+", default=[2000, 3000, 3500],
+                        help="widths of the uploaded photos, 3000 pixels is about 9 MB as PNG")
+    # normalizing is CPU bound, so applications running at once on fewer cores than Lambda gives them queue up
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--mismatch-rate", type=float, default=0.1, help="share of licenses that disagree with the form")
+    parser.add_argument("--api-latency-ms", type=float, default=300, help="latency of each Rekognition and Textract call")
+    parser.add_argument("--api-latency-per-mb-ms", type=float, default=150,
+                        help="latency each megabyte of image adds to a Rekognition or Textract call")
+    parser.add_argument("--s3-latency-ms", type=float, default=10, help="latency of each S3 request")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    configure_environment()
+
+    applicants = make_applicants(args.applicants, [0], args.mismatch_rate, seed=args.seed, photo_sides=args.photo_sides)
+    for normalize in (False, True):
+        elapsed, outcomes, latencies, images, pipeline = run_mode(args, applicants, normalize)
+        calls = pipeline.rekognition.calls + pipeline.textract.calls
+        received = pipeline.rekognition.bytes_received + pipeline.textract.bytes_received
+        print(f"\nnormalize {'on' if normalize else 'off'}: {args.applicants / elapsed:.2f} applications/s, "
+              f"outcomes {outcomes}, API calls {calls}, "
+              f"{received / max(calls, 1) / 1024:.0f} KB per call, S3 GETs {pipeline.s3.calls['get_object']}")
+        if images:
+            original = sum(image["original_bytes"] for image in images)
+            normalized = sum(image["normalized_bytes"] for image in images)
+            print(f"{len(images)} images: {original / 2 ** 20:.1f} MB uploaded, {normalized / 2 ** 20:.1f} MB after "
+                  f"normalizing ({1 - normalized / original:.1%} saved), "
+                  f"{sum(image['key'].startswith('normalized/') for image in images)} read from normalized copies")
+        print(f"{'state':>20} {'count':>6} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, values in latencies.items():
+            print(f"{name:>20} {len(values):>6} {percentile(values, 0.5):>8.1f} {percentile(values, 0.95):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"Lookup latency of the selfie hash index at 100k and 1M hashes, its S3 loading, and the applications it flags on a fraud ring"
+import argparse
+import contextlib
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import Pipeline, bucket, configure_environment, percentile
+from local.applicants import make_applicants, with_reused_photo
+
+
+def random_index(rng, size):
+    from kyc_common.phash import HashIndex, kinds
+
+    index = HashIndex()
+    for _ in range(size):
+        index.add(rng.getrandbits(64), str(uuid.UUID(int=rng.getrandbits(128), version=4)), rng.choice(kinds))
+    return index
+
+
+def near(rng, value, distance):
+    for bit in rng.sample(range(64), distance):
+        value ^= 1 << bit
+    return value
+
+
+def time_lookups(index, queries):
+    latencies = []
+    found = 0
+    for query in queries:
+        start = time.perf_counter()
+        found += bool(index.lookup(query))
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return latencies, found
+
+
+def measure_index(args, rng, size):
+    "Builds an index of random hashes, round trips it through a snapshot and times lookups that miss and that hit"
+    from kyc_common.phash import HashIndex
+
+    start = time.perf_counter()
+    built = random_index(rng, size)
+    build_s = time.perf_counter() - start
+    start = time.perf_counter()
+    snapshot = built.dump_snapshot()
+    dump_s = time.perf_counter() - start
+    index = HashIndex()
+    start = time.perf_counter()
+    index.load_snapshot(snapshot)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    misses = [rng.getrandbits(64) for _ in range(args.queries)]
+    hits = [near(rng, index.hashes[rng.randrange(size)], rng.randint(0, index.max_distance)) for _ in range(args.queries)]
+    print(f"\n{size} hashes: built in {build_s:.1f} s, snapshot of {len(snapshot) / 2 ** 20:.0f} MB written in {dump_s:.1f} s "
+          f"and loaded in {load_ms:.0f} ms")
+    print(f"{'queries':>28} {'count':>6} {'found':>6} {'p50 us':>8} {'p95 us':>8} {'p99 us':>8}")
+    for name, queries in (("unrelated photos", misses), (f"resaved, <= {index.max_distance} bits", hits)):
+        latencies, found = time_lookups(index, queries)
+        print(f"{name:>28} {len(queries):>6} {found:>6} {percentile(latencies, 0.5):>8.1f} "
+              f"{percentile(latencies, 0.95):>8.1f} {percentile(latencies, 0.99):>8.1f}")
+    return snapshot
+
+
+def measure_refresh(args, rng, snapshot):
+    "Times a cold container loading the snapshot from S3, then a warm one loading the segments written since"
+    from kyc_common.phash import SharedHashIndex
+
+    pipeline = Pipeline(0, args.s3_latency_ms / 1000, 1)
+    name = f"{int(time.time() * 1000) - 3_600_000:013d}-{uuid.UUID(int=0, version=4)}"
+    pipeline.s3.put_object(Bucket=bucket, Key=f"phash/snapshots/{name}.bin", Body=snapshot)
+    container = SharedHashIndex()
+    start = time.perf_counter()
+    container.refresh(bucket)
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    for _ in range(args.segments):
+        app_uuid = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        SharedHashIndex().record(bucket, app_uuid, {"selfie": rng.getrandbits(64), "license": rng.getrandbits(64)})
+    calls_before = dict(pipeline.s3.calls)
+    start = time.perf_counter()
+    container.refresh(bucket, force=True)
+    warm_ms = (time.perf_counter() - start) * 1000
+    calls = {call: count - calls_before.get(call, 0) for call, count in pipeline.s3.calls.items() if count != calls_before.get(call, 0)}
+    print(f"cold container loads {len(container.index)} hashes in {cold_ms:.0f} ms, a warm one loads "
+          f"{args.segments} new segments in {warm_ms:.0f} ms with S3 calls {calls}")
+
+
+def run_ring(args, applicants, use_index):
+    from kyc_common import checks
+
+    pipeline = Pipeline(args.api_latency_ms / 1000, args.s3_latency_ms / 1000, args.concurrency)
+    if not use_index:
+        checks.photo_index.find_reused = lambda bucket, app_uuid, hashes: {}
+    pipeline.upload(applicants)
+    start = time.perf_counter()
+    # the handlers log every event and result, which would drown the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(pipeline.run, applicants))
+    elapsed = time.perf_counter() - start
+    pipeline.state_machine.executor.shutdown()
+    return pipeline, [outcome for _, outcome in results], elapsed
+
+
+def measure_ring(args, rng):
+    "Runs applicants of whom a share reuse the selfie of one ring member through the pipeline, with and without the index"
+    applicants = make_applicants(args.applicants, [0], seed=args.seed, photo_sides=[args.photo_side])
+    ring = [applicant for applicant in applicants[1:] if rng.random() < args.ring_rate]
+    for applicant in ring:
+        with_reused_photo(applicant, applicants[0])
+    ring_uuids = {applicant.app_uuid for applicant in ring}
+
+    print(f"\n{len(applicants)} applicants, {len(ring)} reusing the selfie of {applicants[0].app_uuid}")
+    for use_index in (False, True):
+        pipeline, outcomes, elapsed = run_ring(args, applicants, use_index)
+        flagged = {applicant.app_uuid for applicant in applicants if "SELFIE_REUSED_FROM" in pipeline.table.items[applicant.app_uuid]}
+        others_flagged = flagged - ring_uuids
+        print(f"index {'on' if use_index else 'off'}: Rekognition calls {pipeline.rekognition.calls}, "
+              f"Textract calls {pipeline.textract.calls}, "
+              f"ring members flagged for review {len(flagged & ring_uuids)}/{len(ring)}, other applicants flagged "
+              f"{len(others_flagged)}, outcomes {dict((outcome, outcomes.count(outcome)) for outcome in set(outcomes))}, "
+              f"{len(applicants) / elapsed:.1f} applications/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000], help="hashes in the index")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--segments", type=int, default=200, help="segments other containers write between two refreshes")
+    parser.add_argument("--applicants", type=int, default=30)
+    parser.add_argument("--ring-rate", type=float, default=0.3, help="share of applicants reusing the ring's selfie")
+    parser.add_argument("--photo-side", type=int, default=800)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--api-latency-ms", type=float, default=300, help="latency of each Rekognition and Textract call")
+    parser.add_argument("--s3-latency-ms", type=float, default=10, help="latency of each S3 request")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    configure_environment()
+
+    rng = random.Random(args.seed)
+    for size in args.sizes:
+        snapshot = measure_index(args, rng, size)
+        measure_refresh(args, rng, snapshot)
+    measure_ring(args, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"End-to-end throughput of the document pipeline, running DocumentStateMachine in-process against the local stand-ins"
+import argparse
+import contextlib
+import importlib.util
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+sys.path.insert(0, str(repo_root / "10" / "KycCommonLayer"))
+
+from local import stand_ins
+from local.applicants import make_applicants
+from local.state_machine import StateMachine, lambda_resource, load_definition
+
+bucket = "kyc-applications"
+queue_url = "LicenseQueue"
+table_name = "CustomerMetadataTable"
+# the checks run as CompareFaces and CompareDetails in the Parallel state, under other names in the sequential modes
+stage_names = {
+    "CompareFacesFirst": "CompareFaces",
+    "CompareFacesSecond": "CompareFaces",
+    "CompareDetailsFirst": "CompareDetails",
+    "CompareDetailsSecond": "CompareDetails",
+}
+
+
+def load_handler(name, function_dir):
+    # every function is an app.py module, so each is loaded under its own name
+    spec = importlib.util.spec_from_file_location(f"{name}_app", repo_root / function_dir / "app.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.lambda_handler, module
+
+
+class Pipeline:
+    "Runs applications through DocumentStateMachine from 10/template.yaml with the local executor"
+
+    def __init__(self, api_latency, s3_latency, concurrency, task_overhead=0.0, api_latency_per_mb=0.0):
+        from kyc_common import checks, clients, idempotency
+        from kyc_common.phash import SharedHashIndex
+
+        self.s3 = stand_ins.S3(latency=s3_latency)
+        self.textract = stand_ins.Textract(self.s3, latency=api_latency, latency_per_mb=api_latency_per_mb)
+        self.rekognition = stand_ins.Rekognition(self.s3, latency=api_latency, latency_per_mb=api_latency_per_mb)
+        self.table = stand_ins.Table()
+        self.stage_table = stand_ins.Table(key_name="STAGE_KEY")
+        self.sqs = stand_ins.SQS()
+        self.sns = stand_ins.SNS()
+        clients.override("s3", self.s3)
+        clients.override("sns", self.sns)
+        clients.override("rekognition", self.rekognition)
+        clients.override("textract", self.textract)
+        clients.override("sqs", self.sqs)
+        clients.override(table_name=table_name, stand_in=self.table)
+        clients.override(table_name=idempotency.stage_table_name, stand_in=self.stage_table)
+        # every level starts cold, the applicants of a previous level would all be cache hits
+        for cache in (checks.faces_cache, checks.details_cache):
+            cache.local_cache.clear()
+        checks.photo_index = SharedHashIndex()
+
+        unzip, self.unzip_module = load_handler("unzip", "9/UnzipLambdaFunction")
+        normalize_images, _ = load_handler("normalize_images", "10/NormalizeImagesLambdaFunction")
+        compare_faces, _ = load_handler("compare_faces", "9/CompareFacesLambdaFunction")
+        compare_details, _ = load_handler("compare_details", "9/CompareDetailsLambdaFunction")
+        write_to_dynamo, _ = load_handler("write_to_dynamo", "10/WriteToDynamoLambdaFunction")
+        resources = {
+            "UnzipLambdaFunction": lambda_resource(unzip),
+            "NormalizeImagesLambdaFunction": lambda_resource(normalize_images),
+            "CompareFacesLambdaFunction": lambda_resource(compare_faces),
+            "CompareDetailsLambdaFunction": lambda_resource(compare_details),
+            "WriteToDynamoLambdaFunction": lambda_resource(write_to_dynamo),
+        }
+        if task_overhead:
+            # the state transition and Lambda invoke that every Task pays in AWS but not in-process
+            resources = {name: with_overhead(resource, task_overhead) for name, resource in resources.items()}
+        self.resources = resources
+        # the Parallel state runs both checks of every application at once
+        self.state_machine = StateMachine(
+            load_definition(repo_root / "10" / "template.yaml"),
+            resources,
+            max_workers=concurrency * 2,
+        )
+
+    def upload(self, applicants):
+        for applicant in applicants:
+            self.s3.put_object(Bucket=bucket, Key=f"{applicant.app_uuid}.zip", Body=applicant.archive)
+            register_license(self.textract, applicant)
+
+    def run(self, applicant):
+        "Returns the history of the execution and how the application ended"
+        start = time.perf_counter()
+        execution = self.state_machine.execute({
+            "time": "2026-01-01T00:00:00+00:00",
+            "detail": {"bucket": {"name": bucket}, "object": {"key": f"{applicant.app_uuid}.zip"}},
+        })
+        history = execution["history"] + [{"state": "EndToEnd", "duration_ms": (time.perf_counter() - start) * 1000}]
+        if execution["status"] == "FAILED":
+            return history, execution["error"]
+
+        item = self.table.items[applicant.app_uuid]
+        passed = all(item.get(name) is True for name in ("LICENSE_SELFIE_MATCH", "LICENSE_DETAILS_MATCH"))
+        return history, "passed" if passed else "check_failed"
+
+
+def register_license(textract, applicant):
+    "Lets the Textract stand-in read the license fields from the upload and from its normalized copy"
+    textract.documents[(bucket, f"unzipped/{applicant.app_uuid}_license.png")] = applicant.license_fields
+    # random bytes never decode, so only photos have a normalized copy
+    if applicant.photos:
+        textract.documents[(bucket, f"normalized/{applicant.app_uuid}_license.jpg")] = applicant.license_fields
+
+
+def with_overhead(resource, overhead):
+    def run(payload):
+        time.sleep(overhead)
+        return resource(payload)
+    return run
+
+
+def configure_environment():
+    # the stand-ins have no quota, so the limiter only paces when asked to
+    os.environ.setdefault("RATE_LIMIT_PER_SECOND", "100000")
+    os.environ.setdefault("TABLE", table_name)
+    os.environ.setdefault("QUEUE_URL", queue_url)
+    os.environ.setdefault("TOPIC", "arn:aws:sns:us-east-1:000000000000:ApplicationNotifications")
+    os.environ.setdefault("POWERTOOLS_TRACE_DISABLED", "true")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    # Powertools warns on every invocation that flushes no metrics, which is every rejected application
+    warnings.filterwarnings("ignore", message="No application metrics to publish")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run_level(args, unzip_mode, check_mode, concurrency, seed):
+    pipeline = Pipeline(args.api_latency_ms / 1000, args.s3_latency_ms / 1000, concurrency)
+    pipeline.unzip_module.unzip_mode = unzip_mode
+    pipeline.unzip_module.check_mode = check_mode
+    applicants = make_applicants(args.applicants, [kb * 1024 for kb in args.image_kb],
+                                 args.mismatch_rate, args.invalid_rate, seed)
+    pipeline.upload(applicants)
+
+    start = time.perf_counter()
+    # the handlers log every event and result, which would drown the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(pipeline.run, applicants))
+    elapsed = time.perf_counter() - start
+    pipeline.state_machine.executor.shutdown()
+
+    outcomes = {}
+    stages = {}
+    for history, outcome in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        for entry in history:
+            stage = stages.setdefault(stage_names.get(entry["state"], entry["state"]), {"latencies": [], "max_bytes": 0})
+            stage["latencies"].append(entry["duration_ms"])
+            stage["max_bytes"] = max(stage["max_bytes"], entry.get("output_bytes") or 0)
+    return elapsed, outcomes, stages, pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--applicants", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--image-kb", type=int, nargs="+", default=[256, 1024], help="image sizes drawn for each applicant")
+    parser.add_argument("--mismatch-rate", type=float, default=0.1, help="share of licenses that disagree with the form")
+    parser.add_argument("--invalid-rate", type=float, default=0.05, help="share of forms that break the details schema")
+    parser.add_argument("--check-modes", nargs="+", default=["parallel"],
+                        choices=["parallel", "parallel_fail_fast", "faces_first", "details_first"])
+    parser.add_argument("--unzip-modes", nargs="+", default=["stream"], choices=["stream", "ranged", "disk"])
+    parser.add_argument("--api-latency-ms", type=float, default=300, help="latency of each Rekognition and Textract call")
+    parser.add_argument("--s3-latency-ms", type=float, default=10, help="latency of each S3 request")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    configure_environment()
+
+    for unzip_mode in args.unzip_modes:
+        for check_mode in args.check_modes:
+            for level, concurrency in enumerate(args.concurrency):
+                if unzip_mode == "disk" and concurrency > 1:
+                    # disk mode stages every archive in the same /tmp/unzipped, which only one invocation can use at a time
+                    print(f"skipping disk mode at concurrency {concurrency}")
+                    continue
+                elapsed, outcomes, stages, pipeline = run_level(args, unzip_mode, check_mode, concurrency, args.seed + level)
+                print(f"\nunzip {unzip_mode}, checks {check_mode}, concurrency {concurrency}: "
+                      f"{args.applicants / elapsed:.1f} applications/s, outcomes {outcomes}, S3 calls {pipeline.s3.calls}, "
+                      f"Rekognition {pipeline.rekognition.calls}, Textract {pipeline.textract.calls}")
+                print(f"{'state':>20} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max output bytes':>17}")
+                for name, stage in stages.items():
+                    values = stage["latencies"]
+                    print(f"{name:>20} {len(values):>6} {percentile(values, 0.5):>8.1f} {percentile(values, 0.95):>8.1f} "
+                          f"{percentile(values, 0.99):>8.1f} {stage['max_bytes']:>17}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"Replays duplicated and retried upload events through the pipeline and checks how often each downstream service is called"
+import argparse
+import contextlib
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import Pipeline, bucket, configure_environment, load_handler
+from local.applicants import make_applicants
+
+sequencer = "0062E99A88DC407460"
+
+
+def upload_event(applicant, etag="etag-1", prefix=""):
+    # EventBridge repeats the ETag and sequencer when it delivers the same upload again
+    return {
+        "time": "2026-01-01T00:00:00+00:00",
+        "detail": {
+            "bucket": {"name": bucket},
+            "object": {"key": f"{prefix}{applicant.app_uuid}.zip", "etag": etag, "sequencer": sequencer},
+        },
+    }
+
+
+class Replay:
+    "A pipeline on fresh stand-ins that counts the downstream calls of every stage"
+
+    def __init__(self, args, applicants):
+        self.pipeline = Pipeline(args.api_latency_ms / 1000, args.s3_latency_ms / 1000, concurrency=4)
+        self.pipeline.upload(applicants)
+        # duplicates waiting on a running stage retry quickly instead of after the deployed intervals
+        for state in iter_states(self.pipeline.state_machine.definition):
+            for retrier in state.get("Retry", []):
+                retrier["IntervalSeconds"] = 0.05
+        self.result_writes = 0
+        update_item = self.pipeline.table.update_item
+
+        def counted_update_item(**kwargs):
+            if "SUBMITTED_AT" in kwargs.get("ConditionExpression", ""):
+                self.result_writes += 1
+            return update_item(**kwargs)
+
+        self.pipeline.table.update_item = counted_update_item
+
+    def clear_caches(self):
+        from kyc_common import checks
+
+        # every delivery may land on another container, so the in-memory check caches cannot hide a second call
+        for cache in (checks.faces_cache, checks.details_cache):
+            cache.local_cache.clear()
+
+    def execute(self, event):
+        self.clear_caches()
+        return self.pipeline.state_machine.execute(event)
+
+    def counts(self):
+        return {
+            "s3_uploads": self.pipeline.s3.calls["put_object"],
+            "rekognition": self.pipeline.rekognition.calls,
+            "textract": self.pipeline.textract.calls,
+            "result_writes": self.result_writes,
+            # the stage markers live in their own table, so the provisioned APP_UUID items see only the application writes
+            "item_writes": self.pipeline.table.calls["update_item"] + self.pipeline.table.calls["put_item"],
+            "sns": len(self.pipeline.sns.messages),
+            "sqs": sum(len(messages) for messages in self.pipeline.sqs.queues.values()),
+        }
+
+
+def iter_states(definition):
+    for state in definition["States"].values():
+        yield state
+        for branch in state.get("Branches", []):
+            yield from iter_states(branch)
+
+
+def single_delivery(replay, applicants):
+    for applicant in applicants:
+        replay.execute(upload_event(applicant))
+
+
+def duplicate_delivery(replay, applicants):
+    for applicant in applicants:
+        replay.execute(upload_event(applicant))
+        replay.execute(upload_event(applicant))
+
+
+def concurrent_duplicates(replay, applicants):
+    # both executions of an upload run at the same time, the later one waits on StageInProgressError
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for applicant in applicants:
+            list(executor.map(replay.execute, [upload_event(applicant)] * 2))
+
+
+def lost_response(replay, applicants):
+    # WriteToDynamo finishes but its response never reaches Step Functions, and the upload is started again
+    write_to_dynamo = replay.pipeline.state_machine.resources["WriteToDynamoLambdaFunction"]
+    resources = replay.pipeline.state_machine.resources
+
+    def write_then_fail(payload):
+        write_to_dynamo(payload)
+        raise RuntimeError("Lambda response lost")
+
+    for applicant in applicants:
+        resources["WriteToDynamoLambdaFunction"] = write_then_fail
+        replay.execute(upload_event(applicant))
+        resources["WriteToDynamoLambdaFunction"] = write_to_dynamo
+        replay.execute(upload_event(applicant))
+
+
+def new_upload(replay, applicants):
+    # the same key uploaded again is a new application, so every stage runs a second time
+    for applicant in applicants:
+        replay.execute(upload_event(applicant, etag="etag-1"))
+        replay.execute(upload_event(applicant, etag="etag-2"))
+
+
+def express_duplicates(replay, applicants):
+    express, _ = load_handler("express", "10/ExpressLambdaFunction")
+    for applicant in applicants:
+        replay.pipeline.s3.put_object(Bucket=bucket, Key=f"express/{applicant.app_uuid}.zip", Body=applicant.archive)
+    before = replay.counts()["s3_uploads"]
+    for applicant in applicants:
+        for _ in range(2):
+            replay.clear_caches()
+            express(upload_event(applicant, prefix="express/"), None)
+    return before
+
+
+# how many times each scenario may call a service, relative to delivering every upload once
+scenarios = {
+    "duplicate_delivery": (duplicate_delivery, {}),
+    "concurrent_duplicates": (concurrent_duplicates, {}),
+    "lost_response": (lost_response, {}),
+    "new_upload": (new_upload, {"s3_uploads": 2, "rekognition": 2, "textract": 2, "result_writes": 2, "item_writes": 2, "sns": 2, "sqs": 2}),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--applicants", type=int, default=20)
+    parser.add_argument("--mismatch-rate", type=float, default=0.2, help="share of licenses that disagree with the form")
+    parser.add_argument("--api-latency-ms", type=float, default=20, help="latency of each Rekognition and Textract call")
+    parser.add_argument("--s3-latency-ms", type=float, default=1, help="latency of each S3 request")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    configure_environment()
+
+    applicants = make_applicants(args.applicants, [4 * 1024], mismatch_rate=args.mismatch_rate, seed=args.seed)
+    failures = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        baseline = Replay(args, applicants)
+        single_delivery(baseline, applicants)
+        # the archives uploaded by the harness are not calls made by the pipeline
+        expected_once = {**baseline.counts(), "s3_uploads": baseline.counts()["s3_uploads"] - len(applicants)}
+
+        results = {}
+        for name, (scenario, multipliers) in scenarios.items():
+            replay = Replay(args, applicants)
+            scenario(replay, applicants)
+            counts = replay.counts()
+            counts["s3_uploads"] -= len(applicants)
+            results[name] = (counts, {service: calls * multipliers.get(service, 1) for service, calls in expected_once.items()})
+
+        # the express path records the license message as a stage too, like WriteToDynamo
+        replay = Replay(args, applicants)
+        before = express_duplicates(replay, applicants)
+        counts = replay.counts()
+        counts["s3_uploads"] -= before
+        results["express_duplicates"] = (counts, expected_once)
+
+    print(f"{'scenario':>22} " + " ".join(f"{service:>14}" for service in expected_once))
+    print(f"{'single_delivery':>22} " + " ".join(f"{calls:>14}" for calls in expected_once.values()))
+    for name, (counts, expected) in results.items():
+        cells = []
+        for service, calls in counts.items():
+            cells.append(f"{calls:>14}" if calls == expected[service] else f"{f'{calls}!={expected[service]}':>14}")
+            if calls != expected[service]:
+                failures.append(f"{name} {service}: {calls} calls, expected {expected[service]}")
+        print(f"{name:>22} " + " ".join(cells))
+
+    for failure in failures:
+        print(f"UNEXPECTED {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
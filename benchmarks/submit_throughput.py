@@ -0,0 +1,97 @@
+"Throughput of the SubmitFunction handler against the local validation API stand-in"
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+sys.path.insert(0, str(repo_root / "8" / "ValidateFunction"))
+
+from local import stand_ins
+from local_server import ServerConfig, start_server
+
+
+def load_submit_app(url, workers, validation_batch_size, hedge_after_ms):
+    # SubmitFunction reads its settings at import, so every configuration gets a fresh module
+    os.environ.update({
+        "INVOKE_URL": url,
+        "TABLE": "CustomerMetadataTable",
+        "TOPIC": "arn:aws:sns:us-east-1:000000000000:ApplicationNotifications",
+        "QUEUE_URL": "LicenseQueue",
+        "MAX_WORKERS": str(workers),
+        "VALIDATION_BATCH_SIZE": str(validation_batch_size),
+        "HEDGE_AFTER_MS": str(hedge_after_ms),
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+    })
+    submit_dir = repo_root / "8" / "SubmitFunction"
+    if str(submit_dir) not in sys.path:
+        sys.path.insert(0, str(submit_dir))
+    spec = importlib.util.spec_from_file_location(f"submit_app_{workers}_{validation_batch_size}", submit_dir / "app.py")
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+
+    app.ddb_table = stand_ins.Table()
+    app.sns = stand_ins.SNS()
+    return app
+
+
+def make_records(count):
+    return [
+        {
+            "messageId": f"message-{i}",
+            "body": json.dumps({
+                "driver_license_id": f"D{i:08d}",
+                "validation_override": i % 10 != 0,
+                "app_uuid": f"app-{i}",
+            }),
+        }
+        for i in range(count)
+    ]
+
+
+def run(app, records, sqs_batch_size):
+    start = time.perf_counter()
+    failures = 0
+    # the handler logs every message, which would drown the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for i in range(0, len(records), sqs_batch_size):
+            response = app.lambda_handler({"Records": records[i:i + sqs_batch_size]}, None)
+            failures += len(response["batchItemFailures"])
+    return time.perf_counter() - start, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--sqs-batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--validation-batch-sizes", type=int, nargs="+", default=[1, 25])
+    parser.add_argument("--hedge-after-ms", type=float, default=0)
+    parser.add_argument("--latency", default="lognormal:20:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    records = make_records(args.messages)
+    print(f"{'workers':>8} {'batch':>6} {'seconds':>8} {'msgs/s':>8} {'failed':>7} {'requests':>9}")
+    for validation_batch_size in args.validation_batch_sizes:
+        for workers in args.workers:
+            config = ServerConfig(args.latency, args.error_rate, args.throttle_rate, seed=args.seed)
+            server, url = start_server(config)
+            try:
+                app = load_submit_app(url, workers, validation_batch_size, args.hedge_after_ms)
+                elapsed, failures = run(app, records, args.sqs_batch_size)
+            finally:
+                server.shutdown()
+            print(f"{workers:>8} {validation_batch_size:>6} {elapsed:>8.2f} {len(records) / elapsed:>8.0f} "
+                  f"{failures:>7} {config.stats['requests']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"Wall time and peak RSS of extracting one applicant archive in every unzip mode, each in a fresh interpreter"
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parent.parent
+layer_dir = repo_root / "10" / "KycCommonLayer"
+probe_path = Path(__file__).resolve().parent / "unzip_memory_probe.py"
+
+app_uuid = "00000000-0000-4000-8000-000000000000"
+modes = ["disk", "stream", "ranged"]
+# summarised across runs, and compared against the baseline report
+measured = ["wall_ms", "peak_rss_mb", "extraction_rss_mb"]
+
+
+def make_archive(path, selfie_mb, license_mb, seed):
+    # photos barely compress, so random bytes stand in for them at the size that matters
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(f"{app_uuid}_selfie.png", rng.randbytes(int(selfie_mb * 1024 * 1024)))
+        zip_ref.writestr(f"{app_uuid}_license.png", rng.randbytes(int(license_mb * 1024 * 1024)))
+        zip_ref.writestr(f"{app_uuid}_details.csv", b"FIRST_NAME,LAST_NAME\nJANE,DOE\n")
+    return os.path.getsize(path)
+
+
+def run_probe(mode, archive_path):
+    process_env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(layer_dir), str(repo_root)])}
+    command = [sys.executable, str(probe_path), mode, archive_path, app_uuid]
+    completed = subprocess.run(command, env=process_env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{mode} probe failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def profile(mode, archive_path, runs):
+    samples = [run_probe(mode, archive_path) for _ in range(runs)]
+    result = {
+        metric: {
+            "median": round(statistics.median(sample[metric] for sample in samples), 1),
+            "max": round(max(sample[metric] for sample in samples), 1),
+        }
+        for metric in measured
+    }
+    result["succeeded"] = all(sample["succeeded"] for sample in samples)
+    return result
+
+
+def compare(report, baseline, threshold, min_delta_ms, min_delta_mb):
+    "Returns a line for every median that grew by more than threshold and min_delta since the baseline"
+    regressions = []
+    for mode, result in report["modes"].items():
+        previous = baseline["modes"].get(mode)
+        if previous is None:
+            continue
+        for metric in measured:
+            before, after = previous[metric]["median"], result[metric]["median"]
+            min_delta = min_delta_ms if metric.endswith("_ms") else min_delta_mb
+            if after - before > min_delta and after > before * (1 + threshold):
+                regressions.append(f"{mode} {metric}: {before} -> {after}")
+    return regressions
+
+
+def print_report(report):
+    print(f"archive of {report['archive_mb']} MB, {report['runs']} runs per mode")
+    print(f"{'mode':>8} {'wall ms':>16} {'peak RSS MB':>18} {'extraction MB':>18} {'succeeded':>10}")
+    for mode, result in report["modes"].items():
+        wall, peak, extraction = (result[metric] for metric in measured)
+        print(f"{mode:>8} {wall['median']:>7} max {wall['max']:>5} {peak['median']:>7} max {peak['max']:>6} "
+              f"{extraction['median']:>7} max {extraction['max']:>6} {str(result['succeeded']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters started per mode")
+    parser.add_argument("--modes", nargs="+", default=modes, choices=modes)
+    parser.add_argument("--selfie-mb", type=float, default=7)
+    parser.add_argument("--license-mb", type=float, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the report as JSON, to commit as the next baseline")
+    parser.add_argument("--compare", help="baseline report to check for regressions, exits 1 if any are found")
+    parser.add_argument("--threshold", type=float, default=0.3, help="relative growth of a median reported as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=100.0, help="growth in wall time below which differences are noise")
+    parser.add_argument("--min-delta-mb", type=float, default=5.0, help="growth in RSS below which differences are noise")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive_path = os.path.join(directory, f"{app_uuid}.zip")
+        archive_size = make_archive(archive_path, args.selfie_mb, args.license_mb, args.seed)
+        report = {
+            "python": platform.python_version(),
+            "runs": args.runs,
+            "archive_mb": round(archive_size / 2 ** 20, 1),
+            "modes": {mode: profile(mode, archive_path, args.runs) for mode in args.modes},
+        }
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold, args.min_delta_ms, args.min_delta_mb)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
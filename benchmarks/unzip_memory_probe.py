@@ -0,0 +1,40 @@
+"Runs inside a fresh interpreter for unzip_memory.py: extracts one archive in one unzip mode and prints the timings"
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import sys
+import time
+
+from kyc_common import archive, clients
+from local import stand_ins
+
+unzip_mode, archive_path, app_uuid = sys.argv[1:4]
+bucket = "kyc-applications"
+key = f"{app_uuid}.zip"
+
+s3 = stand_ins.S3()
+with open(archive_path, "rb") as file:
+    s3.put_object(Bucket=bucket, Key=key, Body=file.read())
+clients.override("s3", s3)
+shutil.rmtree(archive.unzipped_dir, ignore_errors=True)
+os.makedirs(archive.unzipped_dir, exist_ok=True)
+
+# ru_maxrss is a high-water mark in KB on Linux, the stand-in already holds the archive at this point
+setup_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    file_digests, details = archive.extract_application(bucket, key, app_uuid, unzip_mode)
+wall_ms = (time.perf_counter() - start) * 1000
+peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+shutil.rmtree(archive.unzipped_dir, ignore_errors=True)
+
+print(json.dumps({
+    "wall_ms": round(wall_ms, 1),
+    "peak_rss_mb": round(peak_rss_kb / 1024, 1),
+    "extraction_rss_mb": round((peak_rss_kb - setup_rss_kb) / 1024, 1),
+    "members": len(file_digests),
+    "succeeded": details is not None,
+}))
@@ -0,0 +1 @@
+"In-process stand-ins and tools for running the KYC functions without AWS"
@@ -0,0 +1,168 @@
+"Synthetic applicant archives in the format customers upload, for local benchmarks"
+import csv
+import io
+import random
+import uuid
+import zipfile
+
+details_fields = ['DOCUMENT_NUMBER','FIRST_NAME','LAST_NAME','DATE_OF_BIRTH', 'ADDRESS','STATE_IN_ADDRESS','CITY_IN_ADDRESS','ZIP_CODE_IN_ADDRESS']
+first_names = ["JANE", "JOHN", "MARIA", "WEI", "AISHA", "LUCAS", "PRIYA", "OMAR"]
+last_names = ["DOE", "SMITH", "GARCIA", "CHEN", "KHAN", "SILVA", "PATEL", "HASSAN"]
+cities = [("NEW YORK", "NY", "10001"), ("AUSTIN", "TX", "73301"), ("SEATTLE", "WA", "98101"), ("MIAMI", "FL", "33101")]
+png_signature = b"\x89PNG\r\n\x1a\n"
+
+
+class Applicant:
+    "One synthetic application, with the fields Textract should read from its license"
+
+    def __init__(self, app_uuid, archive, details, license_fields, variant, photos=False):
+        self.app_uuid = app_uuid
+        self.archive = archive
+        self.details = details
+        self.license_fields = license_fields
+        # "valid", "mismatch" (the license disagrees with the form) or "invalid" (the form breaks the schema)
+        self.variant = variant
+        # decodable photos rather than random bytes behind a PNG signature
+        self.photos = photos
+
+
+def make_details(rng):
+    city, state, zip_code = rng.choice(cities)
+    return {
+        "DOCUMENT_NUMBER": f"D{rng.randrange(10 ** 8):08d}",
+        "FIRST_NAME": rng.choice(first_names),
+        "LAST_NAME": rng.choice(last_names),
+        "DATE_OF_BIRTH": f"{rng.randint(1950, 2005)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        # addresses with commas are quoted in the CSV
+        "ADDRESS": f"{rng.randint(1, 9999)} MAIN ST" + rng.choice(["", ", APT 4B"]),
+        "STATE_IN_ADDRESS": state,
+        "CITY_IN_ADDRESS": city,
+        "ZIP_CODE_IN_ADDRESS": zip_code,
+    }
+
+
+def make_image(rng, size):
+    # random bytes do not compress, like the image data of a real PNG
+    return png_signature + rng.randbytes(max(size - len(png_signature), 0))
+
+
+def make_photo(rng, side, orientation=1):
+    "A decodable PNG about side pixels wide, with the grain of a phone camera so it does not compress away"
+    # Pillow is only needed by the benchmarks that send real images through the pipeline
+    from PIL import Image, ImageChops, ImageDraw
+
+    width, height = side, side * 3 // 4
+    base = Image.linear_gradient("L").rotate(rng.uniform(0, 360)).resize((width, height)).convert("RGB")
+    tint = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    scene = Image.blend(base, tint, 0.5)
+    # a few shapes in place of a face, so every applicant's photo has its own perceptual hash
+    draw = ImageDraw.Draw(scene)
+    for _ in range(6):
+        x, y = rng.uniform(0, 0.8) * width, rng.uniform(0, 0.8) * height
+        box = [x, y, x + rng.uniform(0.1, 0.4) * width, y + rng.uniform(0.1, 0.4) * height]
+        draw.ellipse(box, fill=tuple(rng.randrange(256) for _ in range(3)))
+    grain = Image.effect_noise((width, height), 8).convert("RGB")
+    photo = ImageChops.add(scene, grain, scale=1.5)
+    exif = Image.Exif()
+    if orientation != 1:
+        # stored sideways with the rotation in EXIF, as phones save portrait shots
+        exif[0x0112] = orientation
+    output = io.BytesIO()
+    # the fastest zlib level keeps building a 3000 pixel photo to about a second
+    photo.save(output, format="PNG", exif=exif, compress_level=1)
+    return output.getvalue()
+
+
+def resaved_photo(data, scale=0.8, quality=70):
+    "The same photo downscaled and through a JPEG round trip, as when a reused photo is saved again"
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        photo = ImageOps.exif_transpose(image).convert("RGB")
+    photo = photo.resize((int(photo.width * scale), int(photo.height * scale)))
+    jpeg = io.BytesIO()
+    photo.save(jpeg, format="JPEG", quality=quality)
+    output = io.BytesIO()
+    Image.open(jpeg).save(output, format="PNG", compress_level=1)
+    return output.getvalue()
+
+
+def with_reused_photo(applicant, source, name="selfie"):
+    "Replaces one photo of the applicant's archive with the source applicant's, resaved, like a fraud ring reusing a photo"
+    with zipfile.ZipFile(io.BytesIO(source.archive)) as zip_file:
+        photo = resaved_photo(zip_file.read(f"{source.app_uuid}_{name}.png"))
+    archive = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(applicant.archive)) as zip_file, zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as output:
+        for member in zip_file.namelist():
+            output.writestr(member, photo if member == f"{applicant.app_uuid}_{name}.png" else zip_file.read(member))
+    applicant.archive = archive.getvalue()
+    return applicant
+
+
+def details_csv(details):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=list(details))
+    writer.writeheader()
+    writer.writerow(details)
+    return output.getvalue().encode("utf-8")
+
+
+def manifest_csv(applicants):
+    # fields missing from an invalid form are left empty, which the manifest parser rejects the same way
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=["APP_UUID", *details_fields], restval="")
+    writer.writeheader()
+    for applicant in applicants:
+        writer.writerow({"APP_UUID": applicant.app_uuid, **applicant.details})
+    return output.getvalue().encode("utf-8")
+
+
+def make_applicant(rng, image_size, variant="valid", photo_side=None):
+    "Builds the zip of one applicant, named <app_uuid>.zip when uploaded, with decodable photos when photo_side is set"
+    app_uuid = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+    details = make_details(rng)
+    license_fields = dict(details)
+    form_details = dict(details)
+    if variant == "mismatch":
+        license_fields["LAST_NAME"] = rng.choice([name for name in last_names if name != details["LAST_NAME"]])
+    elif variant == "invalid":
+        # a missing column or an empty field, both rejected by the Unzip stage
+        if rng.random() < 0.5:
+            form_details.pop("ZIP_CODE_IN_ADDRESS")
+        else:
+            form_details["FIRST_NAME"] = ""
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for name in ("selfie", "license"):
+            if photo_side:
+                image = make_photo(rng, photo_side, orientation=rng.choice([1, 6]))
+            else:
+                image = make_image(rng, image_size)
+            zip_file.writestr(f"{app_uuid}_{name}.png", image)
+        zip_file.writestr(f"{app_uuid}_details.csv", details_csv(form_details))
+    return Applicant(app_uuid, archive.getvalue(), form_details, license_fields, variant, photos=bool(photo_side))
+
+
+def make_applicants(count, image_sizes, mismatch_rate=0.0, invalid_rate=0.0, seed=None, photo_sides=None):
+    "Returns count applicants with image sizes drawn from image_sizes, or photos from photo_sides, and the given share of bad applications"
+    rng = random.Random(seed)
+    applicants = []
+    for _ in range(count):
+        roll = rng.random()
+        variant = "invalid" if roll < invalid_rate else "mismatch" if roll < invalid_rate + mismatch_rate else "valid"
+        photo_side = rng.choice(photo_sides) if photo_sides else None
+        applicants.append(make_applicant(rng, rng.choice(image_sizes), variant, photo_side))
+    return applicants
+
+
+def make_bulk_archive(applicants):
+    "Repacks single applicant archives into one bulk archive: manifest.csv plus the images of every applicant"
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as bulk_file:
+        bulk_file.writestr("manifest.csv", manifest_csv(applicants))
+        for applicant in applicants:
+            with zipfile.ZipFile(io.BytesIO(applicant.archive)) as zip_file:
+                for name in (f"{applicant.app_uuid}_selfie.png", f"{applicant.app_uuid}_license.png"):
+                    bulk_file.writestr(name, zip_file.read(name))
+    return archive.getvalue()
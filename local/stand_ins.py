@@ -0,0 +1,361 @@
+"In-memory stand-ins for the AWS clients the KYC functions use, for local benchmarks and tools"
+import io
+import operator
+import re
+import threading
+import time
+
+condition_token = re.compile(r"\s*(attribute_not_exists|attribute_exists|AND|OR|NOT|<>|<=|>=|[=<>(),]|[#:\w.]+)")
+comparisons = {"=": operator.eq, "<>": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+missing = object()
+
+
+def wire_value(value):
+    "Returns value in the typed form DynamoDB sends over the wire, which boto3 leaves as is in error responses"
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, str):
+        return {"S": value}
+    if isinstance(value, (bytes, bytearray)):
+        return {"B": bytes(value)}
+    if isinstance(value, dict):
+        return {"M": {name: wire_value(item) for name, item in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {"L": [wire_value(item) for item in value]}
+    # int, float and Decimal all travel as a number string
+    return {"N": str(value)}
+
+
+class ConditionalCheckFailedException(Exception):
+    "Raised like the botocore error, with the old item in response when ReturnValuesOnConditionCheckFailure asks for it"
+
+    def __init__(self, item=None):
+        super().__init__("The conditional request failed")
+        self.response = {"Error": {"Code": "ConditionalCheckFailedException"}}
+        if item is not None:
+            # even through the Table resource the item comes back typed, it is not deserialized like a get_item
+            self.response["Item"] = {name: wire_value(value) for name, value in item.items()}
+
+
+class Condition:
+    "Evaluates the ConditionExpression grammar the functions use: comparisons, attribute_(not_)exists, AND, OR, NOT and parentheses"
+
+    def __init__(self, expression, names, values):
+        self.tokens = condition_token.findall(expression)
+        self.names = names
+        self.values = values
+
+    def evaluate(self, item):
+        self.item = item
+        self.position = 0
+        return self.any_of()
+
+    def next_token(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def any_of(self):
+        result = self.all_of()
+        while self.peek() == "OR":
+            self.next_token()
+            # both sides are parsed even when the left one already decides the result
+            result = self.all_of() or result
+        return result
+
+    def all_of(self):
+        result = self.negation()
+        while self.peek() == "AND":
+            self.next_token()
+            result = self.negation() and result
+        return result
+
+    def negation(self):
+        if self.peek() == "NOT":
+            self.next_token()
+            return not self.negation()
+        return self.primary()
+
+    def primary(self):
+        token = self.next_token()
+        if token == "(":
+            result = self.any_of()
+            self.next_token()
+            return result
+        if token in ("attribute_exists", "attribute_not_exists"):
+            self.next_token()
+            exists = self.operand(self.next_token()) is not missing
+            self.next_token()
+            return exists if token == "attribute_exists" else not exists
+        left = self.operand(token)
+        compare = comparisons[self.next_token()]
+        right = self.operand(self.next_token())
+        # comparing an attribute that does not exist is false, whatever the operator
+        return left is not missing and right is not missing and compare(left, right)
+
+    def operand(self, token):
+        if token.startswith(":"):
+            return self.values[token]
+        value = self.item
+        for name in token.split("."):
+            if not isinstance(value, dict) or self.names.get(name, name) not in value:
+                return missing
+            value = value[self.names.get(name, name)]
+        return value
+
+
+class Table:
+    "DynamoDB table stand-in keyed on APP_UUID, covering the calls the functions make"
+
+    class meta:
+        class client:
+            class exceptions:
+                ConditionalCheckFailedException = ConditionalCheckFailedException
+
+    def __init__(self, key_name="APP_UUID"):
+        self.key_name = key_name
+        self.items = {}
+        self.lock = threading.Lock()
+        self.calls = {"put_item": 0, "update_item": 0, "get_item": 0}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        with self.lock:
+            self.calls["put_item"] += 1
+            old_item = self.items.get(Item[self.key_name])
+            condition = ConditionExpression and Condition(ConditionExpression, ExpressionAttributeNames or {}, ExpressionAttributeValues or {})
+            if condition and not condition.evaluate(old_item or {}):
+                raise ConditionalCheckFailedException()
+            self.items[Item[self.key_name]] = dict(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        with self.lock:
+            self.calls["get_item"] += 1
+            item = self.items.get(Key[self.key_name])
+        return {"Item": dict(item)} if item else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, ExpressionAttributeNames=None,
+                    ConditionExpression=None, ReturnValuesOnConditionCheckFailure="NONE", **kwargs):
+        # only supports the "SET a = :v, b = :w" and "REMOVE a, b" expressions the functions build
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self.lock:
+            self.calls["update_item"] += 1
+            old_item = self.items.get(Key[self.key_name])
+            if ConditionExpression and not Condition(ConditionExpression, names, values).evaluate(old_item or {}):
+                returned = dict(old_item) if old_item and ReturnValuesOnConditionCheckFailure == "ALL_OLD" else None
+                raise ConditionalCheckFailedException(returned)
+            item = self.items.setdefault(Key[self.key_name], dict(Key))
+            if UpdateExpression.startswith("REMOVE "):
+                for name in UpdateExpression.removeprefix("REMOVE ").split(","):
+                    item.pop(names.get(name.strip(), name.strip()), None)
+            else:
+                for assignment in UpdateExpression.removeprefix("SET ").split(","):
+                    name, value = (part.strip() for part in assignment.split("="))
+                    item[names.get(name, name)] = values[value]
+        return {"ConsumedCapacity": {"CapacityUnits": 1.0}}
+
+
+class SNS:
+    "SNS client stand-in that records every published message"
+
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def publish(self, **kwargs):
+        with self.lock:
+            self.messages.append(kwargs)
+        return {"MessageId": str(len(self.messages))}
+
+
+class SQS:
+    "SQS client stand-in with visibility timeouts, enough to drain and redrive a queue locally"
+
+    def __init__(self):
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        with self.lock:
+            self.next_id += 1
+            message_id = f"message-{self.next_id}"
+            self.queues.setdefault(QueueUrl, {})[message_id] = {"Body": MessageBody, "visible_at": 0.0, "receives": 0}
+        return {"MessageId": message_id}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, VisibilityTimeout=30, **kwargs):
+        now = time.monotonic()
+        messages = []
+        with self.lock:
+            for message_id, message in self.queues.get(QueueUrl, {}).items():
+                if len(messages) == MaxNumberOfMessages:
+                    break
+                if message["visible_at"] <= now:
+                    message["visible_at"] = now + VisibilityTimeout
+                    message["receives"] += 1
+                    receipt_handle = f"{message_id}#{message['receives']}"
+                    messages.append({"MessageId": message_id, "ReceiptHandle": receipt_handle, "Body": message["Body"]})
+        return {"Messages": messages} if messages else {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        successful = []
+        with self.lock:
+            queue = self.queues.get(QueueUrl, {})
+            for entry in Entries:
+                queue.pop(entry["ReceiptHandle"].split("#")[0], None)
+                successful.append({"Id": entry["Id"]})
+        return {"Successful": successful, "Failed": []}
+
+    def approximate_count(self, QueueUrl):
+        with self.lock:
+            return len(self.queues.get(QueueUrl, {}))
+
+
+class S3:
+    "S3 client stand-in holding objects in memory, including the range GETs and transfers the functions make"
+
+    def __init__(self, latency=0.0):
+        self.objects = {}
+        # seconds added to every request, so request counts show up in the timings
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = {"get_object": 0, "head_object": 0, "put_object": 0}
+
+    def body(self, Bucket, Key):
+        with self.lock:
+            if (Bucket, Key) not in self.objects:
+                raise KeyError(f"NoSuchKey: s3://{Bucket}/{Key}")
+            return self.objects[(Bucket, Key)]
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        data = Body if isinstance(Body, bytes) else Body.read()
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls["put_object"] += 1
+            self.objects[(Bucket, Key)] = data
+        return {"ETag": f'"{len(data)}"'}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        data = self.body(Bucket, Key)
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls["get_object"] += 1
+        if Range:
+            # only the "bytes=start-end" form the functions send
+            start, end = Range.removeprefix("bytes=").split("-")
+            data = data[int(start):int(end) + 1]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def list_objects_v2(self, Bucket, Prefix="", StartAfter="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        # the continuation token is the last key returned, which is how S3 pages in name order too
+        start_after = max(StartAfter, ContinuationToken or "")
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls["list_objects_v2"] = self.calls.get("list_objects_v2", 0) + 1
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix) and key > start_after)
+        page = keys[:MaxKeys]
+        response = {
+            "Contents": [{"Key": key, "Size": len(self.objects[(Bucket, key)])} for key in page],
+            "IsTruncated": len(keys) > MaxKeys,
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls["delete_objects"] = self.calls.get("delete_objects", 0) + 1
+            for item in Delete["Objects"]:
+                self.objects.pop((Bucket, item["Key"]), None)
+        return {"Deleted": Delete["Objects"]}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        data = self.body(Bucket, Key)
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls["head_object"] += 1
+        return {"ContentLength": len(data), "ETag": f'"{len(data)}"'}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, **kwargs):
+        self.put_object(Bucket, Key, Fileobj.read())
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        with open(Filename, "rb") as file:
+            self.put_object(Bucket, Key, file.read())
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        time.sleep(self.latency)
+        with open(Filename, "wb") as file:
+            file.write(self.body(Bucket, Key))
+
+
+class ImageTooLargeException(Exception):
+    "Raised like the Rekognition and Textract errors for images over the size limit of the call"
+
+
+def read_image(s3, image, limit):
+    # the functions always send S3Object references, which the services fetch themselves
+    data = s3.get_object(Bucket=image["S3Object"]["Bucket"], Key=image["S3Object"]["Name"])["Body"].read()
+    if len(data) > limit:
+        raise ImageTooLargeException(f"Image of {len(data)} bytes is over the {limit} byte limit")
+    return data
+
+
+class Rekognition:
+    "Rekognition client stand-in that reads both images and reports the configured similarity"
+
+    # CompareFaces accepts images up to 15 MB as an S3 object
+    s3_limit = 15 * 1024 * 1024
+
+    def __init__(self, s3, similarity=99.0, latency=0.0, latency_per_mb=0.0):
+        self.s3 = s3
+        self.similarity = similarity
+        self.latency = latency
+        # seconds added for every megabyte of image, the time spent transferring and decoding it
+        self.latency_per_mb = latency_per_mb
+        self.calls = 0
+        self.bytes_received = 0
+
+    def compare_faces(self, SourceImage, TargetImage, SimilarityThreshold=80, **kwargs):
+        size = sum(len(read_image(self.s3, image, self.s3_limit)) for image in (SourceImage, TargetImage))
+        time.sleep(self.latency + self.latency_per_mb * size / (1024 * 1024))
+        self.calls += 1
+        self.bytes_received += size
+        matches = [{"Similarity": self.similarity, "Face": {}}] if self.similarity >= SimilarityThreshold else []
+        return {"FaceMatches": matches, "UnmatchedFaces": []}
+
+
+class Textract:
+    "Textract client stand-in that returns the fields registered for each license image"
+
+    # AnalyzeID accepts images up to 10 MB as an S3 object
+    s3_limit = 10 * 1024 * 1024
+
+    def __init__(self, s3, latency=0.0, latency_per_mb=0.0):
+        self.s3 = s3
+        self.latency = latency
+        self.latency_per_mb = latency_per_mb
+        # fields keyed on (bucket, key) of the license image, unregistered images have none
+        self.documents = {}
+        self.calls = 0
+        self.bytes_received = 0
+
+    def analyze_id(self, DocumentPages, **kwargs):
+        document = DocumentPages[0]
+        data = read_image(self.s3, document, self.s3_limit)
+        time.sleep(self.latency + self.latency_per_mb * len(data) / (1024 * 1024))
+        self.calls += 1
+        self.bytes_received += len(data)
+        s3_object = document["S3Object"]
+        fields = self.documents.get((s3_object["Bucket"], s3_object["Name"]), {})
+        return {"IdentityDocuments": [{"IdentityDocumentFields": [
+            {"Type": {"Text": name}, "ValueDetection": {"Text": value}}
+            for name, value in fields.items()
+        ]}]}
@@ -0,0 +1,341 @@
+"In-process executor for the Amazon States Language definitions in the SAM templates"
+import copy
+import json
+import re
+import time
+import uuid
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+# Step Functions rejects any state input or output larger than this
+max_payload_bytes = 256 * 1024
+path_token = re.compile(r"\.([^.\[]+)|\[(\d+)\]")
+
+
+class StateError(Exception):
+    "A failed state, carrying the Error and Cause Step Functions would report"
+
+    def __init__(self, error, cause=""):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+
+class PathNotFound(StateError):
+    "A path that selects nothing in the data, a runtime error unless a Choice rule tests IsPresent"
+
+    def __init__(self, path):
+        super().__init__("States.Runtime", f"Invalid path {path}: the field does not exist")
+
+
+def load_definition(template_path, state_machine="DocumentStateMachine"):
+    "Reads the Definition of a state machine resource, keeping CloudFormation tags as their long-form dicts"
+    import yaml
+
+    class TemplateLoader(yaml.SafeLoader):
+        pass
+
+    def construct_tag(loader, tag_suffix, node):
+        name = "Ref" if tag_suffix == "Ref" else f"Fn::{tag_suffix}"
+        if isinstance(node, yaml.ScalarNode):
+            return {name: loader.construct_scalar(node)}
+        if isinstance(node, yaml.SequenceNode):
+            return {name: loader.construct_sequence(node, deep=True)}
+        return {name: loader.construct_mapping(node, deep=True)}
+
+    TemplateLoader.add_multi_constructor("!", construct_tag)
+    with open(template_path) as file:
+        template = yaml.load(file, Loader=TemplateLoader)
+    return template["Resources"][state_machine]["Properties"]["Definition"]
+
+
+def get_path(data, path):
+    "Evaluates the $.a.b[0] paths the definitions use, raising PathNotFound for missing fields"
+    if not path.startswith("$"):
+        raise StateError("States.Runtime", f"Unsupported path {path}")
+    for name, index in path_token.findall(path[1:]):
+        try:
+            data = data[int(index)] if index else data[name]
+        except (KeyError, IndexError, TypeError):
+            raise PathNotFound(path) from None
+    return data
+
+
+def set_path(data, path, value):
+    # ResultPath writes into a copy of the state input, creating the objects on the way
+    if path == "$":
+        return value
+    result = copy.deepcopy(data)
+    target = result
+    names = [name for name, _ in path_token.findall(path[1:])]
+    for name in names[:-1]:
+        if not isinstance(target.get(name), dict):
+            target[name] = {}
+        target = target[name]
+    target[names[-1]] = value
+    return result
+
+
+def payload_size(data):
+    return len(json.dumps(data, separators=(",", ":")))
+
+
+class StateMachine:
+    "Runs a definition against Python callables, recording the timing and payload size of every state"
+
+    def __init__(self, definition, resources, references=None, max_workers=8):
+        self.definition = definition
+        # callables taking the task input, keyed on the logical ID in !GetAtt or on the resource ARN
+        self.resources = resources
+        # values of the !GetAtt and !Ref expressions used outside Resource, such as the queue URL
+        self.references = references or {}
+        # shared by the Parallel branches of every execution
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def execute(self, execution_input):
+        "Returns SUCCEEDED with the output, or FAILED with the error and cause, like DescribeExecution, plus the state history"
+        history = []
+        try:
+            output = self.run_states(self.definition, json.loads(json.dumps(execution_input)), history)
+            return {"status": "SUCCEEDED", "output": output, "history": history}
+        except StateError as e:
+            return {"status": "FAILED", "error": e.error, "cause": e.cause, "history": history}
+
+    def run_states(self, definition, data, history):
+        states = definition["States"]
+        name = definition["StartAt"]
+        while True:
+            state = states[name]
+            # one entry per state that ran, parallel branches append to the same history
+            entry = {"state": name, "type": state["Type"], "input_bytes": payload_size(data), "error": None}
+            start = time.perf_counter()
+            try:
+                data, next_name = self.run_state(name, state, data, history)
+                entry["output_bytes"] = payload_size(data)
+            except StateError as e:
+                entry["error"] = e.error
+                raise
+            finally:
+                entry["duration_ms"] = (time.perf_counter() - start) * 1000
+                history.append(entry)
+            if next_name is None:
+                return data
+            name = next_name
+
+    def run_state(self, name, state, data, history):
+        # returns the state output and the next state, or None once the execution or branch ends
+        state_type = state["Type"]
+        next_name = None if state.get("End") else state.get("Next")
+        if state_type == "Fail":
+            raise StateError(state.get("Error", "States.Fail"), state.get("Cause", ""))
+        if state_type == "Succeed":
+            return data, None
+        if state_type == "Choice":
+            return data, self.choose(state, data)
+
+        try:
+            effective_input = self.parameters(state, get_path(data, state.get("InputPath", "$")))
+            if payload_size(effective_input) > max_payload_bytes:
+                raise StateError("States.DataLimitExceeded", f"Input of {name} is larger than {max_payload_bytes} bytes")
+            if state_type == "Pass":
+                result = state.get("Result", effective_input)
+            elif state_type == "Task":
+                result = self.run_task(state, effective_input)
+            elif state_type == "Parallel":
+                result = self.run_parallel(state, effective_input, history)
+            elif state_type == "Map":
+                result = self.run_map(state, effective_input, history)
+            else:
+                raise StateError("States.Runtime", f"State type {state_type} is not supported locally")
+        except StateError as e:
+            catcher = next((catcher for catcher in state.get("Catch", []) if self.matches(catcher, e.error)), None)
+            if catcher is None:
+                raise
+            error_output = {"Error": e.error, "Cause": e.cause}
+            return set_path(data, catcher.get("ResultPath", "$"), error_output), catcher["Next"]
+
+        if "ResultSelector" in state:
+            result = self.evaluate(state["ResultSelector"], result)
+        if "ResultPath" in state and state["ResultPath"] is None:
+            output = data
+        else:
+            output = set_path(data, state.get("ResultPath", "$"), result)
+        output = get_path(output, state.get("OutputPath", "$"))
+        if payload_size(output) > max_payload_bytes:
+            raise StateError("States.DataLimitExceeded", f"Output of {name} is larger than {max_payload_bytes} bytes")
+        return output, next_name
+
+    def parameters(self, state, data):
+        return self.evaluate(state["Parameters"], data) if "Parameters" in state else data
+
+    def evaluate(self, template, data, context=None):
+        # fills in the "name.$" fields of Parameters and ResultSelector from the data,
+        # or from the context object for "$$." paths such as $$.Map.Item.Value
+        if isinstance(template, dict):
+            if len(template) == 1 and next(iter(template)) in ("Ref", "Fn::GetAtt", "Fn::Sub"):
+                value = next(iter(template.values()))
+                return self.references.get(value, value)
+            result = {}
+            for key, value in template.items():
+                if key.endswith(".$") and value.startswith("$$."):
+                    result[key[:-2]] = get_path(context or {}, value[1:])
+                elif key.endswith(".$"):
+                    result[key[:-2]] = get_path(data, value)
+                else:
+                    result[key] = self.evaluate(value, data, context)
+            return result
+        if isinstance(template, list):
+            return [self.evaluate(value, data, context) for value in template]
+        return template
+
+    def run_task(self, state, task_input):
+        resource = state["Resource"]
+        if isinstance(resource, dict):
+            # !GetAtt UnzipLambdaFunction.Arn names the function by its logical ID
+            resource = next(iter(resource.values())).split(".")[0]
+        handler = self.resources[resource]
+
+        retriers = state.get("Retry", [])
+        attempts = {}
+        while True:
+            try:
+                # the payload crosses a JSON boundary on the way in and out, as it does in AWS
+                return json.loads(json.dumps(handler(json.loads(json.dumps(task_input)))))
+            except Exception as e:
+                error = e.error if isinstance(e, StateError) else type(e).__name__
+                retrier = next((retrier for retrier in retriers if self.matches(retrier, error)), None)
+                index = retriers.index(retrier) if retrier else None
+                attempts[index] = attempts.get(index, 0) + 1
+                if retrier is None or attempts[index] > retrier.get("MaxAttempts", 3):
+                    if isinstance(e, StateError):
+                        raise
+                    # a Lambda function error carries the exception the same way the Lambda service reports it
+                    cause = json.dumps({"errorMessage": str(e), "errorType": error, "stackTrace": []})
+                    raise StateError(error, cause) from e
+                interval = retrier.get("IntervalSeconds", 1) * retrier.get("BackoffRate", 2.0) ** (attempts[index] - 1)
+                time.sleep(interval)
+
+    def run_parallel(self, state, data, history):
+        # every branch gets the same input, the first branch to fail fails the whole state
+        futures = [self.executor.submit(self.run_states, branch, data, history) for branch in state["Branches"]]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            if future in done and future.exception() is not None:
+                # Step Functions stops the other branches, here they finish in the background
+                raise future.exception()
+        return [future.result() for future in futures]
+
+    def run_map(self, state, data, history):
+        # the items come from ItemsPath, or from the S3 object named by the ItemReader of a Distributed Map
+        if "ItemReader" in state:
+            reader = state["ItemReader"]
+            read_items = self.resources[reader["Resource"]]
+            items = read_items(self.evaluate(reader.get("Parameters", {}), data), reader.get("ReaderConfig", {}))
+        else:
+            items = get_path(data, state.get("ItemsPath", "$"))
+        if not isinstance(items, list):
+            raise StateError("States.Runtime", "The items of a Map state must be a JSON array")
+        processor = state.get("ItemProcessor", state.get("Iterator"))
+
+        def run_item(index, item):
+            context = {"Map": {"Item": {"Index": index, "Value": item}}}
+            item_input = self.evaluate(state["ItemSelector"], data, context) if "ItemSelector" in state else item
+            try:
+                return self.run_states(processor, json.loads(json.dumps(item_input)), history), None
+            except StateError as e:
+                return {"Error": e.error, "Cause": e.cause}, e
+
+        # MaxConcurrency 0 means no limit, the iterations get their own threads so the
+        # Parallel states inside them can still use the shared executor
+        max_concurrency = state.get("MaxConcurrency", 0) or max(len(items), 1)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as map_executor:
+            outcomes = list(map_executor.map(run_item, range(len(items)), items))
+
+        failures = [error for _, error in outcomes if error is not None]
+        tolerated = max(state.get("ToleratedFailureCount", 0), len(items) * state.get("ToleratedFailurePercentage", 0) / 100)
+        if failures and "ToleratedFailureCount" not in state and "ToleratedFailurePercentage" not in state:
+            raise failures[0]
+        if len(failures) > tolerated:
+            raise StateError("States.ExceedToleratedFailureThreshold",
+                             f"{len(failures)} of {len(items)} items failed, {tolerated:g} are tolerated")
+
+        results = [result for result, _ in outcomes]
+        if "ResultWriter" in state:
+            writer = state["ResultWriter"]
+            return self.resources[writer["Resource"]](self.evaluate(writer.get("Parameters", {}), data), outcomes)
+        return results
+
+    def matches(self, rule, error):
+        return error in rule["ErrorEquals"] or "States.ALL" in rule["ErrorEquals"]
+
+    def choose(self, state, data):
+        for choice in state.get("Choices", []):
+            if self.rule_matches(choice, data):
+                return choice["Next"]
+        if "Default" not in state:
+            raise StateError("States.NoChoiceMatched", "No choice rule matched and there is no Default")
+        return state["Default"]
+
+    def rule_matches(self, rule, data):
+        if "And" in rule:
+            return all(self.rule_matches(inner, data) for inner in rule["And"])
+        if "Or" in rule:
+            return any(self.rule_matches(inner, data) for inner in rule["Or"])
+        if "Not" in rule:
+            return not self.rule_matches(rule["Not"], data)
+
+        try:
+            value = get_path(data, rule["Variable"])
+        except PathNotFound:
+            if "IsPresent" in rule:
+                return not rule["IsPresent"]
+            # comparing a missing field is a runtime error in Step Functions
+            raise StateError("States.Runtime", f"Invalid path {rule['Variable']}")
+        if "IsPresent" in rule:
+            return rule["IsPresent"]
+        if "IsNull" in rule:
+            return (value is None) == rule["IsNull"]
+        if "BooleanEquals" in rule:
+            return isinstance(value, bool) and value == rule["BooleanEquals"]
+        if "StringEquals" in rule:
+            return isinstance(value, str) and value == rule["StringEquals"]
+        if "NumericEquals" in rule:
+            return not isinstance(value, bool) and isinstance(value, (int, float)) and value == rule["NumericEquals"]
+        if "NumericGreaterThan" in rule:
+            return not isinstance(value, bool) and isinstance(value, (int, float)) and value > rule["NumericGreaterThan"]
+        if "NumericLessThan" in rule:
+            return not isinstance(value, bool) and isinstance(value, (int, float)) and value < rule["NumericLessThan"]
+        raise StateError("States.Runtime", f"Choice rule {rule} is not supported locally")
+
+
+def lambda_resource(handler):
+    "Wraps a lambda_handler as a Task resource"
+    return lambda payload: handler(payload, None)
+
+
+def s3_item_reader(s3):
+    "The arn:aws:states:::s3:getObject item reader of a Distributed Map, for objects holding a JSON array"
+    def read_items(parameters, reader_config):
+        if reader_config.get("InputType", "JSON") != "JSON":
+            raise StateError("States.Runtime", f"ItemReader InputType {reader_config['InputType']} is not supported locally")
+        body = s3.get_object(Bucket=parameters["Bucket"], Key=parameters["Key"])["Body"].read()
+        return json.loads(body)
+    return read_items
+
+
+def s3_result_writer(s3):
+    "The arn:aws:states:::s3:putObject result writer, storing the succeeded and failed items of a Map run under the prefix"
+    def write_results(parameters, outcomes):
+        prefix = f"{parameters['Prefix'].rstrip('/')}/{uuid.uuid4()}"
+        files = {
+            "SUCCEEDED_0.json": [{"Output": result} for result, error in outcomes if error is None],
+            "FAILED_0.json": [result for result, error in outcomes if error is not None],
+        }
+        for name, entries in files.items():
+            s3.put_object(Bucket=parameters["Bucket"], Key=f"{prefix}/{name}", Body=json.dumps(entries).encode("utf-8"))
+        manifest = {
+            "DestinationBucket": parameters["Bucket"],
+            "ResultFiles": {status: len(entries) for status, entries in files.items()},
+        }
+        s3.put_object(Bucket=parameters["Bucket"], Key=f"{prefix}/manifest.json", Body=json.dumps(manifest).encode("utf-8"))
+        return {"ResultWriterDetails": {"Bucket": parameters["Bucket"], "Key": f"{prefix}/manifest.json"}}
+    return write_results
@@ -0,0 +1,6 @@
+"Puts the shared layer and the local stand-ins on the path, the way the functions and benchmarks see them"
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, "10", "KycCommonLayer"), root]
@@ -0,0 +1,144 @@
+"Hostile archives are rejected before they are expanded, in every unzip mode"
+import io
+import os
+import time
+import zipfile
+
+import pytest
+
+from kyc_common import archive, clients
+from local.stand_ins import S3
+
+bucket = "kyc-test-bucket"
+app_uuid = "0f8fad5b-d9cb-469f-a165-70867728950e"
+modes = ["disk", "stream", "ranged"]
+# every rejection happens on the central directory or the first bytes read, so it is quick
+time_limit_s = 2.0
+
+
+@pytest.fixture
+def s3():
+    stand_in = S3()
+    clients.override("s3", stand_in)
+    return stand_in
+
+
+def make_archive(members, compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as zip_ref:
+        for name, data in members.items():
+            zip_ref.writestr(name, data)
+    return buffer.getvalue()
+
+
+def application_members(**overrides):
+    members = {
+        f"{app_uuid}_selfie.png": os.urandom(4096),
+        f"{app_uuid}_license.png": os.urandom(4096),
+        f"{app_uuid}_details.csv": b"FIRST_NAME,LAST_NAME\nJane,Doe\n",
+    }
+    members.update(overrides)
+    return members
+
+
+def extract(s3, data, mode):
+    key = f"zipped/{app_uuid}.zip"
+    s3.put_object(Bucket=bucket, Key=key, Body=data)
+    start = time.perf_counter()
+    try:
+        return archive.extract_application(bucket, key, app_uuid, mode)
+    finally:
+        assert time.perf_counter() - start < time_limit_s
+
+
+def uploaded_keys(s3):
+    return sorted(key for _, key in s3.objects if not key.startswith("zipped/"))
+
+
+@pytest.mark.parametrize("mode", modes)
+def test_extracts_a_valid_archive(s3, mode):
+    file_digests, details = extract(s3, make_archive(application_members()), mode)
+
+    assert sorted(file_digests) == sorted(application_members())
+    assert details == b"FIRST_NAME,LAST_NAME\nJane,Doe\n"
+    assert all(key.startswith(archive.unzipped_s3_prefix) for key in uploaded_keys(s3))
+
+
+@pytest.mark.parametrize("mode", modes)
+def test_rejects_a_zip_bomb(s3, mode):
+    # 20 MB of zeros deflates to about 20 KB, far past the compression ratio limit
+    data = make_archive(application_members(**{f"{app_uuid}_license.png": bytes(20 * 1024 * 1024)}))
+
+    with pytest.raises(archive.ArchiveRejectedError, match="compression ratio"):
+        extract(s3, data, mode)
+    assert uploaded_keys(s3) == []
+
+
+@pytest.mark.parametrize("mode", modes)
+def test_rejects_too_many_members(s3, mode):
+    extra = {f"{app_uuid}_extra_{number}.txt": b"x" for number in range(archive.max_members)}
+    data = make_archive(application_members(**extra))
+
+    with pytest.raises(archive.ArchiveRejectedError, match="members, limit is"):
+        extract(s3, data, mode)
+    assert uploaded_keys(s3) == []
+
+
+@pytest.mark.parametrize("mode", modes)
+def test_rejects_a_file_that_is_not_a_zip(s3, mode):
+    # the functions turn BadZipFile into ArchiveRejectedError for the state machine
+    with pytest.raises((archive.ArchiveRejectedError, zipfile.BadZipFile)):
+        extract(s3, os.urandom(64 * 1024), mode)
+    assert uploaded_keys(s3) == []
+
+
+@pytest.mark.parametrize("mode", modes)
+@pytest.mark.parametrize("name", [
+    f"../../{app_uuid}_selfie.png",
+    f"photos/../../{app_uuid}_selfie.png",
+    f"/etc/{app_uuid}_selfie.png",
+    f"..\\..\\{app_uuid}_selfie.png",
+    f"C:/{app_uuid}_selfie.png",
+])
+def test_rejects_path_traversal_names(s3, mode, name):
+    data = make_archive(application_members(**{name: os.urandom(1024)}))
+
+    with pytest.raises(archive.ArchiveRejectedError, match="absolute or parent directory"):
+        extract(s3, data, mode)
+    assert uploaded_keys(s3) == []
+
+
+def test_guarded_reader_stops_a_member_that_lies_about_its_size():
+    member = zipfile.ZipInfo(f"{app_uuid}_selfie.png")
+    member.file_size = 1024
+    reader = archive.GuardedReader(io.BytesIO(bytes(1024 * 1024)), member, archive.ExtractionBudget())
+
+    start = time.perf_counter()
+    with pytest.raises(archive.ArchiveRejectedError, match="past its declared size"):
+        while reader.read(4096):
+            pass
+    assert time.perf_counter() - start < time_limit_s
+    assert reader.bytes_read <= 1024 + 4096
+
+
+def test_guarded_readers_share_one_budget():
+    budget = archive.ExtractionBudget(size_limit=6000)
+    members = []
+    for number in range(2):
+        member = zipfile.ZipInfo(f"member_{number}")
+        member.file_size = 4000
+        members.append(archive.GuardedReader(io.BytesIO(bytes(4000)), member, budget))
+
+    members[0].read()
+    with pytest.raises(archive.ArchiveRejectedError, match="expanded past 6000 bytes"):
+        members[1].read()
+
+
+@pytest.mark.parametrize("mode", modes)
+def test_budget_holds_when_the_headers_pass_the_checks(s3, mode, monkeypatch):
+    # the declared sizes pass check_archive, the budget stops what is actually decompressed
+    monkeypatch.setattr(archive.ExtractionBudget.__init__, "__defaults__", (6000,))
+    data = make_archive(application_members())
+
+    with pytest.raises(archive.ArchiveRejectedError, match="expanded past 6000 bytes"):
+        extract(s3, data, mode)
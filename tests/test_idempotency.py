@@ -0,0 +1,200 @@
+"Each pipeline stage runs once per upload, across duplicated, retried and partly failed executions"
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from kyc_common import clients, idempotency
+from local import stand_ins
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+app_uuid = "0f8fad5b-d9cb-469f-a165-70867728950e"
+upload = f"kyc-applications/{app_uuid}.zip/etag/sequencer"
+
+
+@pytest.fixture
+def table():
+    stand_in = stand_ins.Table(key_name="STAGE_KEY")
+    clients.override(table_name=idempotency.stage_table_name, stand_in=stand_in)
+    return stand_in
+
+
+class Stage:
+    "Counts its runs and fails the first ones when asked to"
+
+    def __init__(self, result, failures=0):
+        self.result = result
+        self.failures = failures
+        self.runs = 0
+
+    def __call__(self):
+        self.runs += 1
+        if self.runs <= self.failures:
+            raise RuntimeError(f"run {self.runs} failed")
+        return self.result
+
+
+def test_conditional_check_failure_returns_the_item_typed_like_dynamodb():
+    # the Table resource deserializes successful responses only, so the stand-in has to match the raw error
+    from boto3.session import Session
+    from botocore.stub import Stubber
+
+    resource_table = Session(region_name="us-east-1", aws_access_key_id="local", aws_secret_access_key="local").resource("dynamodb").Table(
+        idempotency.stage_table_name)
+    key = {"STAGE_KEY": idempotency.marker_key(app_uuid, "unzip")}
+    marker = {**key, "UPLOAD_ID": upload, "STATUS": "COMPLETED", "RESULT": json.dumps({"ok": True}), "EXPIRES_AT": 1767225600}
+    with Stubber(resource_table.meta.client) as stubber:
+        stubber.add_client_error(
+            "update_item",
+            service_error_code="ConditionalCheckFailedException",
+            modeled_fields={"Item": {"STAGE_KEY": {"S": key["STAGE_KEY"]}, "UPLOAD_ID": {"S": upload}, "STATUS": {"S": "COMPLETED"},
+                                     "RESULT": {"S": marker["RESULT"]}, "EXPIRES_AT": {"N": "1767225600"}}},
+        )
+        with pytest.raises(resource_table.meta.client.exceptions.ConditionalCheckFailedException) as real_error:
+            resource_table.update_item(Key=key, UpdateExpression="SET #a = :v", ConditionExpression="attribute_not_exists(#a)",
+                                       ExpressionAttributeNames={"#a": "UPLOAD_ID"}, ExpressionAttributeValues={":v": upload},
+                                       ReturnValuesOnConditionCheckFailure="ALL_OLD")
+
+    stand_in = stand_ins.Table(key_name="STAGE_KEY")
+    stand_in.put_item(Item=marker)
+    with pytest.raises(stand_ins.ConditionalCheckFailedException) as stand_in_error:
+        stand_in.update_item(Key=key, UpdateExpression="SET #a = :v", ConditionExpression="attribute_not_exists(#a)",
+                             ExpressionAttributeNames={"#a": "UPLOAD_ID"}, ExpressionAttributeValues={":v": upload},
+                             ReturnValuesOnConditionCheckFailure="ALL_OLD")
+
+    assert stand_in_error.value.response["Item"] == real_error.value.response["Item"]
+
+
+def test_duplicate_returns_the_recorded_result(table):
+    stage = Stage({"digests": {"selfie": "abc"}, "similarity": 99.5})
+
+    first = idempotency.run_stage("unzip", app_uuid, upload, stage)
+    second = idempotency.run_stage("unzip", app_uuid, upload, stage)
+
+    assert first == second == {"digests": {"selfie": "abc"}, "similarity": 99.5}
+    assert stage.runs == 1
+
+
+def test_duplicate_of_a_stage_returning_nothing_is_not_run_again(table):
+    stage = Stage(None)
+
+    idempotency.run_stage("write", app_uuid, upload, stage)
+
+    assert idempotency.run_stage("write", app_uuid, upload, stage) is None
+    assert stage.runs == 1
+
+
+def test_duplicate_while_the_stage_runs_waits(table):
+    def run_duplicate():
+        with pytest.raises(idempotency.StageInProgressError):
+            idempotency.run_stage("faces", app_uuid, upload, Stage(True))
+        return True
+
+    assert idempotency.run_stage("faces", app_uuid, upload, run_duplicate) is True
+
+
+def test_retry_after_a_failure_runs_the_stage_again(table):
+    stage = Stage(True, failures=1)
+
+    with pytest.raises(RuntimeError):
+        idempotency.run_stage("faces", app_uuid, upload, stage)
+    assert idempotency.run_stage("faces", app_uuid, upload, stage) is True
+    assert idempotency.run_stage("faces", app_uuid, upload, stage) is True
+    assert stage.runs == 2
+
+
+def test_claim_left_by_a_dead_invocation_expires(table, monkeypatch):
+    table.put_item(Item={
+        "STAGE_KEY": idempotency.marker_key(app_uuid, "details"),
+        "UPLOAD_ID": upload,
+        "STATUS": "IN_PROGRESS",
+        "CLAIMED_UNTIL": int(time.time()) - 1,
+    })
+    stage = Stage(True)
+
+    assert idempotency.run_stage("details", app_uuid, upload, stage) is True
+    assert stage.runs == 1
+
+
+def test_new_upload_of_the_same_application_runs_again(table):
+    stage = Stage(True)
+
+    idempotency.run_stage("faces", app_uuid, upload, stage)
+    idempotency.run_stage("faces", app_uuid, upload.replace("etag", "etag2"), stage)
+
+    assert stage.runs == 2
+
+
+def test_partly_failed_execution_only_reruns_the_unfinished_stages(table):
+    stages = {"unzip": Stage({"details_valid": True}), "normalize": Stage({}), "faces": Stage(True, failures=1), "write": Stage(None)}
+
+    def execute():
+        return {name: idempotency.run_stage(name, app_uuid, upload, stage) for name, stage in stages.items()}
+
+    with pytest.raises(RuntimeError):
+        execute()
+    assert execute() == {"unzip": {"details_valid": True}, "normalize": {}, "faces": True, "write": None}
+    assert {name: stage.runs for name, stage in stages.items()} == {"unzip": 1, "normalize": 1, "faces": 2, "write": 1}
+
+
+def test_duplicated_execution_makes_no_second_paid_call():
+    import contextlib
+
+    from pipeline import Pipeline, configure_environment
+    from local.applicants import make_applicants
+
+    configure_environment()
+    pipeline = Pipeline(0, 0, 1)
+    applicants = make_applicants(2, [4096], seed=7)
+    pipeline.upload(applicants)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            first = [pipeline.run(applicant)[1] for applicant in applicants]
+            calls = (pipeline.rekognition.calls, pipeline.textract.calls)
+            item_writes = pipeline.table.calls["update_item"] + pipeline.table.calls["put_item"]
+            second = [pipeline.run(applicant)[1] for applicant in applicants]
+    finally:
+        pipeline.state_machine.executor.shutdown()
+
+    assert first == second
+    assert (pipeline.rekognition.calls, pipeline.textract.calls) == calls
+    # the duplicates stop at their markers, which are items of their own in the stage table
+    assert pipeline.table.calls["update_item"] + pipeline.table.calls["put_item"] == item_writes
+    assert {key.split("#")[1] for key in pipeline.stage_table.items} == {"UNZIP", "NORMALIZE", "FACES", "DETAILS", "WRITE", "SEND"}
+
+
+def test_resent_bulk_batch_keeps_the_recorded_applicants(table):
+    import contextlib
+
+    from pipeline import bucket, configure_environment, load_handler
+    from local.applicants import make_applicants, make_bulk_archive
+
+    configure_environment()
+    s3 = stand_ins.S3()
+    customers = stand_ins.Table()
+    clients.override("s3", s3)
+    clients.override(table_name=os.environ["TABLE"], stand_in=customers)
+    split, _ = load_handler("bulk_split", "10/BulkSplitLambdaFunction")
+    applicants = make_applicants(3, [1024], seed=3)
+    key = "bulk/incoming/batch-3.zip"
+
+    def deliver(etag, batch):
+        s3.put_object(Bucket=bucket, Key=key, Body=make_bulk_archive(batch))
+        event = {"time": "2026-01-01T00:00:00+00:00", "detail": {"bucket": {"name": bucket}, "object": {"key": key, "etag": etag}}}
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return split(event, None)
+
+    first = deliver("etag-1", applicants[:2])
+    customers.items[applicants[0].app_uuid]["LICENSE_SELFIE_MATCH"] = True
+    uploads = s3.calls["put_object"]
+
+    # the same event again returns the recorded batch, the only S3 put is the archive this test uploads
+    assert deliver("etag-1", applicants[:2]) == first
+    assert s3.calls["put_object"] == uploads + 1
+    # a new upload of the batch only records and checks the applicant that is new
+    second = deliver("etag-2", applicants)
+    assert (first["applicants"], second["applicants"], second["already_recorded"]) == (2, 1, 2)
+    assert customers.items[applicants[0].app_uuid]["LICENSE_SELFIE_MATCH"] is True
@@ -0,0 +1,87 @@
+"The selfie hash index keeps any APP_UUID, spares the face check of a reused selfie, and a failing index never blocks the check"
+import pytest
+
+from kyc_common import checks, clients
+from kyc_common.phash import HashIndex, SharedHashIndex, dump_entries
+from local.stand_ins import S3
+
+bucket = "kyc-applications"
+owners = ["0f8fad5b-d9cb-469f-a165-70867728950e", "applicant-42", "ABCDEF", "ü" * 40, "0f8fad5bd9cb469f"]
+
+
+def test_index_keeps_free_form_app_uuids():
+    index = HashIndex()
+    for number, owner in enumerate(owners):
+        index.add(0xF0F0F0F0F0F0F0F0 ^ number, owner, "selfie")
+
+    found = index.lookup(0xF0F0F0F0F0F0F0F0, exclude=owners[0])
+
+    assert sorted(owner for _, owner, _ in found) == sorted(owners[1:])
+
+
+def test_snapshot_and_segments_round_trip_app_uuids():
+    index = HashIndex()
+    for number, owner in enumerate(owners):
+        index.load(dump_entries(owner, {"selfie": 0x0123456789ABCDEF ^ (1 << number)}))
+
+    loaded = HashIndex()
+    loaded.load_snapshot(index.dump_snapshot())
+    loaded.add(0x0123456789ABCDEF, "added-after-the-snapshot", "selfie")
+
+    assert len(loaded) == len(owners) + 1
+    assert {owner for _, owner, _ in loaded.lookup(0x0123456789ABCDEF)} == {*owners, "added-after-the-snapshot"}
+
+
+def test_empty_app_uuid_is_rejected():
+    with pytest.raises(ValueError):
+        HashIndex().add(1, "", "selfie")
+
+
+@pytest.fixture
+def index(monkeypatch):
+    clients.override("s3", S3())
+    monkeypatch.setattr(checks, "photo_index", SharedHashIndex())
+    return checks.photo_index
+
+
+def test_only_the_selfie_is_looked_up(index):
+    images = {"selfie": {"dhash": "00000000000000ff"}, "license": {"dhash": "ffffffffffffff00"}}
+
+    checks.find_reused_photos(bucket, "first", images)
+
+    assert [kind for _, _, kind in index.index.lookup(0xFF)] == ["selfie"]
+    assert index.index.lookup(0xFFFFFFFFFFFFFF00) == []
+
+
+def test_reused_selfie_returns_the_earlier_applications(index):
+    images = {"selfie": {"dhash": "00000000000000ff"}}
+
+    assert checks.find_reused_photos(bucket, "first", images) == []
+    assert checks.find_reused_photos(bucket, "second", {"selfie": {"dhash": "00000000000001ff"}}) == ["first"]
+
+
+def test_index_failure_lets_the_check_go_on(index, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("snapshot is corrupt")
+
+    monkeypatch.setattr(index, "find_reused", fail)
+
+    assert checks.find_reused_photos(bucket, "first", {"selfie": {"dhash": "00000000000000ff"}}) == []
+
+
+def test_reused_selfie_is_flagged_without_a_rekognition_call(index, monkeypatch):
+    from local.stand_ins import SNS
+
+    sns = SNS()
+    clients.override("sns", sns)
+    monkeypatch.setenv("TOPIC", "arn:aws:sns:us-east-1:000000000000:ApplicationNotifications")
+    compared = []
+    monkeypatch.setattr(checks, "compare_faces", lambda app_uuid, *args: compared.append(app_uuid) or True)
+
+    first = checks.check_faces("first", bucket, "license", "selfie", images={"selfie": {"dhash": "00000000000000ff"}})
+    second = checks.check_faces("second", bucket, "license", "selfie", images={"selfie": {"dhash": "00000000000001ff"}})
+
+    assert first == {"LICENSE_SELFIE_MATCH": True}
+    assert second == {"LICENSE_SELFIE_MATCH": None, "SELFIE_REUSED_FROM": ["first"]}
+    assert compared == ["first"]
+    assert len(sns.messages) == 1
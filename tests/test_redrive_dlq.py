@@ -0,0 +1,93 @@
+"The DLQ redrive tool drains the queue through the handler, leaves failed messages behind and keeps to the vendor rate"
+import json
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "8", "SubmitFunction"))
+
+from local.stand_ins import SQS
+from redrive_dlq import TokenBucket, redrive
+
+dlq_url = "LicenseDeadLetterQueue"
+
+
+def load_dlq(count):
+    sqs = SQS()
+    for i in range(count):
+        sqs.send_message(QueueUrl=dlq_url, MessageBody=json.dumps({"driver_license_id": f"D{i:08d}", "app_uuid": f"app-{i}"}))
+    return sqs
+
+
+class Handler:
+    "Answers like SubmitFunction, failing the licenses listed in failing"
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.seen = []
+        self.lock = threading.Lock()
+
+    def __call__(self, event, context):
+        bodies = [json.loads(record["body"]) for record in event["Records"]]
+        with self.lock:
+            self.seen.extend(body["app_uuid"] for body in bodies)
+        return {"batchItemFailures": [
+            {"itemIdentifier": record["messageId"]}
+            for record, body in zip(event["Records"], bodies) if body["app_uuid"] in self.failing
+        ]}
+
+
+def test_redrive_drains_the_queue():
+    sqs = load_dlq(45)
+    handler = Handler()
+
+    summary = redrive(sqs, dlq_url, handler, workers=2, rate=0, batch_size=10)
+
+    assert summary["received"] == summary["replayed"] == 45
+    assert summary["failed"] == 0
+    assert sqs.approximate_count(dlq_url) == 0
+    assert sorted(handler.seen) == sorted(f"app-{i}" for i in range(45))
+
+
+def test_failed_messages_stay_in_the_queue():
+    sqs = load_dlq(30)
+    handler = Handler(failing={f"app-{i}" for i in range(0, 30, 3)})
+
+    summary = redrive(sqs, dlq_url, handler, workers=2, rate=0, batch_size=10)
+
+    assert summary["received"] == 30
+    assert summary["replayed"] == 20
+    assert summary["failed"] == 10
+    assert sqs.approximate_count(dlq_url) == 10
+
+
+def test_handler_errors_leave_the_whole_batch():
+    sqs = load_dlq(20)
+
+    def broken_handler(event, context):
+        raise RuntimeError("validation API is down")
+
+    summary = redrive(sqs, dlq_url, broken_handler, workers=1, rate=0, batch_size=10)
+
+    assert summary["replayed"] == 0
+    assert summary["failed"] == 20
+    assert sqs.approximate_count(dlq_url) == 20
+
+
+def test_redrive_keeps_to_the_rate():
+    # one second of burst, then the other 30 messages are paced at 20 per second
+    sqs = load_dlq(50)
+
+    summary = redrive(sqs, dlq_url, Handler(), workers=4, rate=20, batch_size=10)
+
+    assert summary["replayed"] == 50
+    assert summary["seconds"] >= 1.4
+    assert summary["rate_limit_wait_seconds"] > 0
+
+
+def test_token_bucket_allows_a_burst_then_waits():
+    bucket = TokenBucket(rate=100)
+
+    assert bucket.acquire(100) == 0.0
+    assert bucket.acquire(10) > 0.05
+    assert TokenBucket(rate=0).acquire(1000) == 0.0
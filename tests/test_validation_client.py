@@ -0,0 +1,88 @@
+"Retries to the validation API stop before the SubmitFunction invocation runs out of time"
+import importlib.util
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+repo_root = Path(__file__).resolve().parent.parent
+submit_dir = repo_root / "8" / "SubmitFunction"
+# local_server imports the ValidateFunction handler as app, so its directory goes first
+sys.path[:0] = [str(repo_root / "8" / "ValidateFunction"), str(submit_dir)]
+
+from local import stand_ins
+from local_server import ServerConfig, start_server
+from validation_client import DeadlineExceededError, ValidationClient
+
+
+class Context:
+    "The part of the Lambda context SubmitFunction reads"
+
+    def __init__(self, remaining_ms):
+        self.deadline = time.monotonic() + remaining_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+@pytest.fixture
+def slow_server():
+    # every attempt times out, so without a deadline the client keeps retrying
+    server, url = start_server(ServerConfig(latency="fixed:1500"))
+    yield url
+    server.shutdown()
+
+
+def load_submit_app(url):
+    os.environ.update({
+        "INVOKE_URL": url,
+        "TABLE": "CustomerMetadataTable",
+        "TOPIC": "arn:aws:sns:us-east-1:000000000000:ApplicationNotifications",
+        "QUEUE_URL": "LicenseQueue",
+        "VALIDATION_TIMEOUT": "1",
+        "DEADLINE_MARGIN_MS": "500",
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+    })
+    spec = importlib.util.spec_from_file_location("submit_app", submit_dir / "app.py")
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    app.ddb_table = stand_ins.Table()
+    app.sns = stand_ins.SNS()
+    return app
+
+
+def test_post_gives_up_before_the_deadline(slow_server):
+    client = ValidationClient(slow_server, timeout=1, max_retries=3, backoff_base=0.05)
+    deadline = time.monotonic() + 2.5
+
+    with pytest.raises(DeadlineExceededError):
+        client.post({"driver_license_id": "D00000001", "validation_override": True}, deadline)
+    assert time.monotonic() < deadline
+
+
+def test_post_within_the_deadline_succeeds():
+    server, url = start_server()
+    try:
+        client = ValidationClient(url, timeout=1)
+        response = client.post({"driver_license_id": "D00000001", "validation_override": True}, time.monotonic() + 5)
+    finally:
+        server.shutdown()
+    assert "result" in response
+
+
+def test_handler_reports_unsent_messages_as_batch_item_failures(slow_server):
+    app = load_submit_app(slow_server)
+    records = [
+        {"messageId": f"message-{i}", "body": json.dumps({"driver_license_id": f"D{i:08d}", "validation_override": True, "app_uuid": f"app-{i}"})}
+        for i in range(100)
+    ]
+    context = Context(remaining_ms=3000)
+
+    response = app.lambda_handler({"Records": records}, context)
+
+    assert context.get_remaining_time_in_millis() > 0
+    assert sorted(failure["itemIdentifier"] for failure in response["batchItemFailures"]) == sorted(
+        record["messageId"] for record in records)